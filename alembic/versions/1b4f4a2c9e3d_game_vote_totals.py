@@ -0,0 +1,59 @@
+revision = '1b4f4a2c9e3d'
+down_revision = '89c5cb66426d'
+branch_labels = None
+depends_on = None
+
+import alembic
+import sqlalchemy
+
+def upgrade():
+	# Running totals of `game_votes`, so that reading a game's rating doesn't need
+	# to aggregate every vote. Kept up to date by a trigger on `game_votes`, which
+	# also covers votes being moved around by `merge_games`. No foreign keys: rows
+	# are removed by the trigger when the votes they count are deleted.
+	alembic.op.create_table("game_vote_totals",
+		sqlalchemy.Column("game_id", sqlalchemy.Integer, nullable=False),
+		sqlalchemy.Column("show_id", sqlalchemy.Integer, nullable=False),
+		sqlalchemy.Column("good", sqlalchemy.Integer, nullable=False),
+		sqlalchemy.Column("total", sqlalchemy.Integer, nullable=False),
+	)
+	alembic.op.create_primary_key("game_vote_totals_pk", "game_vote_totals", ["game_id", "show_id"])
+	alembic.op.create_index("game_vote_totals_show_id_idx", "game_vote_totals", ["show_id"])
+
+	alembic.op.execute("""
+		CREATE FUNCTION game_vote_totals_update() RETURNS trigger AS $$
+		BEGIN
+			IF TG_OP = 'UPDATE' OR TG_OP = 'DELETE' THEN
+				UPDATE game_vote_totals
+					SET good = good - OLD.vote::integer, total = total - 1
+					WHERE game_id = OLD.game_id AND show_id = OLD.show_id;
+				DELETE FROM game_vote_totals
+					WHERE game_id = OLD.game_id AND show_id = OLD.show_id AND total <= 0;
+			END IF;
+			IF TG_OP = 'UPDATE' OR TG_OP = 'INSERT' THEN
+				INSERT INTO game_vote_totals (game_id, show_id, good, total)
+					VALUES (NEW.game_id, NEW.show_id, NEW.vote::integer, 1)
+					ON CONFLICT (game_id, show_id) DO UPDATE
+						SET good = game_vote_totals.good + EXCLUDED.good, total = game_vote_totals.total + 1;
+			END IF;
+			RETURN NULL;
+		END
+		$$ LANGUAGE plpgsql
+	""")
+	alembic.op.execute("""
+		CREATE TRIGGER game_vote_totals_update
+			AFTER INSERT OR UPDATE OR DELETE ON game_votes
+			FOR EACH ROW EXECUTE PROCEDURE game_vote_totals_update()
+	""")
+
+	alembic.op.execute("""
+		INSERT INTO game_vote_totals (game_id, show_id, good, total)
+			SELECT game_id, show_id, SUM(vote::integer), COUNT(*)
+			FROM game_votes
+			GROUP BY game_id, show_id
+	""")
+
+def downgrade():
+	alembic.op.execute("DROP TRIGGER game_vote_totals_update ON game_votes")
+	alembic.op.execute("DROP FUNCTION game_vote_totals_update()")
+	alembic.op.drop_table("game_vote_totals")
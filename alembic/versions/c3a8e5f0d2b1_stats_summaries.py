@@ -0,0 +1,58 @@
+revision = 'c3a8e5f0d2b1'
+down_revision = '1b4f4a2c9e3d'
+branch_labels = None
+depends_on = None
+
+import alembic
+import sqlalchemy
+
+def upgrade():
+	# Per-show totals of `game_stats`, for the all-shows view of the stats page.
+	# `games` is the number of `game_stats` rows that make up the total, so that
+	# the row can go away when the last of them does. Like `game_vote_totals`,
+	# this is only ever written by the trigger.
+	alembic.op.create_table("show_stat_totals",
+		sqlalchemy.Column("show_id", sqlalchemy.Integer, nullable=False),
+		sqlalchemy.Column("stat_id", sqlalchemy.Integer, nullable=False),
+		sqlalchemy.Column("count", sqlalchemy.BigInteger, nullable=False),
+		sqlalchemy.Column("games", sqlalchemy.Integer, nullable=False),
+	)
+	alembic.op.create_primary_key("show_stat_totals_pk", "show_stat_totals", ["show_id", "stat_id"])
+	alembic.op.create_index("show_stat_totals_stat_id_idx", "show_stat_totals", ["stat_id"])
+
+	alembic.op.execute("""
+		CREATE FUNCTION show_stat_totals_update() RETURNS trigger AS $$
+		BEGIN
+			IF TG_OP = 'UPDATE' OR TG_OP = 'DELETE' THEN
+				UPDATE show_stat_totals
+					SET count = count - OLD.count, games = games - 1
+					WHERE show_id = OLD.show_id AND stat_id = OLD.stat_id;
+				DELETE FROM show_stat_totals
+					WHERE show_id = OLD.show_id AND stat_id = OLD.stat_id AND games <= 0;
+			END IF;
+			IF TG_OP = 'UPDATE' OR TG_OP = 'INSERT' THEN
+				INSERT INTO show_stat_totals (show_id, stat_id, count, games)
+					VALUES (NEW.show_id, NEW.stat_id, NEW.count, 1)
+					ON CONFLICT (show_id, stat_id) DO UPDATE
+						SET count = show_stat_totals.count + EXCLUDED.count, games = show_stat_totals.games + 1;
+			END IF;
+			RETURN NULL;
+		END
+		$$ LANGUAGE plpgsql
+	""")
+	alembic.op.execute("""
+		CREATE TRIGGER show_stat_totals_update
+			AFTER INSERT OR UPDATE OR DELETE ON game_stats
+			FOR EACH ROW EXECUTE PROCEDURE show_stat_totals_update()
+	""")
+	alembic.op.execute("""
+		INSERT INTO show_stat_totals (show_id, stat_id, count, games)
+			SELECT show_id, stat_id, SUM(count), COUNT(*)
+			FROM game_stats
+			GROUP BY show_id, stat_id
+	""")
+
+def downgrade():
+	alembic.op.execute("DROP TRIGGER show_stat_totals_update ON game_stats")
+	alembic.op.execute("DROP FUNCTION show_stat_totals_update()")
+	alembic.op.drop_table("show_stat_totals")
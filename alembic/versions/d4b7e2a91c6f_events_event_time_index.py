@@ -0,0 +1,12 @@
+revision = 'd4b7e2a91c6f'
+down_revision = 'c3a8e5f0d2b1'
+branch_labels = None
+depends_on = None
+
+import alembic
+
+def upgrade():
+	alembic.op.create_index("events_event_time_idx", "events", ["event", "time"])
+
+def downgrade():
+	alembic.op.drop_index("events_event_time_idx")
@@ -0,0 +1,12 @@
+revision = 'e1f4b8c2d5a7'
+down_revision = 'd4b7e2a91c6f'
+branch_labels = None
+depends_on = None
+
+import alembic
+
+def upgrade():
+	alembic.op.create_index("log_target_time_idx", "log", ["target", "time"])
+
+def downgrade():
+	alembic.op.drop_index("log_target_time_idx")
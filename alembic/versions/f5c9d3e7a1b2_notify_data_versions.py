@@ -0,0 +1,41 @@
+revision = 'f5c9d3e7a1b2'
+down_revision = 'e1f4b8c2d5a7'
+branch_labels = None
+depends_on = None
+
+import alembic
+
+# The groups of tables the web server caches pages by, and the tables that feed
+# into each of them. Any change to one of the tables bumps the group's version.
+DATA_VERSION_GROUPS = {
+	"stats": ["game_stats", "game_vote_totals", "games", "game_per_show_data", "shows", "stats", "disabled_stats"],
+	"quotes": ["quotes", "games", "shows", "game_per_show_data"],
+}
+
+def upgrade():
+	# A group's version is the ID of the last transaction that changed it, which
+	# is announced with a NOTIFY for the web server to pick up. There's no shared
+	# row to update, so writers don't queue up behind each other. Postgres drops
+	# duplicate notifications within a transaction, so each group is announced
+	# once per transaction.
+	alembic.op.execute("""
+		CREATE FUNCTION bump_data_version() RETURNS trigger AS $$
+		BEGIN
+			PERFORM pg_notify('data_versions', TG_ARGV[0] || ' ' || txid_current());
+			RETURN NULL;
+		END
+		$$ LANGUAGE plpgsql
+	""")
+	for group, tables in DATA_VERSION_GROUPS.items():
+		for table in tables:
+			alembic.op.execute("""
+				CREATE TRIGGER %s_bump_%s_version
+					AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %s
+					FOR EACH STATEMENT EXECUTE PROCEDURE bump_data_version('%s')
+			""" % (table, group, table, group))
+
+def downgrade():
+	for group, tables in DATA_VERSION_GROUPS.items():
+		for table in tables:
+			alembic.op.execute("DROP TRIGGER %s_bump_%s_version ON %s" % (table, group, table))
+	alembic.op.execute("DROP FUNCTION bump_data_version()")
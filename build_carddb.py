@@ -7,6 +7,7 @@ formatted to send down the chat.
 
 import sys
 import os
+import asyncio
 import urllib.request
 import urllib.error
 import contextlib
@@ -21,6 +22,7 @@ import sqlalchemy
 
 from common import utils
 import common.postgres
+import common.rpc
 from common.cardname import clean_text
 
 URL = 'http://mtgjson.com/json/AllSets.json.zip'
@@ -139,6 +141,14 @@ def main():
 			{"setid": "UGL", "collector": "29", "cardid": cardid},
 		])
 
+	print("Reloading the bot's card index...")
+	try:
+		asyncio.get_event_loop().run_until_complete(common.rpc.bot.reload_card_index())
+	except utils.PASSTHROUGH_EXCEPTIONS:
+		raise
+	except Exception:
+		print("Couldn't contact the bot, the card index will be rebuilt when it next starts")
+
 def do_download_file(url, fn):
 	"""
 	Download a file, checking that there is a new version of the file on the
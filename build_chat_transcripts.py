@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+import common.postgres
+from common import twitch
+from common import transcripts
+from common.config import config
+
+import datetime
+import dateutil.parser
+import asyncio
+
+engine, metadata = common.postgres.new_engine_and_metadata()
+
+# How long after a video ends before its chat is considered finished
+SETTLE_TIME = datetime.timedelta(minutes=5)
+# How long after a video ends to keep checking its transcript for changes, like
+# chat being cleared after a ban
+RECHECK_PERIOD = datetime.timedelta(days=1)
+
+@asyncio.coroutine
+def main():
+	if not config['chat_transcript_dir']:
+		print("chat_transcript_dir is not set.")
+		return
+
+	log = metadata.tables["log"]
+	now = datetime.datetime.now(datetime.timezone.utc)
+	videos = yield from twitch.get_videos(broadcasts=True, limit=100)
+	for video in videos:
+		if video.get("status") == "recording":
+			continue
+		start = dateutil.parser.parse(video["recorded_at"])
+		end = start + datetime.timedelta(seconds=video["length"])
+		if end + transcripts.AFTER_BUFFER + SETTLE_TIME > now:
+			continue
+		index = transcripts.load_index(video["_id"])
+		if index is not None and end + RECHECK_PERIOD < now and not transcripts.is_stale(index):
+			continue
+		with engine.begin() as conn:
+			transcripts.build(conn, log, video["_id"], start, end)
+
+if __name__ == '__main__':
+	asyncio.get_event_loop().run_until_complete(main())
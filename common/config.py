@@ -68,12 +68,33 @@ config['timezone'] = pytz.timezone(config.get('timezone', 'America/Vancouver'))
 config.setdefault('socket_filename', 'lrrbot.sock')
 # eventsocket - Filename for the UDS channel that the webserver uses to communicate with SSE clients
 config.setdefault('eventsocket', "/tmp/eventserver.sock")
+# header_snapshot - File the bot keeps the current website header information in, for the webserver to read
+config.setdefault('header_snapshot', "/tmp/lrrbot-header.json")
+# chat_transcript_dir - Directory build_chat_transcripts.py writes the chat transcripts of finished
+# videos to. If not set, they're not built and the archive pages query the chat log instead.
+config.setdefault('chat_transcript_dir', None)
+# chat_transcript_url - URL the front-end web server serves chat_transcript_dir at. The chunks are
+# only stored gzipped, so it needs to decompress them for clients that can't take them that way
+# (for nginx, "gzip_static always" and "gunzip on").
+config.setdefault('chat_transcript_url', '/transcripts')
+# www_loop_thread - boolean option, whether each webserver worker keeps its event loop running in a
+# background thread, rather than only running it while a request is being handled. Needs uWSGI's
+# enable-threads.
+config.setdefault('www_loop_thread', False)
+config['www_loop_thread'] = str(config['www_loop_thread']).lower() != 'false'
 
 # socket_port - TCP port to use when Unix domain sockets are not available.
 config['socket_port'] = int(config.get('socket_port', 49601))
 # event_port - TCP port to use when Unix domain sockets are not available.
 config['event_port'] = int(config.get('event_port', 49602))
 
+# eventserver_port - HTTP port the event server serves clients on
+config['eventserver_port'] = int(config.get('eventserver_port', 8080))
+# eventserver_notify - boolean option, whether events are fanned out through Postgres NOTIFY, so
+# that several event server processes can serve clients at once
+config.setdefault('eventserver_notify', False)
+config['eventserver_notify'] = str(config['eventserver_notify']).lower() != 'false'
+
 # google_key - Google API key
 config.setdefault('google_key', '')
 
@@ -142,3 +142,7 @@ def stat_plural(stats, count):
 			else_=plural,
 		)
 	return plural
+
+def vote_rating(game_vote_totals):
+	" The percentage of good votes, from a row of `game_vote_totals` "
+	return 100 * sqlalchemy.cast(game_vote_totals.c.good, sqlalchemy.Numeric) / game_vote_totals.c.total
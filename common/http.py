@@ -1,7 +1,11 @@
 import asyncio
 import atexit
+import collections
 import json
 import logging
+import re
+import time
+import urllib.error
 import urllib.parse
 import urllib.request
 
@@ -12,6 +16,88 @@ from common import utils
 
 log = logging.getLogger("common.http")
 
+# How many responses `cache` keeps
+CACHE_SIZE = 256
+
+re_max_age = re.compile(r"(?:^|,)\s*max-age\s*=\s*(\d+)", re.IGNORECASE)
+re_stale_while_revalidate = re.compile(r"(?:^|,)\s*stale-while-revalidate\s*=\s*(\d+)", re.IGNORECASE)
+re_no_store = re.compile(r"(?:^|,)\s*(?:no-store|private)\b", re.IGNORECASE)
+re_no_cache = re.compile(r"(?:^|,)\s*no-cache\b", re.IGNORECASE)
+
+class CacheEntry:
+	def __init__(self, body, headers, max_stale):
+		self.body = body
+		self.etag = None
+		self.last_modified = None
+		self.revalidating = False
+		self.update(headers, max_stale)
+
+	def update(self, headers, max_stale):
+		"""Update the validators and lifetime from a 200 or 304 response."""
+		self.etag = headers.get('ETag', self.etag)
+		self.last_modified = headers.get('Last-Modified', self.last_modified)
+		cache_control = headers.get('Cache-Control', '')
+		max_age = re_max_age.search(cache_control)
+		stale = re_stale_while_revalidate.search(cache_control)
+		now = time.time()
+		if re_no_cache.search(cache_control):
+			self.fresh_until = self.stale_until = now
+			return
+		self.fresh_until = now + (int(max_age.group(1)) if max_age else 0)
+		self.stale_until = self.fresh_until + max(max_stale, int(stale.group(1)) if stale else 0)
+
+	def conditional_headers(self):
+		headers = {}
+		if self.etag is not None:
+			headers['If-None-Match'] = self.etag
+		if self.last_modified is not None:
+			headers['If-Modified-Since'] = self.last_modified
+		return headers
+
+class HTTPCache:
+	"""
+	Cache of GET responses, used by `request` and `request_coro`.
+
+	A response is reused without asking the server for as long as its
+	`Cache-Control: max-age` allows. After that it's revalidated with
+	`If-None-Match`/`If-Modified-Since`, so an unchanged resource costs a 304
+	rather than the whole body. For up to `max_stale` seconds past that (or the
+	response's own `stale-while-revalidate`), `request_coro` returns the old
+	body straight away and revalidates in the background.
+
+	Responses without an `ETag` or `Last-Modified` header, or with `no-store`,
+	aren't kept.
+	"""
+	def __init__(self, size=CACHE_SIZE):
+		self.size = size
+		self.entries = collections.OrderedDict()
+
+	def key(self, url, params, headers):
+		if params:
+			if not isinstance(params, str):
+				params = urllib.parse.urlencode(sorted(params.items()))
+			url = '%s?%s' % (url, params)
+		return url, tuple(sorted((k.lower(), v) for k, v in headers.items() if k.lower() != 'user-agent'))
+
+	def get(self, key):
+		entry = self.entries.get(key)
+		if entry is not None:
+			self.entries.move_to_end(key)
+		return entry
+
+	def store(self, key, body, headers, max_stale):
+		if re_no_store.search(headers.get('Cache-Control', '')):
+			self.entries.pop(key, None)
+			return
+		if 'ETag' not in headers and 'Last-Modified' not in headers and not re_max_age.search(headers.get('Cache-Control', '')):
+			return
+		self.entries[key] = CacheEntry(body, headers, max_stale)
+		self.entries.move_to_end(key)
+		while len(self.entries) > self.size:
+			self.entries.popitem(last=False)
+
+cache = HTTPCache()
+
 class Request(urllib.request.Request):
 	"""Override the get_method method of Request, adding the "method" field that doesn't exist until Python 3.3"""
 	def __init__(self, *args, method=None, **kwargs):
@@ -23,10 +109,25 @@ class Request(urllib.request.Request):
 		else:
 			return super().get_method()
 
-def request(url, data=None, method='GET', maxtries=3, headers={}, timeout=5, **kwargs):
-	"""Download a webpage, with retries on failure."""
+def request(url, data=None, method='GET', maxtries=3, headers={}, timeout=5, max_stale=0, **kwargs):
+	"""
+	Download a webpage, with retries on failure.
+
+	GET requests go through `cache`. There's nothing to revalidate stale
+	responses in the background with here, so `max_stale` is only there for
+	symmetry with `request_coro` and stale responses are always revalidated.
+	"""
 	# Let's be nice.
 	headers["User-Agent"] = "LRRbot/2.0 (https://lrrbot.mrphlip.com/)"
+	if method == 'GET':
+		key = cache.key(url, data, headers)
+		entry = cache.get(key)
+		if entry is not None:
+			if entry.fresh_until > time.time():
+				return entry.body
+			headers = dict(headers, **entry.conditional_headers())
+	else:
+		key = entry = None
 	if data:
 		if isinstance(data, dict):
 			data = urllib.parse.urlencode(data)
@@ -43,10 +144,17 @@ def request(url, data=None, method='GET', maxtries=3, headers={}, timeout=5, **k
 	firstex = None
 	while True:
 		try:
-			return urllib.request.urlopen(req, timeout=timeout).read().decode("utf-8")
+			res = urllib.request.urlopen(req, timeout=timeout)
+			body = res.read().decode("utf-8")
+			if key is not None:
+				cache.store(key, body, res.headers, max_stale)
+			return body
 		except utils.PASSTHROUGH_EXCEPTIONS:
 			raise
 		except Exception as e:
+			if isinstance(e, urllib.error.HTTPError) and e.code == 304 and entry is not None:
+				entry.update(e.headers, max_stale)
+				return entry.body
 			maxtries -= 1
 			if firstex is None:
 				firstex = e
@@ -60,8 +168,59 @@ def request(url, data=None, method='GET', maxtries=3, headers={}, timeout=5, **k
 http_request_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=6))
 atexit.register(lambda: asyncio.get_event_loop().run_until_complete(http_request_session.close()))
 @asyncio.coroutine
-def request_coro(url, data=None, method='GET', maxtries=3, headers={}, timeout=5, allow_redirects=True):
+def request_coro(url, data=None, method='GET', maxtries=3, headers={}, timeout=5, allow_redirects=True, return_headers=False, max_stale=0):
+	"""
+	Download a webpage, with retries on failure.
+
+	GET requests go through `cache`, and a response up to `max_stale` seconds
+	out of date is returned immediately while it's revalidated in the
+	background.
+
+	If `return_headers` is set, returns the response headers along with the body.
+	"""
 	headers["User-Agent"] = "LRRbot/2.0 (https://lrrbot.mrphlip.com/)"
+	if method == 'GET' and not return_headers:
+		key = cache.key(url, data, headers)
+		entry = cache.get(key)
+		if entry is not None:
+			now = time.time()
+			if entry.fresh_until > now:
+				return entry.body
+			if entry.stale_until > now:
+				if not entry.revalidating:
+					entry.revalidating = True
+					asyncio.ensure_future(revalidate(key, entry, url, data, headers, timeout, max_stale)).add_done_callback(utils.check_exception)
+				return entry.body
+			return (yield from fetch_coro(key, entry, url, data, headers, maxtries, timeout, allow_redirects, max_stale))
+		return (yield from fetch_coro(key, None, url, data, headers, maxtries, timeout, allow_redirects, max_stale))
+	return (yield from _request_coro(url, data, method, maxtries, headers, timeout, allow_redirects, return_headers))
+
+async def revalidate(key, entry, url, data, headers, timeout, max_stale):
+	try:
+		await fetch_coro(key, entry, url, data, headers, 1, timeout, True, max_stale)
+	except utils.PASSTHROUGH_EXCEPTIONS:
+		raise
+	except Exception as e:
+		log.info("Revalidating %s failed: %s: %s", url, e.__class__.__name__, e)
+	finally:
+		entry.revalidating = False
+
+async def fetch_coro(key, entry, url, data, headers, maxtries, timeout, allow_redirects, max_stale):
+	"""Fetch a GET request, revalidating `entry` if there is one, and update the cache."""
+	if entry is not None:
+		headers = dict(headers, **entry.conditional_headers())
+	try:
+		body, response_headers = await _request_coro(url, data, 'GET', maxtries, headers, timeout, allow_redirects, True)
+	except urllib.error.HTTPError as e:
+		if e.code == 304 and entry is not None:
+			entry.update(e.headers, max_stale)
+			return entry.body
+		raise
+	cache.store(key, body, response_headers, max_stale)
+	return body
+
+@asyncio.coroutine
+def _request_coro(url, data, method, maxtries, headers, timeout, allow_redirects, return_headers):
 	firstex = None
 
 	# FIXME(#130): aiohttp fails to decode HEAD requests with Content-Encoding set. Do GET requests instead.
@@ -83,12 +242,14 @@ def request_coro(url, data=None, method='GET', maxtries=3, headers={}, timeout=5
 			status_class = res.status // 100
 			if status_class != 2:
 				yield from res.read()
-				if status_class == 4:
+				if status_class == 4 or res.status == 304:
 					maxtries = 1
 				yield from res.release()
 				raise urllib.error.HTTPError(res.url, res.status, res.reason, res.headers, None)
 			text = yield from res.text()
 			yield from res.release()
+			if return_headers:
+				return text, res.headers
 			return text
 		except utils.PASSTHROUGH_EXCEPTIONS:
 			raise
@@ -1,7 +1,11 @@
 import aiomas
 import asyncio
+import bisect
+import contextlib
 import datetime
 import logging
+import time
+import traceback
 import pytz
 
 from common import utils
@@ -18,6 +22,9 @@ EXTRA_SERIALIZERS = [
 	lambda: (datetime.datetime, lambda t: t.timestamp(), lambda t: datetime.datetime.fromtimestamp(t, pytz.utc))
 ]
 
+# Upper bounds, in seconds, of the buckets in the RPC latency histograms
+LATENCY_BUCKETS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5]
+
 class Server:
 	def __init__(self):
 		self.__server = None
@@ -36,7 +43,56 @@ class Server:
 	async def close(self):
 		self.__server.close()
 		await self.__server.wait_closed()
-		await asyncio.gather(client.close() for client in self.__clients)
+		await asyncio.gather(*[client.close() for client in self.__clients])
+
+	@aiomas.expose
+	async def batch(self, calls):
+		"""
+		Run several calls, sent as `(path, args, kwargs)`, in order and return
+		`(True, result)` or `(False, traceback)` for each of them.
+		"""
+		results = []
+		for path, args, kwargs in calls:
+			try:
+				func = self
+				for key in path:
+					func = getattr(func, key)
+				if not getattr(func, '__rpc__', False):
+					raise LookupError("%s is not exposed" % '.'.join(path))
+				result = func(*args, **kwargs)
+				if asyncio.iscoroutine(result) or isinstance(result, asyncio.Future):
+					result = await result
+			except utils.PASSTHROUGH_EXCEPTIONS:
+				raise
+			except Exception:
+				results.append((False, traceback.format_exc()))
+			else:
+				results.append((True, result))
+		return results
+
+class LatencyHistogram:
+	"""Counts of how long calls took, bucketed by `LATENCY_BUCKETS`."""
+	def __init__(self):
+		self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+		self.errors = 0
+		self.total = 0
+
+	def add(self, duration, error=False):
+		self.counts[bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+		self.total += duration
+		if error:
+			self.errors += 1
+
+	def snapshot(self):
+		return {
+			"buckets": [
+				{"le": le, "count": count}
+				for le, count in zip(LATENCY_BUCKETS + [None], self.counts)
+			],
+			"count": sum(self.counts),
+			"errors": self.errors,
+			"total": self.total,
+		}
 
 class Proxy:
 	def __init__(self, client, path):
@@ -47,22 +103,69 @@ class Proxy:
 		return Proxy(self.__client, self.__path + [key])
 
 	async def __call__(self, *args, **kwargs):
-		for _ in range(3):
-			try:
-				await self.__client.connect()
-				node = self.__client._connection.remote
-				for key in self.__path:
-					node = getattr(node, key)
-				return await node(*args, **kwargs)
-			except ConnectionResetError:
-				await asyncio.sleep(1)
-		raise ConnectionResetError
+		with self.__client.timed('.'.join(self.__path)):
+			return await self.__client.call(self.__path, args, kwargs)
+
+class Batch:
+	"""
+	Several calls to be sent to the server in one message.
+
+	Calling a method on the batch queues it up instead of sending it, and
+	`execute` sends them all and returns their results in order:
+
+		batch = common.rpc.bot.batch()
+		batch.get_game_id()
+		batch.get_show_id()
+		game_id, show_id = await batch.execute()
+
+	If any of the calls failed, `execute` raises the first error once all of
+	them have run.
+	"""
+	def __init__(self, client):
+		self.client = client
+		self.calls = []
+
+	def __getattr__(self, key):
+		return BatchProxy(self, [key])
+
+	async def execute(self):
+		calls, self.calls = self.calls, []
+		if not calls:
+			return []
+		# Each call in the batch gets a sample in its own method's histogram, with
+		# how long the whole batch took
+		start = time.perf_counter()
+		try:
+			results = await self.client.call(['batch'], ([list(call) for call in calls], ), {})
+		except BaseException:
+			for path, args, kwargs in calls:
+				self.client.record('.'.join(path), time.perf_counter() - start, True)
+			raise
+		duration = time.perf_counter() - start
+		for (path, args, kwargs), (success, result) in zip(calls, results):
+			self.client.record('.'.join(path), duration, not success)
+		for (path, args, kwargs), (success, result) in zip(calls, results):
+			if not success:
+				raise aiomas.RemoteException('.'.join(path), result)
+		return [result for success, result in results]
+
+class BatchProxy:
+	def __init__(self, batch, path):
+		self.__batch = batch
+		self.__path = path
+
+	def __getattr__(self, key):
+		return BatchProxy(self.__batch, self.__path + [key])
+
+	def __call__(self, *args, **kwargs):
+		self.__batch.calls.append((self.__path, args, kwargs))
 
 class Client:
 	def __init__(self, path, port):
 		self._connection = None
 		self.__path = path
 		self.__port = port
+		self.__latency = {}
 
 	def __unset_connection(self, exc):
 		self._connection = None
@@ -80,8 +183,96 @@ class Client:
 		if self._connection is not None:
 			await self._connection.close()
 
+	async def call(self, path, args, kwargs):
+		for _ in range(3):
+			try:
+				await self.connect()
+				node = self._connection.remote
+				for key in path:
+					node = getattr(node, key)
+				return await node(*args, **kwargs)
+			except ConnectionResetError:
+				await asyncio.sleep(1)
+		raise ConnectionResetError
+
+	@contextlib.contextmanager
+	def timed(self, name):
+		start = time.perf_counter()
+		error = False
+		try:
+			yield
+		except BaseException:
+			error = True
+			raise
+		finally:
+			self.record(name, time.perf_counter() - start, error)
+
+	def record(self, name, duration, error=False):
+		"""Add a call to `name` that took `duration` seconds to its histogram."""
+		histogram = self.__latency.get(name)
+		if histogram is None:
+			histogram = self.__latency[name] = LatencyHistogram()
+		histogram.add(duration, error)
+
+	def batch(self):
+		"""Start a `Batch` of calls to send together."""
+		return Batch(self)
+
+	def get_metrics(self):
+		"""Latency histograms of the calls made through this client, by method."""
+		return {name: histogram.snapshot() for name, histogram in self.__latency.items()}
+
 	def __getattr__(self, key):
 		return Proxy(self, [key])
 
+class EventPublisher:
+	"""
+	Sends events to the event server over its persistent RPC connection.
+
+	Events are buffered for up to `delay` seconds (or until there are `max_batch`
+	of them) and sent as one batch, so that a burst of events, like a gifted sub
+	bomb, is one round trip and one INSERT instead of one each.
+	"""
+	def __init__(self, client, delay=0.05, max_batch=100):
+		self.client = client
+		self.delay = delay
+		self.max_batch = max_batch
+		self.pending = []
+		self.flusher = None
+
+	async def publish(self, event, data, time=None):
+		"""Send an event. Returns its ID once the event server has stored it."""
+		future = asyncio.Future()
+		self.pending.append((event, data, time, future))
+		if len(self.pending) >= self.max_batch:
+			if self.flusher is not None:
+				self.flusher.cancel()
+			self.flusher = None
+			asyncio.ensure_future(self.flush())
+		elif self.flusher is None:
+			self.flusher = asyncio.ensure_future(self.flush_later())
+		return await future
+
+	async def flush_later(self):
+		await asyncio.sleep(self.delay)
+		self.flusher = None
+		await self.flush()
+
+	async def flush(self):
+		batch, self.pending = self.pending, []
+		if not batch:
+			return
+		try:
+			ids = await self.client.events([(event, data, time) for event, data, time, future in batch])
+		except Exception as e:
+			for event, data, time, future in batch:
+				if not future.done():
+					future.set_exception(e)
+		else:
+			for (event, data, time, future), id in zip(batch, ids):
+				if not future.done():
+					future.set_result(id)
+
 bot = Client(config['socket_filename'], config['socket_port'])
 eventserver = Client(config['eventsocket'], config['event_port'])
+events = EventPublisher(eventserver)
@@ -1,10 +1,17 @@
 import datetime
-import sqlalchemy
 from sqlalchemy.dialects.postgresql import insert
 
 from common.config import config
 
 def increment(engine, metadata, counter, by=1):
+	"""
+	Add `by` to one of today's storm counters directly in the database. Returns
+	the new count.
+
+	The bot normally keeps the storm counts (see `lrrbot.stormcounter`), so this
+	is only for when it can't be reached. It only ever writes increments, so
+	nothing's lost, but the bot won't see the change until the next day.
+	"""
 	storm = metadata.tables['storm']
 	with engine.begin() as conn:
 		query = insert(storm).returning(storm.c[counter])
@@ -19,26 +26,3 @@ def increment(engine, metadata, counter, by=1):
 			counter: by,
 		}).first()
 	return count
-
-def get(engine, metadata, counter):
-	storm = metadata.tables['storm']
-	with engine.begin() as conn:
-		row = conn.execute(sqlalchemy.select([storm.c[counter]])
-			.where(storm.c.date == datetime.datetime.now(config['timezone']).date())) \
-			.first()
-	if row is not None:
-		return row[0]
-	return 0
-
-COMBINED_COUNTERS = ['twitch-subscription', 'twitch-resubscription', 'patreon-pledge']
-def get_combined(engine, metadata):
-	combined_count = 0
-	storm = metadata.tables['storm']
-	with engine.begin() as conn:
-		for counter in COMBINED_COUNTERS:
-			row = conn.execute(sqlalchemy.select([storm.c[counter]])
-				.where(storm.c.date == datetime.datetime.now(config['timezone']).date())) \
-				.first()
-			if row is not None:
-				combined_count += row[0]
-	return combined_count
@@ -0,0 +1,84 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+import aiomas
+
+import common.rpc
+
+class StandInServer(common.rpc.Server):
+	router = aiomas.rpc.Service()
+
+	def __init__(self):
+		super().__init__()
+		self.calls = []
+
+	@aiomas.expose
+	def add(self, a, b):
+		self.calls.append("add")
+		return a + b
+
+	@aiomas.expose
+	async def fail(self):
+		self.calls.append("fail")
+		raise ValueError("failed on purpose")
+
+	def hidden(self):
+		self.calls.append("hidden")
+
+class TestBatch(unittest.TestCase):
+	def setUp(self):
+		self.loop = asyncio.new_event_loop()
+		asyncio.set_event_loop(self.loop)
+		self.dir = tempfile.TemporaryDirectory()
+		path = os.path.join(self.dir.name, "rpc.sock")
+		self.server = StandInServer()
+		self.loop.run_until_complete(self.server.start(path, 0))
+		self.client = common.rpc.Client(path, 0)
+
+	def tearDown(self):
+		self.loop.run_until_complete(self.client.close())
+		self.loop.run_until_complete(self.server.close())
+		self.loop.close()
+		self.dir.cleanup()
+
+	def test_results_in_order(self):
+		batch = self.client.batch()
+		batch.add(1, 2)
+		batch.add(a=3, b=4)
+		self.assertEqual(self.loop.run_until_complete(batch.execute()), [3, 7])
+
+	def test_empty(self):
+		self.assertEqual(self.loop.run_until_complete(self.client.batch().execute()), [])
+
+	def test_failing_call(self):
+		batch = self.client.batch()
+		batch.add(1, 2)
+		batch.fail()
+		batch.add(3, 4)
+		with self.assertRaises(aiomas.RemoteException) as cm:
+			self.loop.run_until_complete(batch.execute())
+		self.assertIn("failed on purpose", cm.exception.remote_traceback)
+		# The calls after the failing one still run
+		self.assertEqual(self.server.calls, ["add", "fail", "add"])
+
+	def test_unexposed_method(self):
+		batch = self.client.batch()
+		batch.hidden()
+		with self.assertRaises(aiomas.RemoteException):
+			self.loop.run_until_complete(batch.execute())
+		self.assertEqual(self.server.calls, [])
+
+	def test_metrics(self):
+		batch = self.client.batch()
+		batch.add(1, 2)
+		batch.fail()
+		with self.assertRaises(aiomas.RemoteException):
+			self.loop.run_until_complete(batch.execute())
+		metrics = self.client.get_metrics()
+		self.assertEqual(sorted(metrics), ["add", "fail"])
+		self.assertEqual(metrics["add"]["count"], 1)
+		self.assertEqual(metrics["add"]["errors"], 0)
+		self.assertEqual(metrics["fail"]["count"], 1)
+		self.assertEqual(metrics["fail"]["errors"], 1)
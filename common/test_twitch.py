@@ -0,0 +1,128 @@
+import asyncio
+import time
+import unittest
+
+import aiohttp.web
+
+from common import twitch
+
+class StandInTwitch:
+	"""
+	A local stand-in for the bits of the Twitch API that `TwitchClient` is used
+	for, which counts the requests it gets.
+	"""
+	def __init__(self, loop):
+		self.loop = loop
+		self.hits = {}
+		self.delay = 0
+		self.ratelimit = None
+		self.fail_next = None
+		self.live = True
+
+	async def start(self):
+		app = aiohttp.web.Application()
+		app.router.add_route('GET', '/kraken/streams/{name}', self.streams)
+		app.router.add_route('GET', '/kraken/channels/{name}', self.channels)
+		app.router.add_route('GET', '/kraken/users/{name}', self.users)
+		self.handler = app.make_handler()
+		self.server = await self.loop.create_server(self.handler, '127.0.0.1', 0)
+		return "http://127.0.0.1:%d/kraken/" % self.server.sockets[0].getsockname()[1]
+
+	async def stop(self):
+		self.server.close()
+		await self.server.wait_closed()
+		await self.handler.finish_connections(1)
+
+	async def respond(self, request, data):
+		self.hits[request.path] = self.hits.get(request.path, 0) + 1
+		headers = {}
+		if self.ratelimit is not None:
+			remaining, reset = self.ratelimit
+			headers['Ratelimit-Remaining'] = str(remaining)
+			headers['Ratelimit-Reset'] = str(reset)
+		if self.fail_next is not None:
+			status, self.fail_next = self.fail_next, None
+			return aiohttp.web.Response(status=status, headers=headers)
+		if self.delay:
+			await asyncio.sleep(self.delay)
+		return aiohttp.web.json_response(data, headers=headers)
+
+	async def streams(self, request):
+		name = request.match_info['name']
+		if self.live:
+			stream = {'channel': {'name': name, 'game': "Lost Odyssey"}, 'viewers': 10, 'created_at': "2017-01-01T00:00:00Z"}
+		else:
+			stream = None
+		return await self.respond(request, {'stream': stream})
+
+	async def channels(self, request):
+		return await self.respond(request, {'name': request.match_info['name'], 'game': "Lost Odyssey"})
+
+	async def users(self, request):
+		return await self.respond(request, {'_id': 1, 'name': request.match_info['name']})
+
+class TestTwitchClient(unittest.TestCase):
+	def setUp(self):
+		self.loop = asyncio.get_event_loop()
+		self.twitch = StandInTwitch(self.loop)
+		root = self.loop.run_until_complete(self.twitch.start())
+		self.client = twitch.TwitchClient(root)
+		self.old_client, twitch.client = twitch.client, self.client
+
+	def tearDown(self):
+		twitch.client = self.old_client
+		self.loop.run_until_complete(self.twitch.stop())
+
+	def run_coro(self, coro):
+		return self.loop.run_until_complete(coro)
+
+	def test_coalesce(self):
+		self.twitch.delay = 0.1
+		first, second = self.run_coro(asyncio.gather(
+			self.client.request("users", "users/loadingreadyrun"),
+			self.client.request("users", "users/loadingreadyrun"),
+		))
+		self.assertEqual(first, {'_id': 1, 'name': "loadingreadyrun"})
+		self.assertEqual(first, second)
+		self.assertIsNot(first, second)
+		self.assertEqual(self.twitch.hits, {'/kraken/users/loadingreadyrun': 1})
+
+	def test_no_coalesce_after_response(self):
+		self.run_coro(self.client.request("users", "users/loadingreadyrun"))
+		self.run_coro(self.client.request("users", "users/loadingreadyrun"))
+		self.assertEqual(self.twitch.hits, {'/kraken/users/loadingreadyrun': 2})
+
+	def test_ratelimit(self):
+		self.twitch.ratelimit = (0, time.time() + 0.5)
+		self.run_coro(self.client.request("users", "users/a"))
+		start = time.time()
+		self.run_coro(self.client.request("users", "users/b"))
+		self.assertGreaterEqual(time.time() - start, 0.4)
+
+	def test_retry_after_429(self):
+		self.twitch.ratelimit = (0, time.time() + 0.2)
+		self.twitch.fail_next = 429
+		self.assertEqual(self.run_coro(self.client.request("users", "users/a")), {'_id': 1, 'name': "a"})
+		self.assertEqual(self.twitch.hits, {'/kraken/users/a': 2})
+
+	def test_metrics(self):
+		self.run_coro(self.client.request("users", "users/a"))
+		self.run_coro(self.client.request("users", "users/b"))
+		self.twitch.fail_next = 404
+		with self.assertRaises(Exception):
+			self.run_coro(self.client.request("users", "users/c"))
+		metrics = self.client.get_metrics()
+		self.assertEqual(metrics['users']['count'], 3)
+		self.assertEqual(metrics['users']['errors'], 1)
+		self.assertLessEqual(metrics['users']['p50'], metrics['users']['max'])
+
+	def test_get_info_live(self):
+		info = self.run_coro(twitch.get_info_uncached_coro("loadingreadyrun"))
+		self.assertTrue(info['live'])
+		self.assertEqual(info['viewers'], 10)
+
+	def test_get_info_offline(self):
+		self.twitch.live = False
+		info = self.run_coro(twitch.get_info_uncached_coro("loadingreadyrun"))
+		self.assertFalse(info['live'])
+		self.assertIsNone(self.run_coro(twitch.get_info_uncached_coro("loadingreadyrun", use_fallback=False)))
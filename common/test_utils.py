@@ -0,0 +1,54 @@
+import collections
+import random
+import unittest
+
+from common import utils
+
+class TestWeightedSet(unittest.TestCase):
+	def setUp(self):
+		random.seed(0)
+
+	def sample(self, options, n=20000):
+		return collections.Counter(options.choice() for _ in range(n))
+
+	def test_empty(self):
+		with self.assertRaises(ValueError):
+			utils.WeightedSet().choice()
+
+	def test_weights(self):
+		options = utils.WeightedSet([("foo", 2), ("bar", 1)])
+		counts = self.sample(options)
+		self.assertEqual(set(counts), {"foo", "bar"})
+		self.assertAlmostEqual(counts["foo"] / counts["bar"], 2, delta=0.2)
+
+	def test_reweight(self):
+		options = utils.WeightedSet([("foo", 1), ("bar", 1)])
+		options.set("foo", 3)
+		counts = self.sample(options)
+		self.assertAlmostEqual(counts["foo"] / counts["bar"], 3, delta=0.3)
+
+	def test_remove(self):
+		options = utils.WeightedSet((i, 1) for i in range(10))
+		for i in range(0, 10, 2):
+			options.remove(i)
+		options.set(1, 0)
+		self.assertEqual(len(options), 4)
+		self.assertNotIn(1, options)
+		self.assertEqual(set(self.sample(options, 2000)), {3, 5, 7, 9})
+
+	def test_reuse_holes(self):
+		options = utils.WeightedSet((i, 1) for i in range(5))
+		options.remove(2)
+		options.set("new", 1)
+		self.assertEqual(len(options.options), 5)
+		self.assertEqual(set(self.sample(options, 2000)), {0, 1, 3, 4, "new"})
+
+	def test_many(self):
+		options = utils.WeightedSet()
+		for i in range(100):
+			options.set(i, i % 3)
+		counts = self.sample(options, 50000)
+		self.assertFalse(any(i % 3 == 0 for i in counts))
+		ones = sum(count for i, count in counts.items() if i % 3 == 1)
+		twos = sum(count for i, count in counts.items() if i % 3 == 2)
+		self.assertAlmostEqual(twos / ones, 2, delta=0.15)
@@ -0,0 +1,118 @@
+import datetime
+import gzip
+import json
+import os
+import time
+
+import sqlalchemy
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+
+from common.config import config
+
+# How much chat, in seconds of video, is in each chunk of a transcript
+CHUNK_LENGTH = 120
+
+# How much chat from before and after the video to include
+BEFORE_BUFFER = datetime.timedelta(minutes=15)
+AFTER_BUFFER = datetime.timedelta(minutes=15)
+
+# Name of the file that marks every transcript as needing to be checked again
+STALE_MARKER = "stale"
+
+def get_chunk_range(start, end):
+	"""The first and last chunks with chat for a video from `start` to `end`."""
+	chunk_length = datetime.timedelta(seconds=CHUNK_LENGTH)
+	# Round away from the video, so the first chunk covers all of the buffer
+	return -BEFORE_BUFFER // chunk_length, (end + AFTER_BUFFER - start) // chunk_length
+
+def get_chunk_times(start, chunk):
+	starttime = start + chunk * datetime.timedelta(seconds=CHUNK_LENGTH)
+	return starttime, starttime + datetime.timedelta(seconds=CHUNK_LENGTH)
+
+def get_chat(conn, log, starttime, endtime, target="#loadingreadyrun"):
+	"""Get the chat messages from `starttime` (inclusive) to `endtime` (exclusive)."""
+	res = conn.execute(sqlalchemy.select([log.c.messagehtml])
+		.where((log.c.target == target) & (log.c.time >= starttime) & (log.c.time < endtime))
+		.order_by(log.c.time.asc()))
+	return [message for (message,) in res]
+
+def get_fingerprints(conn, log, start, end, target="#loadingreadyrun"):
+	"""
+	Get a hash of the chat in each chunk of a video that has any, so that chunks
+	that have changed can be found without fetching them.
+	"""
+	first, last = get_chunk_range(start, end)
+	chunk = sqlalchemy.func.floor(sqlalchemy.extract('epoch', log.c.time - start) / CHUNK_LENGTH)
+	res = conn.execute(sqlalchemy.select([
+			chunk,
+			sqlalchemy.func.md5(sqlalchemy.func.string_agg(log.c.messagehtml, aggregate_order_by(sqlalchemy.literal(''), log.c.time))),
+		]).where((log.c.target == target)
+			& (log.c.time >= get_chunk_times(start, first)[0])
+			& (log.c.time < get_chunk_times(start, last)[1]))
+		.group_by(chunk))
+	return {int(chunk): fingerprint for chunk, fingerprint in res}
+
+def get_path(videoid, filename):
+	return os.path.join(config['chat_transcript_dir'], videoid, filename)
+
+def load_index(videoid):
+	"""Get the index of a video's transcript, or `None` if there isn't one."""
+	if not config['chat_transcript_dir']:
+		return None
+	try:
+		with open(get_path(videoid, "index.json")) as fp:
+			return json.load(fp)
+	except FileNotFoundError:
+		return None
+
+def write_file(filename, data, compress=False):
+	# Write to a temporary file and rename it over the old one, so the web server
+	# never sees half a file
+	tmpfilename = filename + ".tmp"
+	with (gzip.open if compress else open)(tmpfilename, "wt") as fp:
+		json.dump(data, fp)
+	os.replace(tmpfilename, filename)
+
+def is_stale(index):
+	"""Whether a transcript was built before the chat log was last rebuilt."""
+	try:
+		return os.stat(os.path.join(config['chat_transcript_dir'], STALE_MARKER)).st_mtime >= index['built']
+	except FileNotFoundError:
+		return False
+
+def mark_stale():
+	"""Have every transcript checked again, for after the chat log has been changed."""
+	if config['chat_transcript_dir']:
+		with open(os.path.join(config['chat_transcript_dir'], STALE_MARKER), "w"):
+			pass
+
+def build(conn, log, videoid, start, end):
+	"""
+	Write the transcript of a video, as a gzipped JSON file for each chunk that has
+	any chat and an index of them. Chunks that are the same as in the existing
+	transcript are left alone.
+	"""
+	index = load_index(videoid) or {"chunks": {}}
+	built = time.time()
+	fingerprints = {str(chunk): fingerprint for chunk, fingerprint in get_fingerprints(conn, log, start, end).items()}
+	os.makedirs(os.path.join(config['chat_transcript_dir'], videoid), exist_ok=True)
+	for chunk, fingerprint in fingerprints.items():
+		if index['chunks'].get(chunk) == fingerprint:
+			continue
+		starttime, endtime = get_chunk_times(start, int(chunk))
+		write_file(get_path(videoid, "%s.json.gz" % chunk), {
+			"chunk": int(chunk),
+			"start": starttime.timestamp(),
+			"end": endtime.timestamp(),
+			"chat": get_chat(conn, log, starttime, endtime),
+		}, compress=True)
+	for chunk in index['chunks'].keys() - fingerprints.keys():
+		os.unlink(get_path(videoid, "%s.json.gz" % chunk))
+	first, last = get_chunk_range(start, end)
+	write_file(get_path(videoid, "index.json"), {
+		"chunk_length": CHUNK_LENGTH,
+		"first_chunk": first,
+		"last_chunk": last,
+		"chunks": fingerprints,
+		"built": built,
+	})
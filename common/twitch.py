@@ -1,15 +1,134 @@
 import json
 import random
 import asyncio
+import collections
+import logging
 import socket
+import time
+import urllib.error
 import dateutil.parser
 
 import common.http
 from common import utils
 from common.config import config
 
+log = logging.getLogger('common.twitch')
+
 GAME_CHECK_INTERVAL = 5*60
 
+API_ROOT = "https://api.twitch.tv/kraken/"
+# How many response times are kept for each endpoint, for `TwitchClient.get_metrics`
+LATENCY_SAMPLES = 100
+
+class TwitchClient:
+	"""
+	Asynchronous client for the Twitch API, for use inside the event loop.
+
+	 * Identical requests made while one is already in flight share its
+	   response, rather than each going to Twitch.
+	 * Twitch's `Ratelimit-Remaining` and `Ratelimit-Reset` headers are tracked,
+	   and once the budget's spent, requests wait for the reset rather than being
+	   refused. A 429 response is retried once, after the reset.
+	 * Response times are recorded for each endpoint, see `get_metrics`.
+	"""
+	def __init__(self, root=API_ROOT):
+		self.root = root
+		self.in_flight = {}
+		self.ratelimit_remaining = None
+		self.ratelimit_reset = None
+		self.metrics = {}
+
+	async def request(self, endpoint, path, params=None, headers={}):
+		"""
+		Make a GET request to the API and return the decoded response. `endpoint`
+		is the name the response times are recorded under.
+		"""
+		params = params or {}
+		headers = dict(headers, **{'Client-ID': config['twitch_clientid']})
+		key = (path, tuple(sorted(params.items())), tuple(sorted(headers.items())))
+		future = self.in_flight.get(key)
+		if future is None:
+			future = asyncio.ensure_future(self._request(endpoint, self.root + path, params, headers))
+			self.in_flight[key] = future
+			future.add_done_callback(lambda future: self.in_flight.pop(key, None))
+		# Every caller gets its own copy to modify
+		return json.loads(await asyncio.shield(future))
+
+	async def _request(self, endpoint, url, params, headers):
+		for attempt in range(2):
+			await self.wait_for_ratelimit()
+			start = time.monotonic()
+			try:
+				text, response_headers = await common.http.request_coro(url, data=params, headers=dict(headers), return_headers=True)
+			except urllib.error.HTTPError as e:
+				self.record(endpoint, time.monotonic() - start, error=True)
+				if e.code == 429 and attempt == 0:
+					self.update_ratelimit(e.headers, limited=True)
+					continue
+				raise
+			except Exception:
+				self.record(endpoint, time.monotonic() - start, error=True)
+				raise
+			self.record(endpoint, time.monotonic() - start)
+			self.update_ratelimit(response_headers)
+			return text
+
+	async def wait_for_ratelimit(self):
+		while self.ratelimit_remaining is not None and self.ratelimit_remaining <= 0:
+			delay = self.ratelimit_reset - time.time() if self.ratelimit_reset is not None else 0
+			if delay <= 0:
+				self.ratelimit_remaining = None
+				break
+			log.info("Out of Twitch API requests, waiting %.1fs", delay)
+			await asyncio.sleep(delay)
+		if self.ratelimit_remaining is not None:
+			self.ratelimit_remaining -= 1
+
+	def update_ratelimit(self, headers, limited=False):
+		if headers is None:
+			return
+		try:
+			if 'Ratelimit-Reset' in headers:
+				self.ratelimit_reset = float(headers['Ratelimit-Reset'])
+			if limited:
+				self.ratelimit_remaining = 0
+			elif 'Ratelimit-Remaining' in headers:
+				self.ratelimit_remaining = int(headers['Ratelimit-Remaining'])
+		except ValueError:
+			pass
+
+	def record(self, endpoint, duration, error=False):
+		metrics = self.metrics.get(endpoint)
+		if metrics is None:
+			metrics = self.metrics[endpoint] = {
+				'count': 0,
+				'errors': 0,
+				'latencies': collections.deque(maxlen=LATENCY_SAMPLES),
+			}
+		metrics['count'] += 1
+		if error:
+			metrics['errors'] += 1
+		metrics['latencies'].append(duration)
+
+	def get_metrics(self):
+		"""
+		Request counts, error counts and the median, 95th percentile and maximum of
+		the recent response times (in seconds) for each endpoint.
+		"""
+		result = {}
+		for endpoint, metrics in self.metrics.items():
+			latencies = sorted(metrics['latencies'])
+			result[endpoint] = {
+				'count': metrics['count'],
+				'errors': metrics['errors'],
+				'p50': latencies[len(latencies) // 2],
+				'p95': latencies[min(len(latencies) - 1, len(latencies) * 95 // 100)],
+				'max': latencies[-1],
+			}
+		return result
+
+client = TwitchClient()
+
 def get_info_uncached(username=None, use_fallback=True):
 	"""
 	Get the Twitch info for a particular user or channel.
@@ -52,6 +171,32 @@ def get_info_uncached(username=None, use_fallback=True):
 def get_info(username=None, use_fallback=True):
 	return get_info_uncached(username, use_fallback=use_fallback)
 
+async def get_info_uncached_coro(username=None, use_fallback=True):
+	"""
+	Like `get_info_uncached`, but through `client`, for use in the event loop.
+	"""
+	if username is None:
+		username = config['channel']
+
+	data = await client.request("streams", "streams/%s" % username)
+	channel_data = data.get('stream') and data['stream'].get('channel')
+	if channel_data:
+		channel_data['live'] = True
+		channel_data['viewers'] = data['stream'].get('viewers')
+		channel_data['stream_created_at'] = data['stream'].get('created_at')
+		return channel_data
+
+	if not use_fallback:
+		return None
+
+	channel_data = await client.request("channels", "channels/%s" % username)
+	channel_data['live'] = False
+	return channel_data
+
+@utils.cache(GAME_CHECK_INTERVAL, params=[0, 1])
+async def get_info_coro(username=None, use_fallback=True):
+	return await get_info_uncached_coro(username, use_fallback=use_fallback)
+
 @utils.cache(GAME_CHECK_INTERVAL, params=[0, 1])
 def get_game(name, all=False):
 	"""
@@ -80,6 +225,24 @@ def get_game(name, all=False):
 				return game
 		return None
 
+@utils.cache(GAME_CHECK_INTERVAL, params=[0, 1])
+async def get_game_coro(name, all=False):
+	"""
+	Like `get_game`, but through `client`, for use in the event loop.
+	"""
+	res = await client.request("search/games", "search/games", {
+		'query': name,
+		'type': 'suggest',
+		'live': 'false',
+	})
+	if all:
+		return res['games']
+	else:
+		for game in res['games']:
+			if game['name'] == name:
+				return game
+		return None
+
 def get_game_playing(username=None):
 	"""
 	Get the game information for the game the stream is currently playing
@@ -91,6 +254,14 @@ def get_game_playing(username=None):
 		return get_game(name=channel_data['game'])
 	return None
 
+async def get_game_playing_coro(username=None):
+	channel_data = await get_info_coro(username, use_fallback=False)
+	if not channel_data or not channel_data['live']:
+		return None
+	if channel_data.get('game'):
+		return await get_game_coro(name=channel_data['game'])
+	return None
+
 def is_stream_live(username=None):
 	"""
 	Get whether the stream is currently live
@@ -98,6 +269,10 @@ def is_stream_live(username=None):
 	channel_data = get_info(username, use_fallback=False)
 	return channel_data and channel_data['live']
 
+async def is_stream_live_coro(username=None):
+	channel_data = await get_info_coro(username, use_fallback=False)
+	return channel_data and channel_data['live']
+
 @asyncio.coroutine
 def get_subscribers(channel, token, count=5, offset=None, latest=True):
 	headers = {
@@ -190,6 +365,9 @@ def get_user(user):
 	}
 	return json.loads(common.http.request("https://api.twitch.tv/kraken/users/%s" % user, headers=headers))
 
+async def get_user_coro(user):
+	return await client.request("users", "users/%s" % user)
+
 class get_followers:
 	def __init__(self, channel, limit=25, direction='desc'):
 		self.next_url = "https://api.twitch.tv/kraken/channels/%s/follows" % channel
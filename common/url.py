@@ -33,7 +33,7 @@ def canonical_url(url, depth=10):
 @asyncio.coroutine
 def get_tlds():
 	tlds = set()
-	data = yield from request_coro("https://data.iana.org/TLD/tlds-alpha-by-domain.txt")
+	data = yield from request_coro("https://data.iana.org/TLD/tlds-alpha-by-domain.txt", max_stale=24 * 60 * 60)
 	for line in data.splitlines():
 		if not line.startswith("#"):
 			line = line.strip().lower()
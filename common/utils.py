@@ -2,11 +2,8 @@ import asyncio
 import functools
 import inspect
 import itertools
-import json
 import logging
-import os.path
 import random
-import socket
 import textwrap
 import time
 import heapq
@@ -254,23 +251,6 @@ def immutable(obj):
 	else:
 		return obj
 
-def sse_send_event(endpoint, event=None, data=None, event_id=None):
-	if not os.path.exists(config.config['eventsocket']):
-		return
-
-	sse_event = {"endpoint": endpoint}
-	if event is not None:
-		sse_event["event"] = event
-	if data is not None:
-		sse_event["data"] = data
-	if event_id is not None:
-		sse_event["id"] = event_id
-
-	sse = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-	sse.connect(config.config['eventsocket'])
-	sse.send(json.dumps(sse_event).encode("utf-8")+b"\n")
-	sse.close()
-
 def ucfirst(s):
 	return s[0].upper() + s[1:]
 
@@ -337,6 +317,99 @@ def pick_weighted_random_elements(iterable, k):
 			heapq.heapreplace(queue, (r, elem))
 	return [elem for r, elem in queue]
 
+class WeightedSet:
+	"""
+	Weighted random selection from a set of options that changes over time.
+	Adding, removing or reweighting an option and picking one are all O(log n).
+
+	The weights are kept in a Fenwick tree: https://en.wikipedia.org/wiki/Fenwick_tree
+
+	Usage:
+	options = WeightedSet()
+	options.set("foo", 2)
+	options.set("bar", 1)
+	options.choice()
+	will return "foo" twice as often as "bar".
+	"""
+	def __init__(self, options=()):
+		# Slot -> option and its weight. Removed options leave a hole with no weight,
+		# which the next new option fills.
+		self.options = []
+		self.weights = []
+		self.free = []
+		# Option -> slot
+		self.slots = {}
+		# 1-based: tree[i] is the total weight of the slots i - (i & -i) to i - 1
+		self.tree = [0.0]
+		for option, weight in options:
+			self.set(option, weight)
+
+	def __len__(self):
+		return len(self.slots)
+
+	def __contains__(self, option):
+		return option in self.slots
+
+	def _prefix(self, n):
+		"""The total weight of the first `n` slots."""
+		total = 0.0
+		while n > 0:
+			total += self.tree[n]
+			n -= n & -n
+		return total
+
+	def _add(self, slot, delta):
+		i = slot + 1
+		while i < len(self.tree):
+			self.tree[i] += delta
+			i += i & -i
+
+	def set(self, option, weight):
+		"""Add an option, or change its weight. Options with no weight are removed."""
+		if weight <= 0:
+			self.remove(option)
+			return
+		slot = self.slots.get(option)
+		if slot is None:
+			if self.free:
+				slot = self.free.pop()
+				self.options[slot] = option
+			else:
+				slot = len(self.options)
+				self.options.append(option)
+				self.weights.append(0.0)
+				i = slot + 1
+				self.tree.append(self._prefix(i - 1) - self._prefix(i - (i & -i)))
+			self.slots[option] = slot
+		self._add(slot, weight - self.weights[slot])
+		self.weights[slot] = weight
+
+	def remove(self, option):
+		slot = self.slots.pop(option, None)
+		if slot is None:
+			return
+		self._add(slot, -self.weights[slot])
+		self.options[slot] = None
+		self.weights[slot] = 0.0
+		self.free.append(slot)
+
+	def choice(self):
+		if not self.slots:
+			raise ValueError("No options to choose")
+		target = random.random() * self._prefix(len(self.options))
+		# Find the last slot where the total weight before it is at most `target`
+		slot = 0
+		step = 1 << (len(self.tree) - 1).bit_length()
+		while step:
+			if slot + step < len(self.tree) and self.tree[slot + step] <= target:
+				slot += step
+				target -= self.tree[slot]
+			step >>= 1
+		if slot >= len(self.options) or self.options[slot] is None:
+			# Only rounding errors land in a hole or past the end
+			return random.choice(list(self.slots))
+		return self.options[slot]
+
 def merge_config_section(configs, prefix):
 	"""
 	Merge prefixed sections into the real sections, so that different values can
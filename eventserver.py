@@ -2,11 +2,14 @@ import aiohttp
 import aiohttp.web
 import aiomas
 import asyncio
+import collections
 import mimeparse
+import re
 import sqlalchemy
 import sys
 import json
 import datetime
+import logging
 import pytz
 import os
 
@@ -14,16 +17,363 @@ import common.rpc
 import common.postgres
 from common.config import config
 
+# Send a comment to every client this often, so proxies don't drop idle connections
+KEEPALIVE_INTERVAL = 15
+# How many frames a client can fall behind by before it gets disconnected
+MAX_BACKLOG = 256
+
+KEEPALIVE = b":keep-alive\n\n"
+
+# Postgres channel for new events, when `eventserver_notify` is set
+NOTIFY_CHANNEL = "events"
+# Seconds to wait before reconnecting a lost LISTEN connection
+LISTEN_RECONNECT_DELAY = 5
+# Seconds between checks that the event server accepting events is still there,
+# when it's another one
+RPC_RETRY_DELAY = 5
+
+log = logging.getLogger('eventserver')
+
+# Recent events are kept in memory so that reconnecting clients can be caught up
+# without going to the database. Events are kept until there are more than
+# `RECENT_EVENTS_COUNT` of them, or they're older than `RECENT_EVENTS_AGE`.
+RECENT_EVENTS_COUNT = 1000
+RECENT_EVENTS_AGE = datetime.timedelta(hours=24)
+
+INTERVAL_UNITS = {
+	"second": datetime.timedelta(seconds=1),
+	"minute": datetime.timedelta(minutes=1),
+	"hour": datetime.timedelta(hours=1),
+	"day": datetime.timedelta(days=1),
+	"week": datetime.timedelta(weeks=1),
+}
+re_interval_part = re.compile(r"\s*(\d+(?:\.\d+)?)\s*(second|minute|hour|day|week)s?\s*", re.IGNORECASE)
+re_interval_clock = re.compile(r"^\s*(\d+):(\d\d)(?::(\d\d))?\s*$")
+
+def parse_interval(interval):
+	"""
+	Parse the simple forms of a Postgres interval: "2 hours 30 minutes", "1 day"
+	or "02:30:00". Returns `None` for anything else, which then gets left to the
+	database to deal with.
+	"""
+	match = re_interval_clock.match(interval)
+	if match:
+		hours, minutes, seconds = match.groups()
+		return datetime.timedelta(hours=int(hours), minutes=int(minutes), seconds=int(seconds or 0))
+	total = datetime.timedelta()
+	pos = 0
+	while pos < len(interval):
+		match = re_interval_part.match(interval, pos)
+		if not match:
+			return None
+		total += float(match.group(1)) * INTERVAL_UNITS[match.group(2).lower()]
+		pos = match.end()
+	return total if pos > 0 else None
+
+class RecentEvents:
+	"""
+	The most recent events, along with enough information to know which queries
+	can be answered from them: every event with an ID above `floor_id` is in here,
+	and so is every event newer than `floor_time`.
+	"""
+	def __init__(self, rows, floor_id, floor_time):
+		self.events = collections.deque()
+		self.floor_id = floor_id
+		self.floor_time = floor_time
+		for id, event, data, time in rows:
+			self.append(id, event, data, time)
+
+	def append(self, id, event, data, time):
+		"""Add a new event. Returns it as an `Event`."""
+		event = Event(id, event, dict(data, time=time.isoformat()))
+		self.events.append((event, time))
+		self.expire()
+		return event
+
+	def expire(self):
+		cutoff = datetime.datetime.now(tz=pytz.utc) - RECENT_EVENTS_AGE
+		while self.events and (len(self.events) > RECENT_EVENTS_COUNT or self.events[0][1] < cutoff):
+			event, time = self.events.popleft()
+			self.floor_id, self.floor_time = event.id, time
+
+	def get(self, last_event_id, since):
+		"""
+		Events with an ID above `last_event_id` and newer than `since` (either can
+		be `None`), or `None` if some of them might not be in memory any more.
+		"""
+		if last_event_id is not None and last_event_id < self.floor_id:
+			return None
+		if since is not None and self.floor_time is not None and since < self.floor_time:
+			return None
+		return [
+			event
+			for event, time in self.events
+			if (last_event_id is None or event.id > last_event_id) and (since is None or time > since)
+		]
+
 class Poison:
 	pass
 
+def encode_event(event):
+	"""Encode an event as a Server-Sent Events frame."""
+	return b"".join([
+		b"id:%d\n" % event['id'],
+		b"event:%s\n" % event['event'].encode('utf-8'),
+		b"data:%s\n" % json.dumps(event['data']).encode('utf-8'),
+		b"\n",
+	])
+
+class Event:
+	"""
+	An event as it's sent to clients. Each encoding is worked out the first time
+	a client needs it, and then shared by all of them.
+	"""
+	__slots__ = ['id', 'event', 'data', '_sse', '_text']
+
+	def __init__(self, id, event, data):
+		self.id = id
+		self.event = event
+		self.data = data
+		self._sse = None
+		self._text = None
+
+	def as_dict(self):
+		return {'id': self.id, 'event': self.event, 'data': self.data}
+
+	@property
+	def sse(self):
+		"""The event as a Server-Sent Events frame."""
+		if self._sse is None:
+			self._sse = encode_event(self.as_dict())
+		return self._sse
+
+	@property
+	def text(self):
+		"""The event as a JSON WebSocket message."""
+		if self._text is None:
+			self._text = json.dumps(self.as_dict())
+		return self._text
+
+def get_event_filter(request):
+	"""The event types a client asked for with `?events=a,b`, or `None` for all of them."""
+	events = request.GET.get('events')
+	if not events:
+		return None
+	return set(event.strip() for event in events.split(","))
+
+class Client:
+	"""
+	A connected event stream. It's sent `Event`s (only the ones in `events`, if
+	it's set), `KEEPALIVE`s, and `Poison` when it should disconnect.
+	"""
+	def __init__(self, events=None):
+		self.queue = asyncio.Queue(maxsize=MAX_BACKLOG)
+		self.events = events
+
+	def send(self, item):
+		"""Queue an event or keep-alive. Returns `False` if the client is too far behind to take it."""
+		if self.events is not None and isinstance(item, Event) and item.event not in self.events:
+			return True
+		try:
+			self.queue.put_nowait(item)
+			return True
+		except asyncio.QueueFull:
+			return False
+
+	async def get_batch(self):
+		"""Wait for something to send, and then take everything that's queued up."""
+		items = [await self.queue.get()]
+		while not self.queue.empty():
+			items.append(self.queue.get_nowait())
+		return items
+
+	def kill(self):
+		# Throw away the backlog to make room for the poison
+		while not self.queue.empty():
+			self.queue.get_nowait()
+		self.queue.put_nowait(Poison)
+
 class Server(common.rpc.Server):
 	router = aiomas.rpc.Service()
 
 	def __init__(self):
 		super().__init__()
 		self.engine, self.metadata = common.postgres.new_engine_and_metadata()
-		self.queues = []
+		self.clients = set()
+		self.recent = self.load_recent_events()
+		# The newest event that's been sent to the clients
+		self.last_id = self.recent.events[-1][0].id if self.recent.events else self.recent.floor_id
+		self.rpc_started = False
+		# Whether another event server has the RPC socket, and this one is waiting to
+		# take over
+		self.rpc_standby = False
+		self.listen_conn = None
+		self.fetching = None
+		self.fetch_again = False
+
+	def load_recent_events(self):
+		events = self.metadata.tables['events']
+		with self.engine.begin() as conn:
+			rows = conn.execute(sqlalchemy.select([events.c.id, events.c.event, events.c.data, events.c.time])
+				.where(events.c.time > sqlalchemy.func.current_timestamp() - RECENT_EVENTS_AGE)
+				.order_by(events.c.id.desc())
+				.limit(RECENT_EVENTS_COUNT)).fetchall()
+			rows.reverse()
+			# The newest event that didn't make the cut
+			query = sqlalchemy.select([events.c.id, events.c.time]).order_by(events.c.id.desc()).limit(1)
+			if rows:
+				query = query.where(events.c.id < rows[0][0])
+			floor = conn.execute(query).first()
+		floor_id, floor_time = floor if floor is not None else (0, None)
+		return RecentEvents(rows, floor_id, floor_time)
+
+	async def start_rpc(self):
+		"""
+		Start accepting events over RPC. With `eventserver_notify` several event
+		servers can be running, and only one of them has the socket at a time. The
+		others keep checking that it's still there, and take it over if it isn't.
+		"""
+		if config['eventserver_notify']:
+			try:
+				reader, writer = await asyncio.open_unix_connection(config['eventsocket'])
+			except (OSError, NotImplementedError, AttributeError):
+				pass
+			else:
+				writer.close()
+				if not self.rpc_standby:
+					log.info("Another event server is accepting events, not starting RPC")
+				self.retry_rpc_later()
+				return
+		try:
+			os.unlink(config['eventsocket'])
+		except FileNotFoundError:
+			pass
+		try:
+			await self.start(config['eventsocket'], config['event_port'])
+		except OSError:
+			# TCP fallback, and someone else already has the port
+			if not config['eventserver_notify']:
+				raise
+			if not self.rpc_standby:
+				log.info("Another event server is accepting events, not starting RPC")
+			self.retry_rpc_later()
+			return
+		if self.rpc_standby:
+			log.info("The event server accepting events went away, taking over RPC")
+		self.rpc_started = True
+
+	def retry_rpc_later(self):
+		self.rpc_standby = True
+		asyncio.get_event_loop().call_later(RPC_RETRY_DELAY, self.retry_rpc)
+
+	def retry_rpc(self):
+		def done(future):
+			try:
+				future.result()
+			except Exception:
+				log.exception("Failed to start RPC")
+				self.retry_rpc_later()
+		asyncio.ensure_future(self.start_rpc()).add_done_callback(done)
+
+	def listen(self):
+		"""
+		Start listening for new events from Postgres. Each one is announced with a
+		NOTIFY carrying its ID, and every event server then picks up the new rows
+		itself, so they all agree on the IDs for `Last-Event-Id`.
+		"""
+		raw = self.engine.raw_connection()
+		raw.detach()
+		self.listen_conn = raw.connection
+		self.listen_conn.autocommit = True
+		with self.listen_conn.cursor() as cur:
+			cur.execute("LISTEN " + NOTIFY_CHANNEL)
+		asyncio.get_event_loop().add_reader(self.listen_conn.fileno(), self.on_notify)
+		# Catch up on anything that happened before (or while reconnecting)
+		self.fetch_new_events()
+
+	def unlisten(self):
+		if self.listen_conn is not None:
+			asyncio.get_event_loop().remove_reader(self.listen_conn.fileno())
+			try:
+				self.listen_conn.close()
+			except Exception:
+				pass
+			self.listen_conn = None
+
+	def on_notify(self):
+		try:
+			self.listen_conn.poll()
+		except Exception:
+			log.exception("Lost the LISTEN connection")
+			self.unlisten()
+			asyncio.get_event_loop().call_later(LISTEN_RECONNECT_DELAY, self.relisten)
+			return
+		if self.listen_conn.notifies:
+			# All that matters is that there's something new, not what it is
+			del self.listen_conn.notifies[:]
+			self.fetch_new_events()
+
+	def relisten(self):
+		try:
+			self.listen()
+		except Exception:
+			log.exception("Failed to reconnect the LISTEN connection")
+			self.unlisten()
+			asyncio.get_event_loop().call_later(LISTEN_RECONNECT_DELAY, self.relisten)
+
+	def fetch_new_events(self):
+		"""
+		Send out all the events newer than the last one we've sent. If that's
+		already happening, go round again once it's done, so a burst of
+		notifications turns into a couple of queries rather than one each.
+		"""
+		if self.fetching is not None:
+			self.fetch_again = True
+			return
+		self.fetch_again = False
+		self.fetching = asyncio.get_event_loop().run_in_executor(None, self.query_new_events, self.last_id)
+		self.fetching.add_done_callback(self.on_new_events)
+
+	def query_new_events(self, last_id):
+		events = self.metadata.tables['events']
+		with self.engine.begin() as conn:
+			return conn.execute(sqlalchemy.select([events.c.id, events.c.event, events.c.data, events.c.time])
+				.where(events.c.id > last_id)
+				.order_by(events.c.id)).fetchall()
+
+	def on_new_events(self, future):
+		self.fetching = None
+		try:
+			rows = future.result()
+		except Exception:
+			log.exception("Failed to fetch new events")
+			rows = []
+		for id, event, data, time in rows:
+			if id > self.last_id:
+				self.publish(id, event, data, time)
+		if self.fetch_again:
+			self.fetch_new_events()
+
+	def publish(self, id, event, data, time):
+		"""Send a new event out to this server's clients."""
+		self.last_id = id
+		self.broadcast(self.recent.append(id, event, data, time))
+
+	def broadcast(self, item):
+		"""
+		Send an event or keep-alive to every connected client. Clients that have
+		fallen too far behind are disconnected; they'll reconnect and catch up
+		with `Last-Event-Id`.
+		"""
+		for client in list(self.clients):
+			if not client.send(item):
+				self.clients.discard(client)
+				client.kill()
+
+	async def keepalive(self):
+		while True:
+			await asyncio.sleep(KEEPALIVE_INTERVAL)
+			self.broadcast(KEEPALIVE)
 
 	async def negotiate(self, request):
 		request.headers.getall('Accept', "*/*")
@@ -36,71 +386,157 @@ class Server(common.rpc.Server):
 		else:
 			raise NotImplementedError(mime_type)
 
-	def get_last_events(self, request):
+	async def get_last_events(self, request):
+		"""
+		The events a client has missed, as `Event`s. Served from memory if
+		possible, and from the database otherwise.
+		"""
 		try:
 			last_event_id = int(request.headers.get('Last-Event-Id', request.GET.get('last-event-id')))
 		except (ValueError, TypeError):
 			last_event_id = None
 		interval = request.GET.get('interval')
-		if interval is not None and last_event_id is None:
-			last_event_id = 0
-		if last_event_id is not None:
-			events = self.metadata.tables['events']
-			query = sqlalchemy.select([
-				events.c.id, events.c.event, events.c.data, events.c.time
-			])
-			query = query.where(events.c.id > last_event_id)
-			if interval is not None:
-				query = query.where(events.c.time > sqlalchemy.func.current_timestamp() - sqlalchemy.cast(interval, sqlalchemy.Interval))
-			query = query.order_by(events.c.id)
-			try:
-				with self.engine.begin() as conn:
-					return [
-						{'id': id, 'event': event, 'data': dict(data, time=time.isoformat())}
-						for id, event, data, time in conn.execute(query)
-					]
-			except sqlalchemy.exc.DataError as e:
-				raise aiohttp.web.HTTPBadRequest from e
-		return []
+		if last_event_id is None and interval is None:
+			return []
+
+		if interval is not None:
+			delta = parse_interval(interval)
+			since = datetime.datetime.now(tz=pytz.utc) - delta if delta is not None else None
+		if interval is None or since is not None:
+			self.recent.expire()
+			# Without an ID, only the time decides whether the events are in memory
+			events = self.recent.get(last_event_id, since if interval is not None else None)
+			if events is not None:
+				return events
+
+		query_id = last_event_id if last_event_id is not None else 0
+		events = await asyncio.get_event_loop().run_in_executor(None, self.query_events, query_id, interval)
+		return [Event(event['id'], event['event'], event['data']) for event in events]
+
+	def query_events(self, last_event_id, interval):
+		events = self.metadata.tables['events']
+		query = sqlalchemy.select([
+			events.c.id, events.c.event, events.c.data, events.c.time
+		])
+		query = query.where(events.c.id > last_event_id)
+		if interval is not None:
+			query = query.where(events.c.time > sqlalchemy.func.current_timestamp() - sqlalchemy.cast(interval, sqlalchemy.Interval))
+		query = query.order_by(events.c.id)
+		try:
+			with self.engine.begin() as conn:
+				return [
+					{'id': id, 'event': event, 'data': dict(data, time=time.isoformat())}
+					for id, event, data, time in conn.execute(query)
+				]
+		except sqlalchemy.exc.DataError as e:
+			raise aiohttp.web.HTTPBadRequest from e
 
 	async def event_stream(self, request):
-		queue = asyncio.Queue()
-		for event in self.get_last_events(request):
-			await queue.put(event)
-		self.queues.append(queue)
-
-		response = aiohttp.web.StreamResponse()
-		response.enable_chunked_encoding()
-		response.headers['Access-Control-Allow-Origin'] = '*'
-		response.headers['Content-Type'] = 'text/event-stream; charset=utf-8'
-		response.headers['Vary'] = "Accept"
-		await response.prepare(request)
+		# Start listening before looking up the backlog, so nothing is missed in
+		# between. Anything that turns up in both is skipped the second time.
+		client = Client(get_event_filter(request))
+		self.clients.add(client)
+		try:
+			last_events = self.filter_events(client, await self.get_last_events(request))
+			last_id = last_events[-1].id if last_events else 0
+
+			response = aiohttp.web.StreamResponse()
+			response.enable_chunked_encoding()
+			response.headers['Access-Control-Allow-Origin'] = '*'
+			response.headers['Content-Type'] = 'text/event-stream; charset=utf-8'
+			response.headers['Vary'] = "Accept"
+			await response.prepare(request)
 
-		while True:
 			try:
-				try:
-					event = await asyncio.wait_for(queue.get(), 15)
-					if event['event'] is Poison:
-						break
-					response.write(b"id:%d\n" % event['id'])
-					response.write(b"event:%s\n" % event['event'].encode('utf-8'))
-					response.write(b"data:%s\n" % json.dumps(event['data']).encode('utf-8'))
-					response.write(b"\n")
+				if last_events:
+					response.write(b"".join(event.sse for event in last_events))
 					await response.drain()
-					queue.task_done()
-				except asyncio.TimeoutError:
-					response.write(b":keep-alive\n\n")
+				while True:
+					# Write everything that's queued up in one go
+					items = await client.get_batch()
+					if Poison in items:
+						break
+					response.write(b"".join(
+						item.sse if isinstance(item, Event) else item
+						for item in items
+						if not isinstance(item, Event) or item.id > last_id
+					))
 					await response.drain()
 			except IOError:
-				break
-
-		self.queues.remove(queue)
+				pass
+		finally:
+			self.clients.discard(client)
 
 		return response
 
+	def filter_events(self, client, events):
+		if client.events is None:
+			return events
+		return [event for event in events if event.event in client.events]
+
+	async def websocket(self, request):
+		"""
+		The same events as the event stream, over a compressed WebSocket, one JSON
+		message per event. Replays work the same way (`?last-event-id=` and
+		`?interval=`), and `?events=` or a `{"events": [...]}` message from the
+		client limits which event types get sent.
+		"""
+		try:
+			ws = aiohttp.web.WebSocketResponse(compress=True)
+		except TypeError:
+			# This version of aiohttp can't do permessage-deflate
+			ws = aiohttp.web.WebSocketResponse()
+		if not ws.can_prepare(request):
+			raise aiohttp.web.HTTPBadRequest()
+
+		client = Client(get_event_filter(request))
+		self.clients.add(client)
+		writer = None
+		try:
+			last_events = self.filter_events(client, await self.get_last_events(request))
+			last_id = last_events[-1].id if last_events else 0
+			await ws.prepare(request)
+			for event in last_events:
+				ws.send_str(event.text)
+			writer = asyncio.ensure_future(self.websocket_writer(ws, client, last_id))
+			async for msg in ws:
+				if msg.type == aiohttp.WSMsgType.TEXT:
+					try:
+						events = json.loads(msg.data)['events']
+						client.events = set(events) if events is not None else None
+					except (ValueError, KeyError, TypeError):
+						await ws.close(code=aiohttp.WSCloseCode.UNSUPPORTED_DATA, message=b"Expected {\"events\": [...]}")
+				elif msg.type == aiohttp.WSMsgType.ERROR:
+					break
+		finally:
+			self.clients.discard(client)
+			if writer is not None:
+				writer.cancel()
+
+		return ws
+
+	async def websocket_writer(self, ws, client, last_id):
+		try:
+			while True:
+				items = await client.get_batch()
+				if Poison in items:
+					break
+				for item in items:
+					if isinstance(item, Event):
+						if item.id > last_id:
+							ws.send_str(item.text)
+					else:
+						ws.ping()
+				await ws.drain()
+		except (IOError, RuntimeError):
+			# The connection's gone (aiohttp raises RuntimeError for writes to a closing WebSocket)
+			pass
+		await ws.close()
+
 	async def json(self, request):
+		client = Client(get_event_filter(request))
 		return aiohttp.web.json_response({
-			'events': self.get_last_events(request),
+			'events': [event.as_dict() for event in self.filter_events(client, await self.get_last_events(request))],
 		}, headers={"Vary": "Accept", 'Access-Control-Allow-Origin': request.headers.get('Origin', '*')})
 
 	async def cors_preflight(self, request):
@@ -110,26 +546,39 @@ class Server(common.rpc.Server):
 
 	@aiomas.expose
 	async def event(self, event, data, time):
-		if time is None:
-			time = datetime.datetime.now(tz=pytz.utc)
+		ids = await self.events([(event, data, time)])
+		return ids[0]
+
+	@aiomas.expose
+	async def events(self, batch):
+		"""
+		Store and send out a batch of `(event, data, time)` tuples, with one
+		INSERT. Returns their IDs.
+		"""
+		now = datetime.datetime.now(tz=pytz.utc)
+		batch = [(event, data, time if time is not None else now) for event, data, time in batch]
+		if not batch:
+			return []
 		events = self.metadata.tables['events']
 		with self.engine.begin() as conn:
-			id, = conn.execute(events.insert().returning(events.c.id),
-				event=event,
-				data=data,
-				time=time,
-			).first()
-		event = {
-			'id': id,
-			'event': event,
-			'data': dict(data, time=time.isoformat()),
-		}
-		for queue in self.queues:
-			await queue.put(event)
+			ids = [id for id, in conn.execute(events.insert().values([
+				{'event': event, 'data': data, 'time': time}
+				for event, data, time in batch
+			]).returning(events.c.id))]
+			if config['eventserver_notify']:
+				# Delivered on commit. Every event server, including this one, then
+				# picks the new rows up and sends them out.
+				conn.execute(sqlalchemy.select([sqlalchemy.func.pg_notify(NOTIFY_CHANNEL, str(max(ids)))]))
+		if not config['eventserver_notify']:
+			# Send them out in ID order, which is the order clients replay them in
+			for id, (event, data, time) in sorted(zip(ids, batch), key=lambda row: row[0]):
+				self.publish(id, event, data, time)
+		return ids
 
 	async def on_shutdown(self, app):
-		for queue in self.queues:
-			await queue.put({'event': Poison})
+		for client in self.clients:
+			client.kill()
+		self.clients.clear()
 
 server = None
 srv = None
@@ -139,19 +588,25 @@ app = None
 async def main(loop):
 	global server, srv, app, handler
 
-	try:
-		os.unlink(config['eventsocket'])
-	except FileNotFoundError:
-		pass
 	server = Server()
-	await server.start(config['eventsocket'], config['event_port'])
+	await server.start_rpc()
+	if config['eventserver_notify']:
+		server.listen()
 	app = aiohttp.web.Application()
 	app.router.add_route('GET', '/notifications/events', server.negotiate)
 	app.router.add_route('OPTIONS', '/notifications/events', server.cors_preflight)
+	app.router.add_route('GET', '/notifications/websocket', server.websocket)
 	app.on_shutdown.append(server.on_shutdown)
+	keepalive = asyncio.ensure_future(server.keepalive())
+	app.on_cleanup.append(lambda app: keepalive.cancel())
 
 	handler = app.make_handler()
-	srv = await loop.create_server(handler, 'localhost', 8080)
+	if config['eventserver_notify']:
+		# Let several event servers share the port; the kernel spreads the
+		# connections between them.
+		srv = await loop.create_server(handler, 'localhost', config['eventserver_port'], reuse_port=True)
+	else:
+		srv = await loop.create_server(handler, 'localhost', config['eventserver_port'])
 	if sys.platform == "win32":
 		# On Windows Ctrl+C doesn't interrupt `select()`.
 		def windows_is_butts():
@@ -162,7 +617,9 @@ async def cleanup():
 	global server, srv, app, handler
 
 	srv.close()
-	await server.close()
+	server.unlisten()
+	if server.rpc_started:
+		await server.close()
 	await srv.wait_closed()
 	await app.shutdown()
 	await handler.finish_connections(60.0)
@@ -0,0 +1,174 @@
+import bisect
+import collections
+import logging
+import re
+
+import sqlalchemy
+
+from common.cardname import clean_text
+
+__all__ = ["CardIndex"]
+
+log = logging.getLogger('cardindex')
+
+# How many "Did you mean" suggestions to offer for a name that doesn't match anything
+MAX_SUGGESTIONS = 5
+# How many of the best trigram matches to rank by edit distance
+SUGGESTION_CANDIDATES = 50
+# Minimum trigram similarity for a card to be considered as a suggestion at all
+MIN_SIMILARITY = 0.3
+
+def trigrams(text, pad=True):
+	"""
+	Split a cleaned card name into its trigrams. With padding, like pg_trgm, so
+	the start and end of the name count for a little extra.
+	"""
+	if pad:
+		text = "\0\0" + text + "\0"
+	return {text[i:i+3] for i in range(len(text) - 2)}
+
+def edit_distance(a, b):
+	"""Levenshtein distance between two strings."""
+	if len(a) < len(b):
+		a, b = b, a
+	previous = list(range(len(b) + 1))
+	for i, ca in enumerate(a, 1):
+		current = [i]
+		for j, cb in enumerate(b, 1):
+			current.append(min(
+				previous[j] + 1,
+				current[j - 1] + 1,
+				previous[j - 1] + (ca != cb),
+			))
+		previous = current
+	return previous[-1]
+
+class CardIndex:
+	"""
+	In-memory index of the card database, so that `!card` and the card viewer
+	don't need to scan the `cards` table on every lookup.
+
+	Cards are stored in a list, and everything else refers to them by their
+	position in that list:
+	 * `by_name` maps the exact filtered name to the card
+	 * `names` is the sorted list of filtered names, for prefix lookups
+	 * `by_trigram` maps each trigram to the set of cards containing it, used
+	   both to narrow down substring searches and to find suggestions for typos
+	 * `by_multiverse` and `by_collector` map the IDs the card viewer gets
+	   from pubnub
+	"""
+	def __init__(self, engine, metadata):
+		self.engine = engine
+		self.metadata = metadata
+		self.build([], [], [])
+
+	def load(self):
+		"""(Re)build the index from the database."""
+		cards = self.metadata.tables["cards"]
+		card_multiverse = self.metadata.tables["card_multiverse"]
+		card_collector = self.metadata.tables["card_collector"]
+		with self.engine.begin() as conn:
+			card_rows = conn.execute(sqlalchemy.select([cards.c.id, cards.c.filteredname, cards.c.name, cards.c.text])).fetchall()
+			multiverse_rows = conn.execute(sqlalchemy.select([card_multiverse.c.id, card_multiverse.c.cardid])).fetchall()
+			collector_rows = conn.execute(sqlalchemy.select([card_collector.c.setid, card_collector.c.collector, card_collector.c.cardid])).fetchall()
+		self.build(card_rows, multiverse_rows, collector_rows)
+		log.info("Loaded %d cards into the card index", len(self.cards))
+
+	def build(self, card_rows, multiverse_rows, collector_rows):
+		cards = []
+		by_name = {}
+		by_trigram = collections.defaultdict(set)
+		by_id = {}
+		for cardid, filteredname, name, text in card_rows:
+			ix = len(cards)
+			name_trigrams = trigrams(filteredname)
+			cards.append((filteredname, name, text, len(name_trigrams)))
+			by_id[cardid] = ix
+			by_name[filteredname] = ix
+			for trigram in name_trigrams:
+				by_trigram[trigram].add(ix)
+
+		# Build everything before swapping it in, so that lookups happening during a
+		# reload see either the old index or the new one, never half of each.
+		self.by_multiverse = {mid: by_id[cardid] for mid, cardid in multiverse_rows if cardid in by_id}
+		self.by_collector = {(setid, collector): by_id[cardid] for setid, collector, cardid in collector_rows if cardid in by_id}
+		self.cards, self.by_name, self.by_trigram = cards, by_name, dict(by_trigram)
+		self.names = sorted(by_name)
+
+	def _result(self, indexes):
+		cards = self.cards
+		return [(cards[ix][1], cards[ix][2]) for ix in indexes]
+
+	def find_multiverse(self, multiverseid):
+		ix = self.by_multiverse.get(multiverseid)
+		return self._result([ix] if ix is not None else [])
+
+	def find_collector(self, setid, collector):
+		ix = self.by_collector.get((setid, collector))
+		return self._result([ix] if ix is not None else [])
+
+	def find_prefix(self, prefix):
+		"""All the cards whose filtered name starts with `prefix`, in alphabetical order."""
+		start = bisect.bisect_left(self.names, prefix)
+		end = bisect.bisect_left(self.names, prefix + "\U0010FFFF", start)
+		return [self.by_name[name] for name in self.names[start:end]]
+
+	def find(self, search):
+		"""
+		Find the cards matching a search string, closest matches first.
+
+		An exact match on the filtered name wins outright. Otherwise, any card that
+		contains all the words of the search, in order, matches.
+		"""
+		cleansearch = clean_text(search)
+		ix = self.by_name.get(cleansearch)
+		if ix is not None:
+			return self._result([ix])
+
+		searchwords = [clean_text(word) for word in search.split()]
+		searchwords = [word for word in searchwords if word]
+		if not searchwords:
+			return []
+
+		# Only cards that have every trigram of every search word can possibly match
+		candidates = None
+		for word in searchwords:
+			for trigram in trigrams(word, pad=False):
+				matching = self.by_trigram.get(trigram, set())
+				candidates = matching if candidates is None else candidates & matching
+				if not candidates:
+					return []
+		if candidates is None:
+			# All the words are too short to have any trigrams
+			candidates = range(len(self.cards))
+
+		re_search = re.compile(".*?".join(re.escape(word) for word in searchwords))
+		prefixed = set(self.find_prefix(cleansearch))
+		matches = [ix for ix in candidates if re_search.search(self.cards[ix][0])]
+		matches.sort(key=lambda ix: (ix not in prefixed, len(self.cards[ix][0]), self.cards[ix][0]))
+		return self._result(matches)
+
+	def suggest(self, search, count=MAX_SUGGESTIONS):
+		"""
+		Find the card names that are closest to a search string that doesn't match
+		anything, for typos. Returns card names, closest first.
+		"""
+		cleansearch = clean_text(search)
+		if not cleansearch:
+			return []
+		search_trigrams = trigrams(cleansearch)
+		shared = collections.Counter()
+		for trigram in search_trigrams:
+			shared.update(self.by_trigram.get(trigram, ()))
+
+		candidates = []
+		for ix, common in shared.items():
+			similarity = common / (len(search_trigrams) + self.cards[ix][3] - common)
+			if similarity >= MIN_SIMILARITY:
+				candidates.append((similarity, ix))
+		candidates.sort(reverse=True)
+		ranked = sorted(
+			(edit_distance(cleansearch, self.cards[ix][0]), -similarity, self.cards[ix][1])
+			for similarity, ix in candidates[:SUGGESTION_CANDIDATES]
+		)
+		return [name for distance, similarity, name in ranked[:count]]
@@ -297,7 +297,7 @@ def get_twitch_emoticons():
 	headers = {
 		"Client-ID": config['twitch_clientid'],
 	}
-	data = yield from common.http.request_coro("https://api.twitch.tv/kraken/chat/emoticons", headers=headers)
+	data = yield from common.http.request_coro("https://api.twitch.tv/kraken/chat/emoticons", headers=headers, max_stale=CACHE_EXPIRY)
 	data = json.loads(data)['emoticons']
 	emotesets = {}
 	for emote in data:
@@ -324,7 +324,7 @@ def get_twitch_emoticon_images():
 	headers = {
 		"Client-ID": config['twitch_clientid'],
 	}
-	data = yield from common.http.request_coro("https://api.twitch.tv/kraken/chat/emoticon_images", headers=headers)
+	data = yield from common.http.request_coro("https://api.twitch.tv/kraken/chat/emoticon_images", headers=headers, max_stale=CACHE_EXPIRY)
 	data = json.loads(data)["emoticons"]
 	emotesets = {}
 	for emote in data:
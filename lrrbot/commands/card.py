@@ -1,10 +1,5 @@
-import sqlalchemy
-
 import lrrbot.decorators
 from lrrbot.main import bot
-import common.postgres
-import common.time
-from common.cardname import clean_text
 
 @bot.command("cardview (on|off)")
 @lrrbot.decorators.mod_only
@@ -37,7 +32,11 @@ def real_card_lookup(lrrbot, conn, event, respond_to, search, noerror=False):
 		return
 
 	if len(cards) == 0:
-		conn.privmsg(respond_to, "Can't find any card by that name")
+		suggestions = lrrbot.card_index.suggest(search) if isinstance(search, str) else []
+		if suggestions:
+			conn.privmsg(respond_to, "Can't find any card by that name. Did you mean: %s" % '; '.join(suggestions))
+		else:
+			conn.privmsg(respond_to, "Can't find any card by that name")
 	elif len(cards) == 1:
 		conn.privmsg(respond_to, cards[0][1])
 	elif len(cards) <= 5:
@@ -46,30 +45,10 @@ def real_card_lookup(lrrbot, conn, event, respond_to, search, noerror=False):
 		conn.privmsg(respond_to, "Found %d cards you could be referring to - please enter more of the name" % len(cards))
 
 def find_card(lrrbot, search):
-	cards = lrrbot.metadata.tables["cards"]
-	card_multiverse = lrrbot.metadata.tables["card_multiverse"]
-	card_collector = lrrbot.metadata.tables["card_collector"]
-
 	if isinstance(search, int):
-		with lrrbot.engine.begin() as conn:
-			return conn.execute(sqlalchemy.select([cards.c.name, cards.c.text])
-				.select_from(card_multiverse.join(cards, cards.c.id == card_multiverse.c.cardid))
-				.where(card_multiverse.c.id == search)).fetchall()
+		return lrrbot.card_index.find_multiverse(search)
 
 	if isinstance(search, tuple):
-		with lrrbot.engine.begin() as conn:
-			return conn.execute(sqlalchemy.select([cards.c.name, cards.c.text])
-				.select_from(card_collector.join(cards, cards.c.id == card_collector.c.cardid))
-				.where((card_collector.c.setid == search[0]) & (card_collector.c.collector == search[1]))).fetchall()
-
-	cleansearch = clean_text(search)
-	with lrrbot.engine.begin() as conn:
-		rows = conn.execute(sqlalchemy.select([cards.c.name, cards.c.text]).where(cards.c.filteredname == cleansearch)).fetchall()
-		if rows:
-			return rows
+		return lrrbot.card_index.find_collector(*search)
 
-		searchwords = search.split()
-		searchwords = [clean_text(i) for i in searchwords]
-		searchlike = "%" + "%".join(common.postgres.escape_like(i) for i in searchwords) + "%"
-		return conn.execute(sqlalchemy.select([cards.c.name, cards.c.text])
-			.where(cards.c.filteredname.like(searchlike))).fetchall()
+	return lrrbot.card_index.find(search)
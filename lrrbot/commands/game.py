@@ -6,44 +6,40 @@ from sqlalchemy.dialects.postgresql import insert
 import lrrbot.decorators
 from common import utils
 from common import twitch
+from common import game_data
 from lrrbot import storage
 from lrrbot.main import bot
-from lrrbot.commands.stats import stat_increment
 
 @bot.command("game")
 @lrrbot.decorators.throttle()
-def current_game(lrrbot, conn, event, respond_to):
+async def current_game(lrrbot, conn, event, respond_to):
 	"""
 	Command: !game
 	Section: info
 
 	Post the game currently being played.
 	"""
-	game_id = lrrbot.get_game_id()
+	game_id = await lrrbot.get_game_id()
 	if game_id is None:
 		conn.privmsg(respond_to, "Not currently playing any game")
 		return
 	show_id = lrrbot.get_show_id()
 
-	game_votes = lrrbot.metadata.tables["game_votes"]
+	game_vote_totals = lrrbot.metadata.tables["game_vote_totals"]
 	game_per_show_data = lrrbot.metadata.tables["game_per_show_data"]
 	games = lrrbot.metadata.tables["games"]
 	with lrrbot.engine.begin() as pg_conn:
-		good = sqlalchemy.cast(
-			sqlalchemy.func.sum(sqlalchemy.cast(game_votes.c.vote, sqlalchemy.Integer)),
-			sqlalchemy.Numeric
-		)
-		votes_query = sqlalchemy.alias(sqlalchemy.select([
-			(100 * good / sqlalchemy.func.count(game_votes.c.vote)).label("rating")
-		]).where(game_votes.c.game_id == game_id).where(game_votes.c.show_id == show_id))
 		game, rating = pg_conn.execute(
 			sqlalchemy.select([
 				sqlalchemy.func.coalesce(game_per_show_data.c.display_name, games.c.name),
-				votes_query.c.rating
+				game_data.vote_rating(game_vote_totals),
 			]).select_from(
 				games.outerjoin(game_per_show_data,
 					(game_per_show_data.c.game_id == games.c.id)
 						& (game_per_show_data.c.show_id == show_id))
+				.outerjoin(game_vote_totals,
+					(game_vote_totals.c.game_id == games.c.id)
+						& (game_vote_totals.c.show_id == show_id))
 			).where(games.c.id == game_id)).first()
 
 		conn.privmsg(respond_to, "Currently playing: %s%s%s" % (
@@ -53,7 +49,7 @@ def current_game(lrrbot, conn, event, respond_to):
 		))
 
 @bot.command("game (?:(good|yes|:\)|:D|<3|lrrAWESOME|lrrGOAT|lrrSPOT)|(bad|no|:\(|:/|>\(|lrrAWW|lrrEFF|lrrFRUMP))")
-def vote(lrrbot, conn, event, respond_to, vote_good, vote_bad):
+async def vote(lrrbot, conn, event, respond_to, vote_good, vote_bad):
 	"""
 	Command: !game good
 	Command: !game bad
@@ -64,7 +60,7 @@ def vote(lrrbot, conn, event, respond_to, vote_good, vote_bad):
 	host may heed this or ignore it at their choice. Probably ignore
 	it.
 	"""
-	game_id = lrrbot.get_game_id()
+	game_id = await lrrbot.get_game_id()
 	if game_id is None:
 		conn.privmsg(respond_to, "Not currently playing any game")
 		return
@@ -92,38 +88,32 @@ def vote_respond(lrrbot, conn, respond_to, game_id):
 	if game_id is not None:
 		show_id = lrrbot.get_show_id()
 
-		game_votes = lrrbot.metadata.tables["game_votes"]
+		game_vote_totals = lrrbot.metadata.tables["game_vote_totals"]
 		game_per_show_data = lrrbot.metadata.tables["game_per_show_data"]
 		games = lrrbot.metadata.tables["games"]
 		shows = lrrbot.metadata.tables["shows"]
 		with lrrbot.engine.begin() as pg_conn:
-			good = sqlalchemy.cast(
-				sqlalchemy.func.sum(sqlalchemy.cast(game_votes.c.vote, sqlalchemy.Integer)),
-				sqlalchemy.Numeric
-			)
-			votes_query = sqlalchemy.alias(sqlalchemy.select([
-				(100 * good / sqlalchemy.func.count(game_votes.c.vote)).label("rating"),
-				good.label("good"),
-				sqlalchemy.func.count(game_votes.c.vote).label("total"),
-			]).where(game_votes.c.game_id == game_id).where(game_votes.c.show_id == show_id))
 			game, show, rating, good, total = pg_conn.execute(
 				sqlalchemy.select([
 					sqlalchemy.func.coalesce(game_per_show_data.c.display_name, games.c.name),
 					shows.c.name,
-					votes_query.c.rating,
-					votes_query.c.good,
-					votes_query.c.total,
+					game_data.vote_rating(game_vote_totals),
+					game_vote_totals.c.good,
+					game_vote_totals.c.total,
 				]).select_from(
 					games.outerjoin(game_per_show_data,
 						(game_per_show_data.c.game_id == games.c.id)
 							& (game_per_show_data.c.show_id == show_id))
+					.join(game_vote_totals,
+						(game_vote_totals.c.game_id == games.c.id)
+							& (game_vote_totals.c.show_id == show_id))
 				).where(games.c.id == game_id).where(shows.c.id == show_id)).first()
 		conn.privmsg(respond_to, "Rating for %s on %s is now %0.0f%% (%d/%d)" % (game, show, rating, good, total))
 	lrrbot.vote_update = None
 
 @bot.command("game display (.*?)")
 @lrrbot.decorators.mod_only
-def set_game_name(lrrbot, conn, event, respond_to, name):
+async def set_game_name(lrrbot, conn, event, respond_to, name):
 	"""
 	Command: !game display NAME
 	Section: info
@@ -132,7 +122,7 @@ def set_game_name(lrrbot, conn, event, respond_to, name):
 
 	Change the display name of the current game to NAME.
 	"""
-	game_id = lrrbot.get_game_id()
+	game_id = await lrrbot.get_game_id()
 	if game_id is None:
 		conn.privmsg(respond_to, "Not currently playing any game.")
 		return
@@ -156,12 +146,13 @@ def set_game_name(lrrbot, conn, event, respond_to, name):
 		)
 		pg_conn.execute(query)
 		real_name, = pg_conn.execute(name_query).first()
+	lrrbot.game_stats.invalidate(game_id, show_id)
 
-		conn.privmsg(respond_to, "OK, I'll start calling %s \"%s\"" % (real_name, name))
+	conn.privmsg(respond_to, "OK, I'll start calling %s \"%s\"" % (real_name, name))
 
 @bot.command("game override (.*?)")
 @lrrbot.decorators.mod_only
-def override_game(lrrbot, conn, event, respond_to, game):
+async def override_game(lrrbot, conn, event, respond_to, game):
 	"""
 	Command: !game override NAME
 	Section: info
@@ -183,9 +174,9 @@ def override_game(lrrbot, conn, event, respond_to, game):
 	else:
 		lrrbot.override_game(game)
 		operation = "enabled"
-	twitch.get_info.reset_throttle()
+	twitch.get_info_coro.reset_throttle()
 	current_game.reset_throttle()
-	game_id = lrrbot.get_game_id()
+	game_id = await lrrbot.get_game_id()
 	show_id = lrrbot.get_show_id()
 	message = "Override %s. " % operation
 	if game_id is None:
@@ -206,45 +197,39 @@ def override_game(lrrbot, conn, event, respond_to, game):
 
 @bot.command("game refresh")
 @lrrbot.decorators.mod_only
-def refresh(lrrbot, conn, event, respond_to):
+async def refresh(lrrbot, conn, event, respond_to):
 	"""
 	Command: !game refresh
 	Section: info
 
 	Force a refresh of the current Twitch game (normally this is updated at most once every 15 minutes)
 	"""
-	twitch.get_info.reset_throttle()
+	twitch.get_info_coro.reset_throttle()
+	lrrbot.known_games.clear()
 	lrrbot.get_game_id.reset_throttle()
 	current_game.reset_throttle()
-	current_game(lrrbot, conn, event, respond_to)
+	await current_game(lrrbot, conn, event, respond_to)
 
 @bot.command("game completed")
 @lrrbot.decorators.throttle(30, notify=lrrbot.decorators.Visibility.PUBLIC, modoverride=False, allowprivate=False)
-def completed(lrrbot, conn, event, respond_to):
+async def completed(lrrbot, conn, event, respond_to):
 	"""
 	Command: !game completed
 	Section: info
 
 	Mark a game as having been completed.
 	"""
-	game_id = lrrbot.get_game_id()
+	game_id = await lrrbot.get_game_id()
 	if game_id is None:
 		conn.privmsg(respond_to, "Not currently playing any game")
 		return
 	show_id = lrrbot.get_show_id()
-	games = lrrbot.metadata.tables["games"]
-	game_per_show_data = lrrbot.metadata.tables["game_per_show_data"]
-	stats = lrrbot.metadata.tables["stats"]
-	with lrrbot.engine.begin() as pg_conn:
-		name, = pg_conn.execute(sqlalchemy.select([
-			sqlalchemy.func.coalesce(game_per_show_data.c.display_name, games.c.name),
-		]).select_from(games.outerjoin(
-			game_per_show_data,
-			(game_per_show_data.c.game_id == games.c.id) & (game_per_show_data.c.show_id == show_id)
-		)).where(games.c.id == game_id)).first()
-		stat_id, emote = pg_conn.execute(sqlalchemy.select([stats.c.id, stats.c.emote])
-			.where(stats.c.string_id == "completed")).first()
-		stat_increment(lrrbot, pg_conn, game_id, show_id, stat_id, 1)
+	stat = lrrbot.game_stats.get_stat("completed")
+	name = (await lrrbot.game_stats.get_game_coro(game_id, show_id))["name"]
+	lrrbot.game_stats.increment(game_id, show_id, stat, 1)
+	emote = stat["emote"]
 	if emote:
 		emote += " "
+	else:
+		emote = ""
 	conn.privmsg(respond_to, "%s%s added to the completed list" % (emote, name))
@@ -11,7 +11,6 @@ import sqlalchemy
 
 import common.http
 import common.time
-import common.storm
 import lrrbot.decorators
 from common import utils
 from common.config import config
@@ -36,19 +35,14 @@ def stormcount(lrrbot, conn, event, respond_to):
 
 	Show the current storm counts.
 	"""
-	twitch_subscription = common.storm.get(lrrbot.engine, lrrbot.metadata, 'twitch-subscription')
-	twitch_resubscription = common.storm.get(lrrbot.engine, lrrbot.metadata, 'twitch-resubscription')
-	twitch_follow = common.storm.get(lrrbot.engine, lrrbot.metadata, 'twitch-follow')
-	twitch_cheer = common.storm.get(lrrbot.engine, lrrbot.metadata, 'twitch-cheer')
-	patreon_pledge = common.storm.get(lrrbot.engine, lrrbot.metadata, 'patreon-pledge')
-	storm_count = common.storm.get_combined(lrrbot.engine, lrrbot.metadata)
+	counts = lrrbot.storm.snapshot()
 	conn.privmsg(respond_to, "Today's storm count: %d (new subscribers: %d, returning subscribers: %d, new patrons: %d), bits cheered: %d, new followers: %d" % (
-		storm_count,
-		twitch_subscription,
-		twitch_resubscription,
-		patreon_pledge,
-		twitch_cheer,
-		twitch_follow,
+		counts['storm'],
+		counts['twitch-subscription'],
+		counts['twitch-resubscription'],
+		counts['patreon-pledge'],
+		counts['twitch-cheer'],
+		counts['twitch-follow'],
 	))
 
 @bot.command("spam(?:count)?")
@@ -163,7 +157,7 @@ def viewers(lrrbot, conn, event, respond_to):
 
 	Post the number of viewers currently watching the stream
 	"""
-	stream_info = twitch.get_info()
+	stream_info = yield from twitch.get_info_coro()
 	if stream_info:
 		viewers = stream_info.get("viewers")
 	else:
@@ -182,9 +176,7 @@ def viewers(lrrbot, conn, event, respond_to):
 	chatters = "%d %s in the chat." % (chatters, "user" if chatters == 1 else "users")
 	conn.privmsg(respond_to, "%s %s" % (viewers, chatters))
 
-def uptime_msg(stream_info=None, factor=1):
-	if stream_info is None:
-		stream_info = twitch.get_info()
+def uptime_msg(stream_info, factor=1):
 	if stream_info and stream_info.get("stream_created_at"):
 		start = dateutil.parser.parse(stream_info["stream_created_at"])
 		now = datetime.datetime.now(datetime.timezone.utc)
@@ -196,21 +188,22 @@ def uptime_msg(stream_info=None, factor=1):
 
 @bot.command("(uptime|updog)")
 @lrrbot.decorators.throttle()
-def uptime(lrrbot, conn, event, respond_to, command):
+async def uptime(lrrbot, conn, event, respond_to, command):
 	"""
 	Command: !uptime
 	Section: info
 
 	Post the duration the stream has been live.
 	"""
-	conn.privmsg(respond_to, uptime_msg(factor=7 if command == "updog" else 1))
+	stream_info = await twitch.get_info_coro()
+	conn.privmsg(respond_to, uptime_msg(stream_info, factor=7 if command == "updog" else 1))
 
 @utils.cache(30) # We could easily be sending a bunch of these at once, and the info doesn't change often
-def get_status_msg(lrrbot):
+async def get_status_msg(lrrbot):
 	messages = []
-	stream_info = twitch.get_info()
+	stream_info = await twitch.get_info_coro()
 	if stream_info and stream_info.get('live'):
-		game_id = lrrbot.get_game_id()
+		game_id = await lrrbot.get_game_id()
 		show_id = lrrbot.get_show_id()
 
 		shows = lrrbot.metadata.tables["shows"]
@@ -247,11 +240,11 @@ def get_status_msg(lrrbot):
 		messages.append(random.choice(storage.data['responses']['advice']['response']))
 	return ' '.join(messages)
 
-def send_status(lrrbot, conn, target):
-	conn.privmsg(target, get_status_msg(lrrbot))
+async def send_status(lrrbot, conn, target):
+	conn.privmsg(target, await get_status_msg(lrrbot))
 
 @bot.command("status")
-def status(lrrbot, conn, event, respond_to):
+async def status(lrrbot, conn, event, respond_to):
 	"""
 	Command: !status
 	Section: info
@@ -261,7 +254,7 @@ def status(lrrbot, conn, event, respond_to):
 	Otherwise, it will tell you about the next scheduled stream.
 	"""
 	source = irc.client.NickMask(event.source)
-	send_status(lrrbot, conn, source.nick)
+	await send_status(lrrbot, conn, source.nick)
 
 @bot.command("auto(?: |-)?status")
 def autostatus_check(lrrbot, conn, event, respond_to):
@@ -309,5 +302,5 @@ def autostatus_on_join(conn, event):
 		if res is not None:
 			enabled, = res
 			if res[0]:
-				send_status(bot, conn, source.nick)
+				asyncio.ensure_future(send_status(bot, conn, source.nick)).add_done_callback(utils.check_exception)
 bot.reactor.add_global_handler('join', autostatus_on_join, 99)
@@ -19,9 +19,7 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-import common.postgres
 import common.time
-import common.utils
 import lrrbot.decorators
 from lrrbot.main import bot
 
@@ -55,25 +53,16 @@ def quote(lrrbot, conn, event, respond_to, meta_param, meta_value, qid, attrib):
 
 	Post the quotation with the specified ID.
 	"""
-	quotes = lrrbot.metadata.tables["quotes"]
-	games = lrrbot.metadata.tables["games"]
-	shows = lrrbot.metadata.tables["shows"]
-	query = sqlalchemy.select([quotes.c.id, quotes.c.quote, quotes.c.attrib_name, quotes.c.attrib_date, quotes.c.context])
-	source = quotes
 	if qid:
-		query = query.where(quotes.c.id == int(qid))
-	elif meta_param:
-		if meta_param == "game":
-			query = query.where(games.c.name.ilike("%" + common.postgres.escape_like(meta_value.lower()) + "%"))
-			source = source.join(games, games.c.id == quotes.c.game_id)
-		elif meta_param == "show":
-			query = query.where(shows.c.name.ilike("%" + common.postgres.escape_like(meta_value.lower()) + "%"))
-			source = source.join(shows, shows.c.id == quotes.c.show_id)
+		row = lrrbot.quote_index.get(int(qid))
+	elif meta_param == "game":
+		row = lrrbot.quote_index.random_by_game(meta_value)
+	elif meta_param == "show":
+		row = lrrbot.quote_index.random_by_show(meta_value)
 	elif attrib:
-		query = query.where(quotes.c.attrib_name.ilike("%" + common.postgres.escape_like(attrib.lower()) + "%"))
-	query = query.select_from(source).where(~quotes.c.deleted)
-	with lrrbot.engine.begin() as pg_conn:
-		row = common.utils.pick_random_elements(pg_conn.execute(query), 1)[0]
+		row = lrrbot.quote_index.random_by_attrib(attrib)
+	else:
+		row = lrrbot.quote_index.random()
 	if row is None:
 		conn.privmsg(respond_to, "Could not find any matching quotes.")
 		return
@@ -83,7 +72,7 @@ def quote(lrrbot, conn, event, respond_to, meta_param, meta_value, qid, attrib):
 
 @bot.command("addquote(?: \((.+?)\))?(?: \[(.+?)\])? ([^\|]+?)(?: ?\| ?([^\|]*))?")
 @lrrbot.decorators.mod_only
-def addquote(lrrbot, conn, event, respond_to, name, date, quote, context):
+async def addquote(lrrbot, conn, event, respond_to, name, date, quote, context):
 	"""
 	Command: !addquote (NAME) [DATE] QUOTE | CONTEXT
 	Command: !addquote (NAME) [DATE] QUOTE
@@ -100,10 +89,12 @@ def addquote(lrrbot, conn, event, respond_to, name, date, quote, context):
 		except ValueError:
 			return conn.privmsg(respond_to, "Could not add quote due to invalid date.")
 	quotes = lrrbot.metadata.tables["quotes"]
-	game_id = lrrbot.get_game_id()
+	game_id = await lrrbot.get_game_id()
 	show_id = lrrbot.get_show_id()
 	with lrrbot.engine.begin() as pg_conn:
 		qid, = pg_conn.execute(quotes.insert().returning(quotes.c.id), quote=quote, attrib_name=name, attrib_date=date, context=context, game_id=game_id, show_id=show_id).first()
+	lrrbot.quote_index.add(qid, quote, name, date, context, game_id, show_id)
+	lrrbot.tweets.update_quote(qid, quote, name, context)
 
 	conn.privmsg(respond_to, format_quote("New quote", qid, quote, name, date, context))
 
@@ -131,6 +122,8 @@ def modquote(lrrbot, conn, event, respond_to, qid, name, date, quote, context):
 		res = pg_conn.execute(quotes.update().where((quotes.c.id == int(qid)) & (~quotes.c.deleted)),
 			quote=quote, attrib_name=name, attrib_date=date, context=context)
 	if res.rowcount == 1:
+		lrrbot.quote_index.update(int(qid), quote, name, date, context)
+		lrrbot.tweets.update_quote(int(qid), quote, name, context)
 		conn.privmsg(respond_to, format_quote("Modified quote", qid, quote, name, date, context))
 	else:
 		conn.privmsg(respond_to, "Could not modify quote.")
@@ -149,6 +142,8 @@ def delquote(lrrbot, conn, event, respond_to, qid):
 	with lrrbot.engine.begin() as pg_conn:
 		res = pg_conn.execute(quotes.update().where(quotes.c.id == int(qid)), deleted=True)
 	if res.rowcount == 1:
+		lrrbot.quote_index.remove(int(qid))
+		lrrbot.tweets.remove_quote(int(qid))
 		conn.privmsg(respond_to, "Marked quote #{qid} as deleted.".format(qid=qid))
 	else:
 		conn.privmsg(respond_to, "Could not find quote #{qid}.".format(qid=qid))
@@ -164,15 +159,17 @@ def findquote(lrrbot, conn, event, respond_to, query):
 	Search for a quote in the quote database.
 	"""
 
-	quotes = lrrbot.metadata.tables["quotes"]
-	with lrrbot.engine.begin() as pg_conn:
-		fts_column = sqlalchemy.func.to_tsvector('english', quotes.c.quote)
-		query = sqlalchemy.select([
-			quotes.c.id, quotes.c.quote, quotes.c.attrib_name, quotes.c.attrib_date, quotes.c.context
-		]).where(
-			(fts_column.op("@@")(sqlalchemy.func.plainto_tsquery('english', query))) & (~quotes.c.deleted)
-		)
-		row = common.utils.pick_random_elements(pg_conn.execute(query), 1)[0]
+	row = lrrbot.quote_index.find(query)
+	if row is None:
+		# Nothing has all the words exactly, so let Postgres try with stemming
+		quotes = lrrbot.metadata.tables["quotes"]
+		with lrrbot.engine.begin() as pg_conn:
+			fts_column = sqlalchemy.func.to_tsvector('english', quotes.c.quote)
+			row = pg_conn.execute(sqlalchemy.select([
+				quotes.c.id, quotes.c.quote, quotes.c.attrib_name, quotes.c.attrib_date, quotes.c.context
+			]).where(
+				(fts_column.op("@@")(sqlalchemy.func.plainto_tsquery('english', query))) & (~quotes.c.deleted)
+			).order_by(sqlalchemy.func.random()).limit(1)).first()
 	if row is None:
 		return conn.privmsg(respond_to, "Could not find any matching quotes.")
 	qid, quote, name, date, context = row
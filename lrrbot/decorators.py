@@ -158,7 +158,7 @@ def private_reply_when_live(func):
 	@functools.wraps(func)
 	@asyncio.coroutine
 	def wrapper(self, conn, event, respond_to, *args, **kwargs):
-		if event.type == "pubmsg" and twitch.get_info()["live"]:
+		if event.type == "pubmsg" and (yield from twitch.is_stream_live_coro()):
 			source = irc.client.NickMask(event.source)
 			respond_to = source.nick
 		return (yield from func(self, conn, event, respond_to, *args, **kwargs))
@@ -0,0 +1,311 @@
+import contextlib
+import logging
+import threading
+
+import sqlalchemy
+from sqlalchemy.dialects.postgresql import insert
+
+log = logging.getLogger('gamestats')
+
+# How often, in seconds, queued stat changes are written to `game_stats`
+FLUSH_INTERVAL = 10
+
+class GameStats:
+	"""
+	In-memory cache of the game stats, so that `!death` and friends don't need to
+	hit the database on every use.
+
+	The stat definitions and `disabled_stats` are loaded once on startup (the
+	command regexes are built from the stat list then too). The counts for a
+	(game, show) pair, along with the names needed to print them, are loaded the
+	first time they're needed. Changes are applied to the cache immediately and
+	queued, and the queue is written to `game_stats` in one go every
+	`FLUSH_INTERVAL` seconds.
+
+	Anything in the bot that reads `game_stats` directly should call `flush`
+	first, and anything that changes game names or IDs should call `invalidate`.
+	The web server can't, so what it reads can be up to `FLUSH_INTERVAL` seconds
+	behind; `/api/stats`, which overlays poll, asks the bot instead.
+
+	Coroutines should call `get_game_coro` before the other methods, so that the
+	game is already cached and nothing blocks the event loop.
+
+	`lock` only ever protects the in-memory state, and is never held while
+	waiting on the database: the worker thread that merges games holds table
+	locks while it needs `lock`, so the other way around would deadlock.
+	"""
+
+	def __init__(self, lrrbot, loop):
+		self.lrrbot = lrrbot
+		self.loop = loop
+		# The queue can also be flushed from the worker thread that merges games
+		self.lock = threading.RLock()
+		self.pending = {}
+		# How many sets of changes have been taken off the queue and not yet been
+		# committed or put back, and a counter bumped whenever that changes. See
+		# `get_game`.
+		self.writing = 0
+		self.write_generation = 0
+		self.games = {}
+		# Games that are in the middle of being merged, see `merging`
+		self.frozen = set()
+		# Bumped on every change, so that anything derived from the stats knows when
+		# it needs to be recalculated
+		self.version = 0
+		# Called with `(game_id, show_id, game, stat, count)` after a stat changes,
+		# and with nothing after `invalidate`, for anything that keeps its own copy
+		# of the stats up to date. `on_invalidate` can be called from other threads.
+		self.on_change = []
+		self.on_invalidate = []
+		self.load_definitions()
+		self.lrrbot.reactor.execute_every(period=FLUSH_INTERVAL, function=self.flush)
+
+	def load_definitions(self):
+		stats = self.lrrbot.metadata.tables["stats"]
+		disabled_stats = self.lrrbot.metadata.tables["disabled_stats"]
+		with self.lrrbot.engine.begin() as conn:
+			self.stats = {
+				string_id: {
+					"id": id,
+					"singular": singular or string_id,
+					"plural": plural or (singular or string_id) + "s",
+					"emote": emote,
+				}
+				for id, string_id, singular, plural, emote in conn.execute(sqlalchemy.select([
+					stats.c.id, stats.c.string_id, stats.c.singular, stats.c.plural, stats.c.emote,
+				]))
+			}
+			self.disabled = set(conn.execute(sqlalchemy.select([disabled_stats.c.show_id, disabled_stats.c.stat_id])))
+
+	def get_stat(self, string_id):
+		return self.stats[string_id.lower()]
+
+	def is_disabled(self, show_id, stat):
+		return (show_id, stat["id"]) in self.disabled
+
+	def get_game(self, game_id, show_id):
+		"""
+		Get the cached data for a game on a show: the display name of the game, the
+		name of the show, and the counts of all its stats.
+		"""
+		while True:
+			with self.lock:
+				game = self.games.get((game_id, show_id))
+				if game is not None:
+					return game
+				generation = self.write_generation
+				writing = self.writing
+
+			name, show, counts = self.load_game(game_id, show_id)
+
+			with self.lock:
+				game = self.games.get((game_id, show_id))
+				if game is not None:
+					return game
+				# If changes were being written while the counts were loaded, there's no
+				# telling whether the counts include them, so load them again.
+				if writing or generation != self.write_generation:
+					continue
+
+				# Apply anything that's still waiting to be written
+				for (pending_game_id, pending_show_id, stat_id), (is_set, n) in self.pending.items():
+					if (pending_game_id, pending_show_id) == (game_id, show_id):
+						counts[stat_id] = n if is_set else counts.get(stat_id, 0) + n
+
+				game = self.games[game_id, show_id] = {
+					"name": name,
+					"show": show,
+					"counts": counts,
+				}
+				return game
+
+	async def get_game_coro(self, game_id, show_id):
+		"""
+		Like `get_game`, but if the game isn't cached yet, it's loaded in the
+		executor, so the event loop doesn't wait on the database (or on a merge
+		that's being written).
+		"""
+		with self.lock:
+			game = self.games.get((game_id, show_id))
+		if game is not None:
+			return game
+		return await self.loop.run_in_executor(None, self.get_game, game_id, show_id)
+
+	def load_game(self, game_id, show_id):
+		games = self.lrrbot.metadata.tables["games"]
+		shows = self.lrrbot.metadata.tables["shows"]
+		game_per_show_data = self.lrrbot.metadata.tables["game_per_show_data"]
+		game_stats = self.lrrbot.metadata.tables["game_stats"]
+		with self.lrrbot.engine.begin() as conn:
+			name, show = conn.execute(sqlalchemy.select([
+				sqlalchemy.func.coalesce(game_per_show_data.c.display_name, games.c.name),
+				shows.c.name,
+			]).select_from(
+				games
+					.join(shows, shows.c.id == show_id)
+					.outerjoin(game_per_show_data, (game_per_show_data.c.game_id == games.c.id)
+						& (game_per_show_data.c.show_id == shows.c.id))
+			).where(games.c.id == game_id)).first()
+			counts = dict(conn.execute(sqlalchemy.select([game_stats.c.stat_id, game_stats.c.count])
+				.where(game_stats.c.game_id == game_id)
+				.where(game_stats.c.show_id == show_id)))
+		return name, show, counts
+
+	def get_count(self, game_id, show_id, stat):
+		return self.get_game(game_id, show_id)["counts"].get(stat["id"], 0)
+
+	def increment(self, game_id, show_id, stat, n):
+		"""Add `n` to a stat. Returns the new count."""
+		# Load the game first, as that might need the database
+		game = self.get_game(game_id, show_id)
+		counts = game["counts"]
+		with self.lock:
+			counts[stat["id"]] = count = counts.get(stat["id"], 0) + n
+			key = (game_id, show_id, stat["id"])
+			is_set, pending = self.pending.get(key, (False, 0))
+			self.pending[key] = (is_set, pending + n)
+			self.version += 1
+		for callback in self.on_change:
+			callback(game_id, show_id, game, stat, count)
+		return count
+
+	def set(self, game_id, show_id, stat, n):
+		"""Set a stat to `n`. Returns the new count."""
+		game = self.get_game(game_id, show_id)
+		counts = game["counts"]
+		with self.lock:
+			counts[stat["id"]] = n
+			self.pending[game_id, show_id, stat["id"]] = (True, n)
+			self.version += 1
+		for callback in self.on_change:
+			callback(game_id, show_id, game, stat, n)
+		return n
+
+	def format(self, game_id, show_id, stat, with_emote=False):
+		game = self.get_game(game_id, show_id)
+		count = game["counts"].get(stat["id"], 0)
+		if with_emote and stat["emote"] is not None:
+			emote = stat["emote"] + " "
+		else:
+			emote = ""
+		return "%s%d %s for %s on %s" % (emote, count, stat["singular"] if count == 1 else stat["plural"], game["name"], game["show"])
+
+	def flush(self):
+		"""Write all the queued changes to `game_stats`."""
+		with self.flushing() as pending:
+			if pending:
+				with self.lrrbot.engine.begin() as conn:
+					self.write(conn, pending)
+
+	@contextlib.contextmanager
+	def flushing(self, include_frozen=False):
+		"""
+		Take the queued changes off the queue, for the caller to `write` in a
+		transaction that's committed by the end of the `with` block. If the block
+		fails, they go back on the queue.
+
+		Usage:
+		with game_stats.flushing() as pending:
+			with engine.begin() as conn:
+				game_stats.write(conn, pending)
+		"""
+		with self.lock:
+			pending = {
+				key: value
+				for key, value in self.pending.items()
+				if include_frozen or key[0] not in self.frozen
+			}
+			for key in pending:
+				del self.pending[key]
+			self.writing += 1
+			self.write_generation += 1
+		try:
+			yield pending
+		except BaseException:
+			self.restore(pending)
+			raise
+		finally:
+			with self.lock:
+				self.writing -= 1
+				self.write_generation += 1
+
+	def restore(self, pending):
+		"""Put changes that failed to be written back on the queue, under any newer ones."""
+		with self.lock:
+			for key, (is_set, n) in pending.items():
+				new_set, new_n = self.pending.get(key, (False, 0))
+				if new_set:
+					continue
+				self.pending[key] = (is_set, n + new_n)
+
+	def write(self, conn, pending):
+		game_stats = self.lrrbot.metadata.tables["game_stats"]
+		for is_set in (True, False):
+			rows = [
+				{"game_id": game_id, "show_id": show_id, "stat_id": stat_id, "count": n}
+				for (game_id, show_id, stat_id), (pending_set, n) in pending.items()
+				if pending_set == is_set
+			]
+			if not rows:
+				continue
+			query = insert(game_stats)
+			query = query.on_conflict_do_update(
+				index_elements=[game_stats.c.game_id, game_stats.c.show_id, game_stats.c.stat_id],
+				set_={
+					'count': query.excluded.count if is_set else game_stats.c.count + query.excluded.count,
+				}
+			)
+			conn.execute(query, rows)
+		log.debug("Wrote %d stat changes", len(pending))
+
+	def invalidate(self, game_id=None, show_id=None):
+		"""
+		Forget the cached names and counts for a game (on one show, or all of them),
+		or for everything. Queued changes are kept.
+		"""
+		with self.lock:
+			self.version += 1
+			if game_id is None:
+				self.games = {}
+			else:
+				for key in list(self.games):
+					if key[0] == game_id and (show_id is None or key[1] == show_id):
+						del self.games[key]
+		for callback in self.on_invalidate:
+			callback()
+
+	def merging(self, game_id):
+		"""
+		Stop writing changes for a game that's about to be merged into another one,
+		as the game might be gone by the time they're written. The merge itself
+		should write what `flushing(include_frozen=True)` gives it with the tables
+		locked, and then call `merged` once it's committed, or `unfreeze` if it
+		failed.
+		"""
+		with self.lock:
+			self.frozen.add(game_id)
+
+	def unfreeze(self, game_id):
+		"""Start writing changes for a game again, after merging it failed."""
+		with self.lock:
+			self.frozen.discard(game_id)
+
+	def merged(self, old_id, new_id):
+		"""
+		Move the changes queued for `old_id` over to `new_id`, after `merge_games`
+		has moved the rows in the database.
+		"""
+		with self.lock:
+			for (game_id, show_id, stat_id), (is_set, n) in list(self.pending.items()):
+				if game_id != old_id:
+					continue
+				del self.pending[game_id, show_id, stat_id]
+				key = (new_id, show_id, stat_id)
+				if is_set:
+					self.pending[key] = (True, n)
+				else:
+					new_set, new_n = self.pending.get(key, (False, 0))
+					self.pending[key] = (new_set, new_n + n)
+			self.frozen.discard(old_id)
+			self.invalidate(old_id)
+			self.invalidate(new_id)
@@ -16,6 +16,9 @@ CACHE_EXPIRY = 15*60
 CALENDAR_LRL = "loadingreadyrun.com_72jmf1fn564cbbr84l048pv1go@group.calendar.google.com"
 CALENDAR_FAN = "caffeinatedlemur@gmail.com"
 EVENT_COUNT = 10
+# How many more events to ask for, to make up for the ones that ended between the
+# start of the hour and now, see `get_upcoming_events`
+EXTRA_EVENT_COUNT = 5
 
 EVENTS_URL = "https://www.googleapis.com/calendar/v3/calendars/%s/events"
 DATE_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
@@ -41,32 +44,43 @@ def get_upcoming_events(calendar, after=None):
 	"""
 	if after is None:
 		after = datetime.datetime.now(datetime.timezone.utc)
+	# Ask for everything since the start of the hour, so that the URL stays the
+	# same for a while and the HTTP cache can revalidate it instead of downloading
+	# it again. Events that ended earlier in the hour come back too, so ask for a
+	# few more than needed, and keep going if that wasn't enough.
+	time_min = after.replace(minute=0, second=0, microsecond=0)
 	url = EVENTS_URL % urllib.parse.quote(calendar)
 	data = {
-		"maxResults": EVENT_COUNT,
+		"maxResults": EVENT_COUNT + EXTRA_EVENT_COUNT,
 		"orderBy": "startTime",
 		"singleEvents": "true",
-		"timeMin": after.strftime(DATE_FORMAT),
+		"timeMin": time_min.strftime(DATE_FORMAT),
 		"timeZone": config['timezone'].zone,
 		"key": config['google_key'],
 	}
-	res = common.http.request(url, data)
-	res = json.loads(res)
-	if 'error' in res:
-		raise Exception(res['error']['message'])
 	formatted_items = []
-	for item in res['items']:
-		formatted_items.append({
-			"id": item['id'],
-			"url": item['htmlLink'],
-			"title": item['summary'],
-			"creator": item['creator']['displayName'],
-			"start": dateutil.parser.parse(item['start']['dateTime']),
-			"end": dateutil.parser.parse(item['end']['dateTime']),
-			"location": item.get('location'),
-			"description": item.get('description'),
-		})
-	return formatted_items
+	while True:
+		res = common.http.request(url, data)
+		res = json.loads(res)
+		if 'error' in res:
+			raise Exception(res['error']['message'])
+		for item in res['items']:
+			if dateutil.parser.parse(item['end']['dateTime']) <= after:
+				continue
+			formatted_items.append({
+				"id": item['id'],
+				"url": item['htmlLink'],
+				"title": item['summary'],
+				"creator": item['creator']['displayName'],
+				"start": dateutil.parser.parse(item['start']['dateTime']),
+				"end": dateutil.parser.parse(item['end']['dateTime']),
+				"location": item.get('location'),
+				"description": item.get('description'),
+			})
+		if len(formatted_items) >= EVENT_COUNT or 'nextPageToken' not in res:
+			break
+		data = dict(data, pageToken=res['nextPageToken'])
+	return formatted_items[:EVENT_COUNT]
 
 def get_next_event(calendar, after=None, include_current=False):
 	"""
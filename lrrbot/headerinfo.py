@@ -0,0 +1,147 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+import sqlalchemy
+
+from common import game_data
+from common import twitch
+from common import utils
+from common.config import config
+from lrrbot import googlecalendar, storage
+
+log = logging.getLogger('headerinfo')
+
+# How often, in seconds, the header is rebuilt
+UPDATE_INTERVAL = 5
+
+class HeaderInfo:
+	"""
+	The information in the header of every page on the website: whether the
+	stream is live, the current game and show with their names, rating and stats,
+	or when the next stream is.
+
+	It's rebuilt every `UPDATE_INTERVAL` seconds, and whenever it changes the new
+	snapshot is written to `config['header_snapshot']`, where the web server
+	picks it up without having to ask the bot. `version` goes up on every change,
+	and the web server caches pages by it. The file is also touched on every
+	rebuild even if nothing changed, so the web server can tell when the bot has
+	stopped updating it.
+	"""
+
+	def __init__(self, lrrbot, loop):
+		self.lrrbot = lrrbot
+		self.loop = loop
+		# Start from the time, rather than 0, so that the versions from before a
+		# restart aren't used again: there's at most one change per update.
+		self.version = int(time.time())
+		self.snapshot = None
+		self.updating = None
+		self.schedule_update()
+		self.lrrbot.reactor.execute_every(period=UPDATE_INTERVAL, function=self.schedule_update)
+
+	async def build(self):
+		live = await twitch.is_stream_live_coro()
+		game_id = await self.lrrbot.get_game_id()
+
+		data = {
+			"is_live": live,
+			"channel": config['channel'],
+		}
+
+		if live and game_id is not None:
+			show_id = self.lrrbot.get_show_id()
+			game = await self.lrrbot.game_stats.get_game_coro(game_id, show_id)
+			data['current_game'] = {
+				"id": game_id,
+				"display": game["name"],
+				"is_override": self.lrrbot.game_override is not None,
+				"stats": self.get_stats(show_id, game["counts"]),
+			}
+			data['current_show'] = {
+				"id": show_id,
+				"name": game["show"],
+				"is_override": self.lrrbot.show_override is not None,
+			}
+			rating = self.get_rating(game_id, show_id)
+			if rating is not None:
+				data['current_game']['rating'] = rating
+		elif not live:
+			data['nextstream'] = await self.loop.run_in_executor(None, googlecalendar.get_next_event_text, googlecalendar.CALENDAR_LRL)
+
+		# The web server picks one of these for each page
+		if 'advice' in storage.data['responses']:
+			data['advice'] = storage.data['responses']['advice']['response']
+
+		return data
+
+	def get_stats(self, show_id, counts):
+		stats = [
+			{
+				'count': counts[stat["id"]],
+				'type': stat["singular"] if counts[stat["id"]] == 1 else stat["plural"],
+			}
+			for stat in self.lrrbot.game_stats.stats.values()
+			if counts.get(stat["id"]) and not self.lrrbot.game_stats.is_disabled(show_id, stat)
+		]
+		stats.sort(key=lambda stat: stat['count'], reverse=True)
+		return stats
+
+	def get_rating(self, game_id, show_id):
+		game_vote_totals = self.lrrbot.metadata.tables["game_vote_totals"]
+		with self.lrrbot.engine.begin() as conn:
+			rating = conn.execute(sqlalchemy.select([
+				game_data.vote_rating(game_vote_totals),
+				game_vote_totals.c.good,
+				game_vote_totals.c.total,
+			]).where(game_vote_totals.c.game_id == game_id).where(game_vote_totals.c.show_id == show_id)).first()
+		if rating is None:
+			return None
+		return {
+			'perc': float(rating[0]),
+			'good': rating[1],
+			'total': rating[2],
+		}
+
+	def schedule_update(self):
+		# Don't pile up updates if Twitch is being slow
+		if self.updating is None or self.updating.done():
+			self.updating = asyncio.ensure_future(self.update(), loop=self.loop)
+			self.updating.add_done_callback(utils.check_exception)
+
+	async def update(self):
+		try:
+			data = await self.build()
+		except Exception:
+			log.exception("Failed to update the header")
+			return
+		if data == self.snapshot:
+			self.touch()
+			return
+		self.snapshot = data
+		self.version += 1
+		self.write()
+
+	async def get(self):
+		if self.snapshot is None:
+			await self.update()
+		if self.snapshot is None:
+			raise Exception("Header information isn't available")
+		return dict(self.snapshot, version=self.version)
+
+	def write(self):
+		# Write to a temporary file and rename it over the old one, so the web
+		# server never sees half a snapshot
+		filename = config['header_snapshot']
+		tmpfilename = filename + ".tmp"
+		with open(tmpfilename, "w") as fp:
+			json.dump(dict(self.snapshot, version=self.version), fp)
+		os.replace(tmpfilename, filename)
+
+	def touch(self):
+		try:
+			os.utime(config['header_snapshot'])
+		except FileNotFoundError:
+			self.write()
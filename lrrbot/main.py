@@ -21,7 +21,12 @@ from common import twitch
 from common import slack
 from common import game_data
 from common.pubsub import PubSub
-from lrrbot import chatlog, storage, twitchsubs, whisper, asyncreactor, linkspam, cardviewer
+from lrrbot import chatlog, storage, twitchsubs, whisper, asyncreactor, linkspam, cardviewer, cardindex
+from lrrbot import gamestats
+from lrrbot import tweets
+from lrrbot import quoteindex
+from lrrbot import stormcounter
+from lrrbot import headerinfo
 from lrrbot import spam
 from lrrbot import command_parser
 from lrrbot import rpc
@@ -91,6 +96,15 @@ class LRRBot(irc.bot.SingleServerIRCBot):
 		# create pubnub listener
 		self.cardviewer = cardviewer.CardViewer(self, self.loop)
 
+		self.card_index = cardindex.CardIndex(self.engine, self.metadata)
+		self.card_index.load()
+
+		self.game_stats = gamestats.GameStats(self, self.loop)
+		self.quote_index = quoteindex.QuoteIndex(self, self.loop)
+		self.tweets = tweets.TweetGenerator(self, self.loop)
+		self.storm = stormcounter.StormCounter(self, self.loop)
+		self.header_info = headerinfo.HeaderInfo(self, self.loop)
+
 		# IRC event handlers
 		self.reactor.add_global_handler('welcome', self.check_privmsg_wrapper, 0)
 		self.reactor.add_global_handler('welcome', self.on_connect, 1)
@@ -109,6 +123,8 @@ class LRRBot(irc.bot.SingleServerIRCBot):
 		# Set up bot state
 		self.game_override = None
 		self.show_override = None
+		self.known_games = {}
+		self.pending_game_merges = set()
 		self.vote_update = None
 		self.access = "all"
 		self.set_show("")
@@ -164,6 +180,8 @@ class LRRBot(irc.bot.SingleServerIRCBot):
 				tasks_waiting.append(self.whisperconn.stop_task())
 			self.cardviewer.stop()
 			self.loop.run_until_complete(asyncio.wait(tasks_waiting))
+			self.game_stats.flush()
+			self.storm.flush()
 
 	def disconnect(self, msg="I'll be back!"):
 		self.missed_pings = 0
@@ -315,34 +333,80 @@ class LRRBot(irc.bot.SingleServerIRCBot):
 			chatlog.clear_chat_log(event.arguments[0])
 
 	@utils.cache(twitch.GAME_CHECK_INTERVAL)
-	def get_game_id(self):
+	async def get_game_id(self):
 		if self.game_override is None:
-			game = twitch.get_game_playing()
+			game = await twitch.get_game_playing_coro()
 			if game is None:
 				return None
 			game_id, game_name = game["_id"], game["name"]
 
+			# Fast path: still the same game as last time, nothing to update
+			if self.known_games.get(game_name) == game_id:
+				return game_id
+
 			games = self.metadata.tables["games"]
 			with self.engine.begin() as conn:
-				game_data.lock_tables(conn, self.metadata)
 				old_id = conn.execute(sqlalchemy.select([games.c.id]).where(games.c.name == game_name)).first()
 				if old_id is None:
-					conn.execute(games.insert(), {
+					conn.execute(insert(games).on_conflict_do_nothing(index_elements=[games.c.id]), {
 						"id": game_id,
 						"name": game_name
 					})
+					old_id = game_id
 				else:
 					old_id, = old_id
-					conn.execute(insert(games).on_conflict_do_nothing(index_elements=[games.c.id]), {
-						"id": game_id,
-						"name": "__LRRBOT_TEMP_GAME_%s__" % game_name,
-					})
+					if old_id != game_id:
+						conn.execute(insert(games).on_conflict_do_nothing(index_elements=[games.c.id]), {
+							"id": game_id,
+							"name": "__LRRBOT_TEMP_GAME_%s__" % game_name,
+						})
+			if old_id == game_id:
+				self.known_games[game_name] = game_id
+				return game_id
+
+			# Twitch has a new ID for a game we already know. Merging the two needs all
+			# the tables that reference `games` locked, so do it in the background and
+			# keep using the old ID until it's done.
+			if game_id not in self.pending_game_merges:
+				self.pending_game_merges.add(game_id)
+				self.game_stats.merging(old_id)
+				self.loop.run_in_executor(None, self.merge_game, old_id, game_id, game_name) \
+					.add_done_callback(functools.partial(self.on_game_merged, game_id, game_name))
+			return old_id
+		return self.game_override
+
+	def merge_game(self, old_id, game_id, game_name):
+		"""
+			Merge the game called `game_name` (with ID `old_id`) into the Twitch-assigned
+			`game_id`.
+
+			Runs in a worker thread, see `get_game_id`. Anything the event loop uses is
+			updated afterwards, in `on_game_merged`.
+		"""
+		try:
+			games = self.metadata.tables["games"]
+			with self.game_stats.flushing(include_frozen=True) as pending:
+				with self.engine.begin() as conn:
+					game_data.lock_tables(conn, self.metadata)
+					self.game_stats.write(conn, pending)
 					game_data.merge_games(conn, self.metadata, old_id, game_id, game_id)
 					conn.execute(games.update().where(games.c.id == game_id), {
 						"name": game_name,
 					})
-			return game_id
-		return self.game_override
+		except Exception:
+			# Nothing was moved, so the queued changes can be written to the old game after all
+			self.game_stats.unfreeze(old_id)
+			raise
+		self.game_stats.merged(old_id, game_id)
+		log.info("Merged game %r into ID %s", game_name, game_id)
+
+	def on_game_merged(self, game_id, game_name, future):
+		self.pending_game_merges.discard(game_id)
+		if not future.cancelled() and future.exception() is None:
+			self.known_games[game_name] = game_id
+			self.quote_index.load()
+			self.get_game_id.reset_throttle()
+		utils.check_exception(future)
 
 	def override_game(self, name):
 		"""
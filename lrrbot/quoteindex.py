@@ -0,0 +1,195 @@
+import logging
+import random
+import re
+
+import sqlalchemy
+
+from common import utils
+
+log = logging.getLogger('quoteindex')
+
+re_words = re.compile(r"\w+")
+
+def words(text):
+	return set(word.lower() for word in re_words.findall(text or ""))
+
+class Bucket:
+	"""
+	A set of quote IDs that can also pick a random element in constant time.
+	"""
+	def __init__(self):
+		self.ids = []
+		self.positions = {}
+
+	def __len__(self):
+		return len(self.ids)
+
+	def add(self, qid):
+		if qid not in self.positions:
+			self.positions[qid] = len(self.ids)
+			self.ids.append(qid)
+
+	def remove(self, qid):
+		i = self.positions.pop(qid, None)
+		if i is None:
+			return
+		last = self.ids.pop()
+		if i < len(self.ids):
+			self.ids[i] = last
+			self.positions[last] = i
+
+	def choice(self):
+		return random.choice(self.ids)
+
+class QuoteIndex:
+	"""
+	In-memory index of the quote database, for `!quote` and `!findquote`.
+
+	Quote IDs are bucketed by the lower-cased attribution, the game and the show,
+	and there's an inverted index from each word of the quote to the quotes that
+	contain it. Filters like `!quote game NAME` are substring matches, so they're
+	checked against the distinct keys (of which there are far fewer than quotes),
+	and then a random quote is picked from the matching buckets.
+
+	The `!addquote`, `!modquote` and `!delquote` commands keep this up to date,
+	and the whole thing is reloaded when games get merged.
+	"""
+	def __init__(self, lrrbot, loop):
+		self.lrrbot = lrrbot
+		self.loop = loop
+		self.load()
+
+	def load(self):
+		quotes = self.lrrbot.metadata.tables["quotes"]
+		games = self.lrrbot.metadata.tables["games"]
+		shows = self.lrrbot.metadata.tables["shows"]
+		with self.lrrbot.engine.begin() as conn:
+			rows = conn.execute(sqlalchemy.select([
+				quotes.c.id, quotes.c.quote, quotes.c.attrib_name, quotes.c.attrib_date, quotes.c.context,
+				quotes.c.game_id, quotes.c.show_id,
+			]).where(~quotes.c.deleted)).fetchall()
+			game_names = {id: name.lower() for id, name in conn.execute(sqlalchemy.select([games.c.id, games.c.name])
+				.where(games.c.id.in_(sqlalchemy.select([quotes.c.game_id]))))}
+			show_names = {id: name.lower() for id, name in conn.execute(sqlalchemy.select([shows.c.id, shows.c.name])
+				.where(shows.c.id.in_(sqlalchemy.select([quotes.c.show_id]))))}
+
+		self.quotes = {}
+		self.all = Bucket()
+		self.by_attrib = {}
+		self.by_game = {}
+		self.by_show = {}
+		self.by_word = {}
+		self.game_names = game_names
+		self.show_names = show_names
+		for qid, quote, name, date, context, game_id, show_id in rows:
+			self.add(qid, quote, name, date, context, game_id, show_id)
+		log.info("Loaded %d quotes into the quote index", len(self.quotes))
+
+	def add(self, qid, quote, name, date, context, game_id, show_id):
+		"""Add a new quote to the index, or replace an existing one."""
+		self.remove(qid)
+		self.quotes[qid] = (quote, name, date, context, game_id, show_id)
+		self.all.add(qid)
+		if name:
+			self.by_attrib.setdefault(name.lower(), Bucket()).add(qid)
+		if game_id is not None:
+			self.by_game.setdefault(game_id, Bucket()).add(qid)
+			if game_id not in self.game_names:
+				self.game_names[game_id] = self._get_name("games", game_id)
+		if show_id is not None:
+			self.by_show.setdefault(show_id, Bucket()).add(qid)
+			if show_id not in self.show_names:
+				self.show_names[show_id] = self._get_name("shows", show_id)
+		for word in words(quote):
+			self.by_word.setdefault(word, set()).add(qid)
+
+	def update(self, qid, quote, name, date, context):
+		"""Change the text of a quote, keeping its game and show."""
+		if qid in self.quotes:
+			game_id, show_id = self.quotes[qid][4:]
+			self.add(qid, quote, name, date, context, game_id, show_id)
+
+	def remove(self, qid):
+		if qid not in self.quotes:
+			return
+		quote, name, date, context, game_id, show_id = self.quotes.pop(qid)
+		self.all.remove(qid)
+		if name:
+			self._remove_from(self.by_attrib, name.lower(), qid)
+		if game_id is not None:
+			self._remove_from(self.by_game, game_id, qid)
+		if show_id is not None:
+			self._remove_from(self.by_show, show_id, qid)
+		for word in words(quote):
+			self._remove_from(self.by_word, word, qid)
+
+	def _remove_from(self, index, key, qid):
+		bucket = index.get(key)
+		if bucket is None:
+			return
+		if isinstance(bucket, Bucket):
+			bucket.remove(qid)
+		else:
+			bucket.discard(qid)
+		if not bucket:
+			del index[key]
+
+	def _get_name(self, table, id):
+		table = self.lrrbot.metadata.tables[table]
+		with self.lrrbot.engine.begin() as conn:
+			name, = conn.execute(sqlalchemy.select([table.c.name]).where(table.c.id == id)).first()
+		return name.lower()
+
+	def _result(self, qid):
+		if qid is None:
+			return None
+		quote, name, date, context, game_id, show_id = self.quotes[qid]
+		return qid, quote, name, date, context
+
+	def get(self, qid):
+		return self._result(qid if qid in self.quotes else None)
+
+	def _pick(self, buckets):
+		buckets = [bucket for bucket in buckets if bucket]
+		if not buckets:
+			return None
+		return utils.weighted_choice((bucket, len(bucket)) for bucket in buckets).choice()
+
+	def random(self):
+		"""A random quote."""
+		return self._result(self._pick([self.all]))
+
+	def random_by_attrib(self, attrib):
+		"""A random quote whose attribution contains `attrib`."""
+		attrib = attrib.lower()
+		return self._result(self._pick(bucket for name, bucket in self.by_attrib.items() if attrib in name))
+
+	def random_by_game(self, game):
+		"""A random quote from a game whose name contains `game`."""
+		game = game.lower()
+		return self._result(self._pick(
+			bucket for game_id, bucket in self.by_game.items() if game in self.game_names.get(game_id, "")
+		))
+
+	def random_by_show(self, show):
+		"""A random quote from a show whose name contains `show`."""
+		show = show.lower()
+		return self._result(self._pick(
+			bucket for show_id, bucket in self.by_show.items() if show in self.show_names.get(show_id, "")
+		))
+
+	def find(self, query):
+		"""
+		A random quote that contains all the words in `query`, or `None` if there
+		are none. This only does exact word matches, so callers should fall back
+		to full-text search for stemmed matches.
+		"""
+		matches = None
+		for word in words(query):
+			ids = self.by_word.get(word, set())
+			matches = ids if matches is None else matches & ids
+			if not matches:
+				return None
+		if not matches:
+			return None
+		return self._result(random.choice(list(matches)))
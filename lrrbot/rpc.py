@@ -1,6 +1,6 @@
 import asyncio
 import aiomas
-import random
+import hashlib
 import re
 import math
 import logging
@@ -9,12 +9,10 @@ import traceback
 
 import sqlalchemy
 
-import common.utils
 import common.rpc
-from common import utils
 from common.config import config
-from common import game_data
 from common import twitch
+from common import utils
 from lrrbot import googlecalendar, storage
 import lrrbot.docstring
 
@@ -33,9 +31,56 @@ class Server(common.rpc.Server):
 		self.spam = None
 		self.static = None
 
+		self.command_catalogue = None
+		self.command_catalogue_funcs = None
+		self.command_catalogue_version = None
+
+	@aiomas.expose
+	async def get_game_id(self):
+		return await self.lrrbot.get_game_id()
+
+	@aiomas.expose
+	async def get_current_context(self):
+		"""The current game and show, whether the stream is live, and whether the game or show is overridden."""
+		game_id = await self.lrrbot.get_game_id()
+		# The header is rebuilt every few seconds, which is fresh enough, and saves
+		# waiting on Twitch. If it's not there, not knowing is better than failing.
+		header = self.lrrbot.header_info.snapshot
+		if header is not None:
+			is_live = header["is_live"]
+		else:
+			try:
+				is_live = await twitch.is_stream_live_coro()
+			except utils.PASSTHROUGH_EXCEPTIONS:
+				raise
+			except Exception:
+				log.exception("Failed to check whether the stream is live")
+				is_live = None
+		return {
+			"game_id": game_id,
+			"show_id": self.lrrbot.get_show_id(),
+			"is_live": is_live,
+			"game_override": self.lrrbot.game_override is not None,
+			"show_override": self.lrrbot.show_override is not None,
+		}
+
 	@aiomas.expose
-	def get_game_id(self):
-		return self.lrrbot.get_game_id()
+	async def get_stat_count(self, stat):
+		"""
+		The count of a stat for the current game and show, or `None` if there's no
+		current game. This comes from the bot's cache, so it includes changes that
+		haven't been written to `game_stats` yet.
+		"""
+		game_id = await self.lrrbot.get_game_id()
+		if game_id is None:
+			return None
+		show_id = self.lrrbot.get_show_id()
+		try:
+			stat = self.lrrbot.game_stats.get_stat(stat)
+		except KeyError:
+			return 0
+		game = await self.lrrbot.game_stats.get_game_coro(game_id, show_id)
+		return game["counts"].get(stat["id"], 0)
 
 	@aiomas.expose
 	def get_data(self, key):
@@ -46,6 +91,17 @@ class Server(common.rpc.Server):
 			node = node.get(subkey, {})
 		return node
 
+	@aiomas.expose
+	def get_data_if_modified(self, key, if_version=None):
+		"""
+		Like `get_data`, but if the section `key` is in is still at `if_version`,
+		the data is left out of the response.
+		"""
+		version = storage.get_version(key[0] if isinstance(key, (list, tuple)) else key)
+		if version == if_version:
+			return {"version": version}
+		return {"version": version, "data": self.get_data(key)}
+
 	@aiomas.expose
 	def set_data(self, key, value):
 		if not isinstance(key, (list, tuple)):
@@ -62,8 +118,7 @@ class Server(common.rpc.Server):
 		node[key[-1]] = value
 		storage.save()
 
-	@aiomas.expose
-	def get_commands(self):
+	def build_command_catalogue(self):
 		ret = []
 		for command in self.lrrbot.commands.commands.values():
 			doc = lrrbot.docstring.parse_docstring(command['func'].__doc__)
@@ -84,32 +139,39 @@ class Server(common.rpc.Server):
 				}]
 		return ret
 
-	@aiomas.expose
-	def get_header_info(self):
-		live = twitch.is_stream_live()
-		game_id = self.lrrbot.get_game_id()
+	def update_command_catalogue(self):
+		# Commands are only changed rarely, so only parse the docstrings again when
+		# they are. Static commands reuse the same function with a new docstring,
+		# so the docstrings are part of the key too.
+		funcs = [
+			(pattern, command['func'], command['func'].__doc__)
+			for pattern, command in self.lrrbot.commands.commands.items()
+		]
+		if funcs != self.command_catalogue_funcs:
+			self.command_catalogue = self.build_command_catalogue()
+			self.command_catalogue_funcs = funcs
+			catalogue = json.dumps(self.command_catalogue, sort_keys=True)
+			self.command_catalogue_version = hashlib.sha1(catalogue.encode("utf-8")).hexdigest()
 
-		data = {
-			"is_live": live,
-			"channel": config['channel'],
-		}
+	@aiomas.expose
+	def get_commands(self):
+		self.update_command_catalogue()
+		return self.command_catalogue
 
-		if live and game_id is not None:
-			data['current_game'] = {
-				"id": game_id,
-				"is_override": self.lrrbot.game_override is not None,
-			}
-			data['current_show'] = {
-				"id": self.lrrbot.get_show_id(),
-				"is_override": self.lrrbot.show_override is not None,
-			}
-		elif not live:
-			data['nextstream'] = googlecalendar.get_next_event_text(googlecalendar.CALENDAR_LRL)
+	@aiomas.expose
+	def get_commands_if_modified(self, if_version=None):
+		self.update_command_catalogue()
+		if self.command_catalogue_version == if_version:
+			return {"version": self.command_catalogue_version}
+		return {"version": self.command_catalogue_version, "data": self.command_catalogue}
 
-		if 'advice' in storage.data['responses']:
-			data['advice'] = random.choice(storage.data['responses']['advice']['response'])
+	@aiomas.expose
+	async def get_header_info(self):
+		return await self.lrrbot.header_info.get()
 
-		return data
+	@aiomas.expose
+	def get_twitch_metrics(self):
+		return twitch.client.get_metrics()
 
 	@aiomas.expose
 	def nextstream(self):
@@ -126,60 +188,7 @@ class Server(common.rpc.Server):
 
 	@aiomas.expose
 	def get_tweet(self):
-		tweet = self.generate_tweet()
-		while len(tweet) > 140:
-			tweet = self.generate_tweet()
-		return tweet
-
-	def generate_tweet(self):
-		import lrrbot.commands
-		mode = utils.weighted_choice([(0, 10), (1, 4), (2, 1)])
-		if mode == 0: # get random !advice
-			return random.choice(storage.data['responses']['advice']['response'])
-		elif mode == 1: # get a random !quote
-			quotes = self.lrrbot.metadata.tables["quotes"]
-			with self.lrrbot.engine.begin() as conn:
-				query = sqlalchemy.select([quotes.c.quote, quotes.c.attrib_name, quotes.c.context]).where(~quotes.c.deleted)
-				row = common.utils.pick_random_elements(conn.execute(query), 1)[0]
-			if row is None:
-				return None
-
-			quote, name, context = row
-
-			quote_msg = "\"{quote}\"".format(quote=quote)
-			if name:
-				quote_msg += " —{name}".format(name=name)
-				if context:
-					quote_msg += ", {context}".format(context=context)
-			return quote_msg
-		else: # get a random statistic
-			game_per_show_data = self.lrrbot.metadata.tables["game_per_show_data"]
-			game_stats = self.lrrbot.metadata.tables["game_stats"]
-			games = self.lrrbot.metadata.tables["games"]
-			shows = self.lrrbot.metadata.tables["shows"]
-			stats = self.lrrbot.metadata.tables["stats"]
-			with self.lrrbot.engine.begin() as conn:
-				res = conn.execute(
-					sqlalchemy.select([
-						sqlalchemy.func.coalesce(game_per_show_data.c.display_name, games.c.name),
-						shows.c.name,
-						game_data.stat_plural(stats, game_stats.c.count),
-						game_stats.c.count,
-						sqlalchemy.func.log(game_stats.c.count)
-					]).select_from(
-						game_stats
-							.join(games, games.c.id == game_stats.c.game_id)
-							.join(shows, shows.c.id == game_stats.c.show_id)
-							.outerjoin(game_per_show_data, (game_per_show_data.c.game_id == game_stats.c.game_id) & (game_per_show_data.c.show_id == game_stats.c.show_id))
-							.join(stats, stats.c.id == game_stats.c.stat_id)
-					).where(game_stats.c.count > 1)
-				)
-				game, show, stat, count = utils.pick_weighted_random_elements((
-					((game, show, stat, count), weight)
-					for game, show, stat, count, weight in res
-				), 1)[0]
-
-			return "%d %s for %s on %s" % (count, stat, game, show)
+		return self.lrrbot.tweets.generate()
 
 	@aiomas.expose
 	def patreon_pledge(self, data):
@@ -191,9 +200,21 @@ class Server(common.rpc.Server):
 				.where(users.c.name == config['channel'])
 			).first()
 		if name:
-			storm_count = common.storm.get_combined(self.lrrbot.engine, self.lrrbot.metadata)
+			storm_count = self.lrrbot.storm.get_combined()
 			self.lrrbot.connection.privmsg("#" + config['channel'], "lrrSPOT Thanks for supporting %s on Patreon, %s! (Today's storm count: %d)" % (name[0], data['name'], storm_count))
 
+	@aiomas.expose
+	def get_storm_counts(self):
+		return self.lrrbot.storm.snapshot()
+
+	@aiomas.expose
+	def increment_storm(self, counter, by=1):
+		return self.lrrbot.storm.increment(counter, by)
+
+	@aiomas.expose
+	def reload_card_index(self):
+		self.lrrbot.card_index.load()
+
 	@aiomas.expose
 	def disconnect_from_chat(self):
 		self.lrrbot.disconnect()
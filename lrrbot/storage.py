@@ -1,3 +1,4 @@
+import hashlib
 import json
 import os
 
@@ -27,11 +28,15 @@ data = {
 }
 """
 
+# Versions of the sections of `data`, worked out as they're asked for
+versions = {}
+
 def load():
 	"""Read data from storage"""
 	global data
 	with open(config['datafile'], "r") as fp:
 		data = json.load(fp)
+	versions.clear()
 
 def save():
 	"""Save data to storage"""
@@ -45,5 +50,18 @@ def save():
 
 	os.replace(realfile, backupfile)
 	os.replace(tempfile, realfile)
+	versions.clear()
+
+def get_version(key):
+	"""
+	Get a version string for the section `data[key]`, which changes whenever the
+	section is changed and saved. It's a hash of the contents, so it stays the
+	same across restarts.
+	"""
+	version = versions.get(key)
+	if version is None:
+		section = json.dumps(data.get(key), sort_keys=True)
+		version = versions[key] = hashlib.sha1(section.encode("utf-8")).hexdigest()
+	return version
 
 load()
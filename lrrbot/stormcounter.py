@@ -0,0 +1,96 @@
+import datetime
+import logging
+
+import sqlalchemy
+from sqlalchemy.dialects.postgresql import insert
+
+from common.config import config
+
+log = logging.getLogger('stormcounter')
+
+# How often, in seconds, queued increments are written to the `storm` table
+FLUSH_INTERVAL = 5
+
+COMBINED_COUNTERS = ['twitch-subscription', 'twitch-resubscription', 'patreon-pledge']
+
+class StormCounter:
+	"""
+	Today's storm counts, kept in memory.
+
+	Increments are applied immediately and queued, and the queue is written to
+	the `storm` table every `FLUSH_INTERVAL` seconds. At midnight (in
+	`config['timezone']`) the counts start over from whatever's in the database
+	for the new day.
+
+	Everything that wants a storm count, including the web server (over RPC),
+	reads it from here, so they all agree even before the counts are written.
+	"""
+
+	def __init__(self, lrrbot, loop):
+		self.lrrbot = lrrbot
+		self.loop = loop
+		self.counters = [column.name for column in self.lrrbot.metadata.tables['storm'].columns if column.name != 'date']
+		# date -> counter -> amount not yet written
+		self.pending = {}
+		self.date = None
+		self.counts = None
+		self.rollover()
+		self.lrrbot.reactor.execute_every(period=FLUSH_INTERVAL, function=self.flush)
+
+	def today(self):
+		return datetime.datetime.now(config['timezone']).date()
+
+	def rollover(self):
+		"""Switch to a new day's counts, if the day has changed."""
+		today = self.today()
+		if today == self.date:
+			return
+		storm = self.lrrbot.metadata.tables['storm']
+		with self.lrrbot.engine.begin() as conn:
+			row = conn.execute(sqlalchemy.select([storm.c[counter] for counter in self.counters])
+				.where(storm.c.date == today)).first()
+		counts = dict(zip(self.counters, row)) if row is not None else dict.fromkeys(self.counters, 0)
+		for counter, by in self.pending.get(today, {}).items():
+			counts[counter] += by
+		self.date, self.counts = today, counts
+
+	def increment(self, counter, by=1):
+		"""Add `by` to one of today's counters. Returns the new count."""
+		self.rollover()
+		self.counts[counter] += by
+		pending = self.pending.setdefault(self.date, {})
+		pending[counter] = pending.get(counter, 0) + by
+		return self.counts[counter]
+
+	def get(self, counter):
+		self.rollover()
+		return self.counts[counter]
+
+	def get_combined(self):
+		self.rollover()
+		return sum(self.counts[counter] for counter in COMBINED_COUNTERS)
+
+	def snapshot(self):
+		"""All of today's counts, plus the combined storm count under "storm"."""
+		self.rollover()
+		snapshot = dict(self.counts)
+		snapshot["storm"] = sum(self.counts[counter] for counter in COMBINED_COUNTERS)
+		return snapshot
+
+	def flush(self):
+		"""Write all the queued increments to the database."""
+		if self.pending:
+			storm = self.lrrbot.metadata.tables['storm']
+			with self.lrrbot.engine.begin() as conn:
+				for date, counts in self.pending.items():
+					query = insert(storm)
+					query = query.on_conflict_do_update(
+						index_elements=[storm.c.date],
+						set_={
+							counter: storm.c[counter] + query.excluded[counter]
+							for counter in counts
+						}
+					)
+					conn.execute(query, dict(counts, date=date))
+			self.pending = {}
+		self.rollover()
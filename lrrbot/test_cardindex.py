@@ -0,0 +1,49 @@
+import unittest
+
+import lrrbot.cardindex
+
+CARDS = [
+	(1, "lightningbolt", "Lightning Bolt", "Lightning Bolt (R) | Instant | Lightning Bolt deals 3 damage to any target."),
+	(2, "lightninghelix", "Lightning Helix", "Lightning Helix (RW) | Instant | ..."),
+	(3, "chainlightning", "Chain Lightning", "Chain Lightning (R) | Sorcery | ..."),
+	(4, "boltofkeranos", "Bolt of Keranos", "Bolt of Keranos (1RR) | Sorcery | ..."),
+	(5, "counterspell", "Counterspell", "Counterspell (UU) | Instant | ..."),
+]
+MULTIVERSE = [(191089, 1), (83584, 5)]
+COLLECTOR = [("M10", "146", 1), ("ICE", "64", 5)]
+
+class TestCardIndex(unittest.TestCase):
+	def setUp(self):
+		self.index = lrrbot.cardindex.CardIndex(None, None)
+		self.index.build(CARDS, MULTIVERSE, COLLECTOR)
+
+	def test_exact(self):
+		self.assertEqual(self.index.find("Lightning Bolt"), [(CARDS[0][2], CARDS[0][3])])
+
+	def test_exact_wins_over_substring(self):
+		self.assertEqual([name for name, text in self.index.find("lightning-bolt")], ["Lightning Bolt"])
+
+	def test_words_in_order(self):
+		self.assertEqual([name for name, text in self.index.find("bolt keranos")], ["Bolt of Keranos"])
+		self.assertEqual(self.index.find("keranos bolt"), [])
+
+	def test_prefix_ranked_first(self):
+		self.assertEqual([name for name, text in self.index.find("lightning")], ["Lightning Bolt", "Lightning Helix", "Chain Lightning"])
+
+	def test_short_words(self):
+		self.assertEqual([name for name, text in self.index.find("of")], ["Bolt of Keranos"])
+
+	def test_no_match(self):
+		self.assertEqual(self.index.find("Black Lotus"), [])
+
+	def test_suggest_typo(self):
+		self.assertEqual(self.index.suggest("Lightnig Blot")[0], "Lightning Bolt")
+		self.assertEqual(self.index.suggest("Counterspel"), ["Counterspell"])
+
+	def test_multiverse(self):
+		self.assertEqual([name for name, text in self.index.find_multiverse(83584)], ["Counterspell"])
+		self.assertEqual(self.index.find_multiverse(1), [])
+
+	def test_collector(self):
+		self.assertEqual([name for name, text in self.index.find_collector("M10", "146")], ["Lightning Bolt"])
+		self.assertEqual(self.index.find_collector("M10", "147"), [])
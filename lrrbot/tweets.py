@@ -0,0 +1,162 @@
+import logging
+import math
+import random
+
+import sqlalchemy
+
+from common import utils
+from lrrbot import quoteindex
+from lrrbot import storage
+
+log = logging.getLogger('tweets')
+
+MAX_LENGTH = 140
+
+def format_quote(quote, name, context):
+	quote_msg = "\"{quote}\"".format(quote=quote)
+	if name:
+		quote_msg += " —{name}".format(name=name)
+		if context:
+			quote_msg += ", {context}".format(context=context)
+	return quote_msg
+
+def format_stat(count, stat, game, show):
+	return "%d %s for %s on %s" % (count, stat["singular"] if count == 1 else stat["plural"], game, show)
+
+class TweetGenerator:
+	"""
+	Random tweets for the Twitter bot: a bit of advice, a quote or a stat.
+
+	Everything is kept pre-rendered and filtered down to the things that fit in a
+	tweet, so picking one doesn't touch the database:
+	 * quotes come from the bot's `QuoteIndex`, and the IDs of the ones that fit
+	   are kept in a `quoteindex.Bucket`, which `update_quote` and `remove_quote`
+	   keep up to date
+	 * stats are kept in a `utils.WeightedSet`, weighted by `log(count)`, which
+	   `GameStats` keeps up to date as the stats change. When game names change
+	   it's reloaded from the database in the executor.
+	"""
+
+	def __init__(self, lrrbot, loop):
+		self.lrrbot = lrrbot
+		self.loop = loop
+		self.quotes = quoteindex.Bucket()
+		self.quote_texts = {}
+		# (game ID, show ID, stat ID) -> text
+		self.stats = utils.WeightedSet()
+		self.stat_texts = {}
+		self.loading_stats = None
+		self.load_stats_again = False
+		# Changes made while the stats are being loaded, to apply on top of them
+		self.stat_changes = None
+		self.load_quotes()
+		self.lrrbot.game_stats.on_change.append(self.update_stat)
+		self.lrrbot.game_stats.on_invalidate.append(lambda: self.loop.call_soon_threadsafe(self.schedule_load_stats))
+		self.schedule_load_stats()
+
+	def load_quotes(self):
+		self.quotes, self.quote_texts = quoteindex.Bucket(), {}
+		for qid, (quote, name, date, context, game_id, show_id) in self.lrrbot.quote_index.quotes.items():
+			self.update_quote(qid, quote, name, context)
+
+	def update_quote(self, qid, quote, name, context):
+		"""Add a new quote, or replace an existing one."""
+		text = format_quote(quote, name, context)
+		if len(text) > MAX_LENGTH:
+			self.remove_quote(qid)
+		else:
+			self.quote_texts[qid] = text
+			self.quotes.add(qid)
+
+	def remove_quote(self, qid):
+		self.quote_texts.pop(qid, None)
+		self.quotes.remove(qid)
+
+	def update_stat(self, game_id, show_id, game, stat, count):
+		key = (game_id, show_id, stat["id"])
+		text = format_stat(count, stat, game["name"], game["show"])
+		self.set_stat(self.stats, self.stat_texts, key, text, count)
+		if self.stat_changes is not None:
+			self.stat_changes[key] = (text, count)
+
+	def set_stat(self, stats, texts, key, text, count):
+		if count > 1 and len(text) <= MAX_LENGTH:
+			stats.set(key, math.log(count))
+			texts[key] = text
+		else:
+			stats.remove(key)
+			texts.pop(key, None)
+
+	def schedule_load_stats(self):
+		if self.loading_stats is not None:
+			self.load_stats_again = True
+			return
+		self.load_stats_again = False
+		self.stat_changes = {}
+		self.loading_stats = self.loop.run_in_executor(None, self.load_stats)
+		self.loading_stats.add_done_callback(self.on_stats_loaded)
+
+	def load_stats(self):
+		game_per_show_data = self.lrrbot.metadata.tables["game_per_show_data"]
+		game_stats = self.lrrbot.metadata.tables["game_stats"]
+		games = self.lrrbot.metadata.tables["games"]
+		shows = self.lrrbot.metadata.tables["shows"]
+		self.lrrbot.game_stats.flush()
+		with self.lrrbot.engine.begin() as conn:
+			return conn.execute(
+				sqlalchemy.select([
+					game_stats.c.game_id,
+					game_stats.c.show_id,
+					game_stats.c.stat_id,
+					sqlalchemy.func.coalesce(game_per_show_data.c.display_name, games.c.name),
+					shows.c.name,
+					game_stats.c.count,
+				]).select_from(
+					game_stats
+						.join(games, games.c.id == game_stats.c.game_id)
+						.join(shows, shows.c.id == game_stats.c.show_id)
+						.outerjoin(game_per_show_data, (game_per_show_data.c.game_id == game_stats.c.game_id) & (game_per_show_data.c.show_id == game_stats.c.show_id))
+				).where(game_stats.c.count > 1)
+			).fetchall()
+
+	def on_stats_loaded(self, future):
+		self.loading_stats = None
+		changes, self.stat_changes = self.stat_changes, None
+		try:
+			rows = future.result()
+		except Exception:
+			log.exception("Failed to load the stat tweets")
+		else:
+			stats_by_id = {stat["id"]: stat for stat in self.lrrbot.game_stats.stats.values()}
+			stats, texts = utils.WeightedSet(), {}
+			for game_id, show_id, stat_id, game, show, count in rows:
+				stat = stats_by_id.get(stat_id)
+				if stat is not None:
+					self.set_stat(stats, texts, (game_id, show_id, stat_id), format_stat(count, stat, game, show), count)
+			# Anything that changed since the stats were flushed is newer than what
+			# was loaded
+			for key, (text, count) in changes.items():
+				self.set_stat(stats, texts, key, text, count)
+			self.stats, self.stat_texts = stats, texts
+			log.debug("Loaded stat tweets: %d stats", len(stats))
+		if self.load_stats_again:
+			self.schedule_load_stats()
+
+	def get_advice(self):
+		if 'advice' not in storage.data['responses']:
+			return []
+		return [advice for advice in storage.data['responses']['advice']['response'] if len(advice) <= MAX_LENGTH]
+
+	def generate(self):
+		advice = self.get_advice()
+		mode = utils.weighted_choice([
+			(0, 10 if advice else 0),
+			(1, 4 if self.quotes else 0),
+			(2, 1 if self.stats else 0),
+		])
+		if mode == 0: # get random !advice
+			return random.choice(advice)
+		elif mode == 1: # get a random !quote
+			return self.quote_texts[self.quotes.choice()]
+		else: # get a random statistic
+			return self.stat_texts[self.stats.choice()]
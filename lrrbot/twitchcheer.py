@@ -1,6 +1,5 @@
 import asyncio
 import common.rpc
-import common.storm
 from common import twitch
 from common import utils
 from lrrbot import chatlog
@@ -31,11 +30,11 @@ class TwitchCheer:
 			'message': event.arguments[0],
 			'messagehtml': await chatlog.format_message(event.arguments[0], event.tags.get('emotes'), event.tags.get('emoteset', []), cheer=True),
 			'bits': event.tags['bits'],
-			'count': common.storm.increment(self.lrrbot.engine, self.lrrbot.metadata, eventname, event.tags['bits']),
+			'count': self.lrrbot.storm.increment(eventname, event.tags['bits']),
 			'level': self.get_level(event.tags['bits']),
 		}
 
-		await common.rpc.eventserver.event(eventname, data, None)
+		await common.rpc.events.publish(eventname, data, None)
 
 	@classmethod
 	def get_level(cls, bits):
@@ -2,7 +2,6 @@ import asyncio
 
 from common.config import config
 from common import rpc
-from common import storm
 from common import twitch
 from common import utils
 
@@ -54,6 +53,6 @@ class TwitchFollows:
 				event = {
 					'name': name,
 					'avatar': avatar,
-					'count': storm.increment(self.lrrbot.engine, self.lrrbot.metadata, 'twitch-follow'),
+					'count': self.lrrbot.storm.increment('twitch-follow'),
 				}
-				await rpc.eventserver.event('twitch-follow', event, timestamp)
+				await rpc.events.publish('twitch-follow', event, timestamp)
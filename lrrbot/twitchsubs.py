@@ -15,7 +15,6 @@ from common import http
 from lrrbot import storage
 from lrrbot import chatlog
 import common.rpc
-import common.storm
 
 log = logging.getLogger('twitchsubs')
 
@@ -104,7 +103,7 @@ class TwitchSubs:
 			asyncio.ensure_future(self.on_subscriber(conn, event.target, subscribe_match.group(1), eventtime, monthcount=int(subscribe_match.group(2)))).add_done_callback(utils.check_exception)
 			# Halt message processing
 			return "NO MORE"
-		asyncio.ensure_future(common.rpc.eventserver.event('twitch-message', {'message': event.arguments[0], 'count': common.storm.increment(self.lrrbot.engine, self.lrrbot.metadata, 'twitch-message')}, eventtime)).add_done_callback(utils.check_exception)
+		asyncio.ensure_future(common.rpc.events.publish('twitch-message', {'message': event.arguments[0], 'count': self.lrrbot.storm.increment('twitch-message')}, eventtime)).add_done_callback(utils.check_exception)
 
 		# Halt message processing
 		return "NO MORE"
@@ -158,7 +157,7 @@ class TwitchSubs:
 		}
 		if logo is None:
 			try:
-				channel_info = twitch.get_info_uncached(user)
+				channel_info = await twitch.get_info_uncached_coro(user)
 			except utils.PASSTHROUGH_EXCEPTIONS:
 				raise
 			except Exception:
@@ -180,11 +179,11 @@ class TwitchSubs:
 		if monthcount is not None and monthcount > 1:
 			event = "twitch-resubscription"
 			data['monthcount'] = monthcount
-			data['count'] = common.storm.increment(self.lrrbot.engine, self.lrrbot.metadata, event)
+			data['count'] = self.lrrbot.storm.increment(event)
 		else:
 			event = "twitch-subscription"
-			data['count'] = common.storm.increment(self.lrrbot.engine, self.lrrbot.metadata, event)
-		storm_count = common.storm.get_combined(self.lrrbot.engine, self.lrrbot.metadata)
+			data['count'] = self.lrrbot.storm.increment(event)
+		storm_count = self.lrrbot.storm.get_combined()
 		conn.privmsg(channel, "lrrSPOT Thanks for subscribing, %s! (Today's storm count: %d)" % (data['name'], storm_count))
 
-		await common.rpc.eventserver.event(event, data, eventtime)
+		await common.rpc.events.publish(event, data, eventtime)
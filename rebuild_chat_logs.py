@@ -2,10 +2,13 @@
 import lrrbot.main
 from lrrbot.chatlog import run_task, rebuild_all, stop_task
 import asyncio
+from common import transcripts
 
 loop = asyncio.get_event_loop()
 task = asyncio.async(run_task(), loop=loop)
 rebuild_all()
 stop_task()
 loop.run_until_complete(task)
+# Every message might have changed, so check all of the transcripts again
+transcripts.mark_stale()
 loop.close()
@@ -5,39 +5,36 @@ from common.config import config
 import common.rpc
 import datetime
 import flask
-import common.storm
+from common import game_data
+
+async def get_current_context():
+	"""
+	The bot's current context, asked for once per request, so the cache key and
+	the view share it.
+	"""
+	if 'current_context' not in flask.g:
+		flask.g.current_context = await common.rpc.bot.get_current_context()
+	return flask.g.current_context
+
+async def current_context_key():
+	context = await get_current_context()
+	return context['game_id'], context['show_id']
 
 @server.app.route("/api/stats/<stat>")
 async def api_stats(stat):
-	game_id = await common.rpc.bot.get_game_id()
-	if game_id is None:
+	# Overlays poll this, so ask the bot, which has the changes it hasn't written
+	# to the database yet
+	count = await common.rpc.bot.get_stat_count(stat)
+	if count is None:
 		return "-"
-	show_id = await common.rpc.bot.get_show_id()
-
-	game_stats = server.db.metadata.tables["game_stats"]
-	stats = server.db.metadata.tables["stats"]
-	with server.db.engine.begin() as conn:
-		count = conn.execute(sqlalchemy.select([game_stats.c.count])
-			.where(game_stats.c.game_id == game_id)
-			.where(game_stats.c.show_id == show_id)
-			.where(game_stats.c.stat_id == sqlalchemy.select([stats.c.id])
-				.where(stats.c.string_id == stat))
-		).first()
-		if count is not None:
-			count, = count
-		else:
-			count = 0
-
 	return str(count)
 
 @server.app.route("/api/stormcount")
-def stormcount():
+async def stormcount():
+	counts = await common.rpc.bot.get_storm_counts()
 	return flask.jsonify({
-		'twitch-subscription': common.storm.get(server.db.engine, server.db.metadata, 'twitch-subscription'),
-		'twitch-resubscription': common.storm.get(server.db.engine, server.db.metadata, 'twitch-resubscription'),
-		'twitch-follow': common.storm.get(server.db.engine, server.db.metadata, 'twitch-follow'),
-		'twitch-cheer': common.storm.get(server.db.engine, server.db.metadata, 'twitch-cheer'),
-		'patreon-pledge': common.storm.get(server.db.engine, server.db.metadata, 'patreon-pledge'),
+		counter: counts[counter]
+		for counter in ['twitch-subscription', 'twitch-resubscription', 'twitch-follow', 'twitch-cheer', 'patreon-pledge']
 	})
 
 @server.app.route("/api/next")
@@ -45,23 +42,20 @@ async def nextstream():
 	return await common.rpc.bot.nextstream()
 
 @server.app.route("/api/votes")
+@server.cache_response("stats", key=current_context_key)
 async def api_votes():
-	game_id = await common.rpc.bot.get_game_id()
+	context = await get_current_context()
+	game_id, show_id = context['game_id'], context['show_id']
 	if game_id is None:
 		return "-"
-	show_id = await common.rpc.bot.get_show_id()
 
-	game_votes = server.db.metadata.tables["game_votes"]
+	game_vote_totals = server.db.metadata.tables["game_vote_totals"]
 	with server.db.engine.begin() as conn:
-		good = sqlalchemy.cast(
-			sqlalchemy.func.sum(sqlalchemy.cast(game_votes.c.vote, sqlalchemy.Integer)),
-			sqlalchemy.Numeric
-		)
 		rating = conn.execute(sqlalchemy.select([
-			(100 * good / sqlalchemy.func.count(game_votes.c.vote)),
-			good,
-			sqlalchemy.func.count(game_votes.c.vote),
-		]).where(game_votes.c.game_id == game_id).where(game_votes.c.show_id == show_id)).first()
+			game_data.vote_rating(game_vote_totals),
+			game_vote_totals.c.good,
+			game_vote_totals.c.total,
+		]).where(game_vote_totals.c.game_id == game_id).where(game_vote_totals.c.show_id == show_id)).first()
 		if rating is not None:
 			return "%.0f%% (%d/%d)" % (float(rating[0]), rating[1], rating[2])
 		else:
@@ -78,19 +72,21 @@ async def set_show(session, show):
 	return ""
 
 @server.app.route("/api/game")
+@server.cache_response("stats", key=current_context_key)
 async def get_game():
-	game_id = await common.rpc.bot.get_game_id()
+	context = await get_current_context()
+	game_id, show_id = context['game_id'], context['show_id']
 	if game_id is None:
 		return "-"
-	show_id = await common.rpc.bot.get_show_id()
 
 	games = server.db.metadata.tables["games"]
 	with server.db.engine.begin() as conn:
 		return conn.execute(sqlalchemy.select([games.c.name]).where(games.c.id == game_id)).first()[0]
 
 @server.app.route("/api/show")
+@server.cache_response("stats", key=current_context_key)
 async def get_show():
-	show_id = await common.rpc.bot.get_show_id()
+	show_id = (await get_current_context())['show_id']
 
 	shows = server.db.metadata.tables["shows"]
 	with server.db.engine.begin() as conn:
@@ -113,3 +109,10 @@ async def disconnect(session):
 		return flask.jsonify(status="OK")
 	else:
 		return flask.jsonify(status="ERR")
+
+@server.app.route("/api/rpc-metrics")
+@login.with_minimal_session
+async def rpc_metrics(session):
+	if not session['user']['is_mod']:
+		return flask.jsonify(status="ERR")
+	return flask.jsonify(bot=common.rpc.bot.get_metrics(), eventserver=common.rpc.eventserver.get_metrics())
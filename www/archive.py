@@ -1,17 +1,16 @@
-import urllib.request
 import urllib.parse
-import contextlib
 import datetime
-import copy
+import hashlib
 
 import flask
 import flask.json
 import dateutil.parser
 import asyncio
-import sqlalchemy
 
+import common.http
 import common.time
 import common.url
+from common import transcripts
 from common import utils
 from common.config import config
 from www import server
@@ -19,18 +18,19 @@ from www import login
 
 CACHE_TIMEOUT = 5*60
 
-BEFORE_BUFFER = datetime.timedelta(minutes=15)
-AFTER_BUFFER = datetime.timedelta(minutes=15)
+# How many rendered archive_video.html fragments to keep
+FRAGMENT_CACHE_SIZE = 1000
+
+# How long browsers can keep chunks that are over and done with
+CHAT_CHUNK_MAX_AGE = 24*60*60
+# How long before a chunk is considered over and done with, to allow for
+# messages to be logged late
+CHAT_CHUNK_SETTLE_TIME = datetime.timedelta(minutes=5)
 
 @utils.cache(CACHE_TIMEOUT, params=[0, 1])
-def archive_feed_data(channel, broadcasts):
+async def archive_feed_data(channel, broadcasts):
 	url = "https://api.twitch.tv/kraken/channels/%s/videos?broadcasts=%s&limit=%d" % (urllib.parse.quote(channel, safe=""), "true" if broadcasts else "false", 100)
-	req = urllib.request.Request(url)
-	req.add_header('Client-ID', config['twitch_clientid'])
-	fp = urllib.request.urlopen(req)
-	data = fp.read()
-	fp.close()
-	data = data.decode()
+	data = await common.http.request_coro(url, headers={'Client-ID': config['twitch_clientid']}, max_stale=CACHE_TIMEOUT)
 
 	# {u'_id': u'v40431562',
 	#  u'_links': {u'channel': u'https://api.twitch.tv/kraken/channels/loadingreadyrun',
@@ -75,6 +75,8 @@ def archive_feed_data(channel, broadcasts):
 
 	videos = flask.json.loads(data)['videos']
 	for video in videos:
+		# Identifies this version of the video's data, for caching what's made from it
+		video["data_hash"] = hashlib.sha1(flask.json.dumps(video, sort_keys=True).encode("utf-8")).hexdigest()
 		if video.get('created_at'):
 			video["created_at"] = dateutil.parser.parse(video["created_at"])
 		if video.get('delete_at'):
@@ -83,48 +85,79 @@ def archive_feed_data(channel, broadcasts):
 			video["recorded_at"] = dateutil.parser.parse(video["recorded_at"])
 	return videos
 
-def archive_feed_data_html(channel, broadcasts, rss):
-	# Deep copy so we don't modify the cached data
-	data = copy.deepcopy(archive_feed_data(channel, broadcasts))
-	for vid in data:
+# Rendered archive_video.html, by video ID, whether it's for the RSS feed and the video's data_hash
+fragment_cache = {}
+
+def render_video(vid, rss):
+	key = (vid['_id'], rss, vid['data_hash'])
+	html = fragment_cache.get(key)
+	if html is None:
+		# Copy so we don't modify the cached data
+		vid = dict(vid)
 		# For new clips, sometimes: vid['thumbnails'] == "https://www.twitch.tv/images/xarth/404_processing_320x240.png"
 		if isinstance(vid['thumbnails'], list):
 			vid['thumbnails'] = [i for i in vid['thumbnails'] if i['url'] != vid['preview']]
 		else:
 			vid['thumbnails'] = []
-		vid['html'] = flask.render_template("archive_video.html", vid=vid, rss=rss)
-	return data
+		html = flask.render_template("archive_video.html", vid=vid, rss=rss)
+		if len(fragment_cache) >= FRAGMENT_CACHE_SIZE:
+			fragment_cache.clear()
+		fragment_cache[key] = html
+	return html
+
+# The feed's last ETag, by channel and whether it's broadcasts or highlights, and when it changed
+feed_changed = {}
+
+async def archive_feed_data_html(channel, broadcasts, rss):
+	return [dict(vid, html=render_video(vid, rss)) for vid in await archive_feed_data(channel, broadcasts)]
 
 @server.app.route('/archive')
 @login.with_session
-def archive(session):
+async def archive(session):
 	channel = flask.request.values.get('channel', 'loadingreadyrun')
 	broadcasts = 'highlights' not in flask.request.values
-	return flask.render_template("archive.html", videos=archive_feed_data_html(channel, broadcasts, False), broadcasts=broadcasts, session=session)
+	return flask.render_template("archive.html", videos=await archive_feed_data_html(channel, broadcasts, False), broadcasts=broadcasts, session=session)
 
 @server.app.route('/archivefeed')
-def archive_feed():
+async def archive_feed():
 	channel = flask.request.values.get('channel', 'loadingreadyrun')
 	broadcasts = 'highlights' not in flask.request.values
-	rss = flask.render_template("archive_feed.xml", videos=archive_feed_data_html(channel, broadcasts, True), broadcasts=broadcasts)
-	return flask.Response(rss, mimetype="application/xml")
+	videos = await archive_feed_data_html(channel, broadcasts, True)
+
+	# The feed only changes when the videos do, so readers polling it can be told
+	# it hasn't changed without rendering it
+	response = flask.Response(mimetype="application/xml")
+	etag = hashlib.sha1()
+	etag.update(("%s\n%s\n" % (channel, broadcasts)).encode("utf-8"))
+	for vid in videos:
+		etag.update(("%s\n" % vid['data_hash']).encode("utf-8"))
+	etag = etag.hexdigest()
+	# Videos being edited or deleted doesn't leave a time in the listing, so go by
+	# when the listing was first seen to be different
+	last_etag, last_modified = feed_changed.get((channel, broadcasts), (None, None))
+	if last_etag != etag:
+		last_modified = datetime.datetime.utcnow().replace(microsecond=0)
+		feed_changed[channel, broadcasts] = (etag, last_modified)
+	response.set_etag(etag)
+	response.last_modified = last_modified
+	response.cache_control.public = True
+	response.cache_control.max_age = CACHE_TIMEOUT
+	response.make_conditional(flask.request)
+	if response.status_code != 304:
+		response.set_data(flask.render_template("archive_feed.xml", videos=videos, broadcasts=broadcasts))
+	return response
 
 def chat_data(starttime, endtime, target="#loadingreadyrun"):
+	"""Get the chat messages from `starttime` (inclusive) to `endtime` (exclusive)."""
 	log = server.db.metadata.tables["log"]
 	with server.db.engine.begin() as conn:
-		res = conn.execute(sqlalchemy.select([log.c.messagehtml])
-			.where((log.c.target == target) & log.c.time.between(starttime, endtime))
-			.order_by(log.c.time.asc()))
-		return [message for (message,) in res]
+		return transcripts.get_chat(conn, log, starttime, endtime, target)
 
 @utils.cache(CACHE_TIMEOUT, params=[0])
-def get_video_data(videoid):
+async def get_video_data(videoid):
 	try:
-		url = "https://api.twitch.tv/kraken/videos/%s" % (videoid, )
-		req = urllib.request.Request(url)
-		req.add_header('Client-ID', config['twitch_clientid'])
-		with contextlib.closing(urllib.request.urlopen(req)) as fp:
-			video = flask.json.load(fp)
+		url = "https://api.twitch.tv/kraken/videos/%s" % (urllib.parse.quote(videoid, safe=""), )
+		video = flask.json.loads(await common.http.request_coro(url, headers={'Client-ID': config['twitch_clientid']}))
 		start = dateutil.parser.parse(video["recorded_at"])
 		return {
 			"start": start,
@@ -139,12 +172,51 @@ def get_video_data(videoid):
 		return None
 
 @server.app.route('/archive/<videoid>')
-def archive_watch(videoid):
+async def archive_watch(videoid):
 	starttime = common.time.parsetime(flask.request.values.get('t'))
 	if starttime:
 		starttime = int(starttime.total_seconds())
-	video = get_video_data(videoid)
+	video = await get_video_data(videoid)
 	if video is None:
 		return "Unrecognised video"
-	chat = chat_data(video["start"] - BEFORE_BUFFER, video["end"] + AFTER_BUFFER)
-	return flask.render_template("archive_watch.html", video=video, chat=chat, starttime=starttime)
+	# The chat is loaded a chunk at a time by archive.js, as the video plays, from
+	# the prebuilt transcript if there is one
+	first_chunk, last_chunk = transcripts.get_chunk_range(video["start"], video["end"])
+	index = transcripts.load_index(videoid)
+	if index is not None:
+		transcript_url = "%s/%s" % (config['chat_transcript_url'], urllib.parse.quote(videoid))
+		transcript_chunks = sorted(map(int, index['chunks']))
+	else:
+		transcript_url = transcript_chunks = None
+	return flask.render_template("archive_watch.html", video=video, starttime=starttime,
+		chunk_length=transcripts.CHUNK_LENGTH, first_chunk=first_chunk, last_chunk=last_chunk,
+		transcript_url=transcript_url, transcript_chunks=transcript_chunks,
+	)
+
+@server.app.route('/archive/<videoid>/chat')
+async def archive_chat(videoid):
+	"""
+	The chat for `transcripts.CHUNK_LENGTH` seconds of the video, starting `chunk`
+	chunks after the start of the video. `chunk` can be negative, for the chat
+	from before the video started.
+	"""
+	try:
+		chunk = int(flask.request.values['chunk'])
+	except (KeyError, ValueError):
+		return flask.json.jsonify(error="Invalid chunk"), 400
+	video = await get_video_data(videoid)
+	if video is None:
+		return flask.json.jsonify(error="Unrecognised video"), 404
+	starttime, endtime = transcripts.get_chunk_times(video["start"], chunk)
+	if endtime <= video["start"] - transcripts.BEFORE_BUFFER or starttime >= video["end"] + transcripts.AFTER_BUFFER:
+		chat = []
+	else:
+		chat = chat_data(starttime, endtime)
+	response = flask.json.jsonify(chunk=chunk, start=starttime.timestamp(), end=endtime.timestamp(), chat=chat)
+	if endtime + CHAT_CHUNK_SETTLE_TIME < datetime.datetime.now(datetime.timezone.utc):
+		response.cache_control.public = True
+		response.cache_control.max_age = CHAT_CHUNK_MAX_AGE
+	else:
+		# Still being written
+		response.cache_control.no_cache = True
+	return response
@@ -0,0 +1,42 @@
+import copy
+
+import flask
+
+import common.rpc
+
+# Local copies of the data fetched from the bot, with their versions
+cache = {}
+
+async def get_if_modified(cache_key, fetch):
+	"""
+	Get the version and the contents of something from the bot, with `fetch`
+	being one of the bot's `*_if_modified` methods taking the version of the local
+	copy. The contents are only downloaded again if they've changed.
+	"""
+	version, data = cache.get(cache_key, (None, None))
+	res = await fetch(version)
+	if 'data' in res:
+		data = res['data']
+		cache[cache_key] = res['version'], data
+	return res['version'], data
+
+async def get_data(key):
+	"""
+	Get a section of the bot's storage, like `common.rpc.bot.get_data`, but only
+	download it again if it's changed since the last time.
+	"""
+	cache_key = ('data', ) + (tuple(key) if isinstance(key, (list, tuple)) else (key, ))
+	version, data = await get_if_modified(cache_key, lambda version: common.rpc.bot.get_data_if_modified(key, version))
+	# The views like to modify what they get
+	return copy.deepcopy(data)
+
+async def get_commands():
+	"""
+	Get the version and the list of the bot's commands, only downloading the list
+	again if it's changed. The bot is asked once per request, so a cache key and
+	the view can both use this.
+	"""
+	if 'commands' not in flask.g:
+		flask.g.commands = await get_if_modified('commands', common.rpc.bot.get_commands_if_modified)
+	version, data = flask.g.commands
+	return version, copy.deepcopy(data)
@@ -3,6 +3,7 @@ import flask.json
 from www import server
 from www import login
 from www import history
+from www import botdata
 import common.rpc
 
 @server.app.route('/commands')
@@ -11,7 +12,7 @@ async def commands(session):
 	mode = flask.request.values.get('mode', 'responses')
 	assert(mode in ('responses', 'explanations'))
 
-	data = await common.rpc.bot.get_data(mode)
+	data = await botdata.get_data(mode)
 
 	# Prepare the data, and group equivalent commands together
 	data_reverse = {}
@@ -1,7 +1,7 @@
 import flask
 from www import server
 from www import login
-import common.rpc
+from www import botdata
 import html
 from collections import OrderedDict
 
@@ -20,10 +20,19 @@ def command_format(cmd):
 	cmd["description"] = cmd["description"].split("\n\n")
 	return cmd
 
+async def help_key():
+	page_key = await login.anonymous_page_key()
+	if page_key is None:
+		return None
+	version, commands = await botdata.get_commands()
+	return page_key, version
+
 @server.app.route('/help')
+@server.cache_response(key=help_key)
 @login.with_session
 async def help(session):
-	commandlist = sorted(map(command_format, await common.rpc.bot.get_commands()), key=lambda c: c["raw-aliases"])
+	version, commands = await botdata.get_commands()
+	commandlist = sorted(map(command_format, commands), key=lambda c: c["raw-aliases"])
 	commands = {}
 	for command in commandlist:
 		section = command['section']
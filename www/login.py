@@ -1,5 +1,9 @@
 import asyncio
 import functools
+import json
+import os
+import random
+import time
 import urllib.request
 import urllib.parse
 import uuid
@@ -14,7 +18,6 @@ from www import server
 from common.config import config, from_apipass
 from common import utils
 from common import twitch
-from common import game_data
 import common.rpc
 
 with server.db.engine.begin() as conn:
@@ -110,6 +113,52 @@ def require_mod(func):
 			return await login(session['url'])
 	return wrapper
 
+# The last header snapshot read from `config['header_snapshot']`
+header_cache = {'mtime': None, 'header': None}
+
+# How old, in seconds, the header snapshot can get before the bot is assumed to
+# have stopped updating it. The bot touches it every 5 seconds.
+HEADER_MAX_AGE = 30
+
+async def load_header():
+	"""
+	The current header information, before an advice is picked. The bot keeps it
+	in a file, so this doesn't need to ask the bot unless the file's missing or
+	out of date.
+	"""
+	try:
+		mtime = os.stat(config['header_snapshot']).st_mtime_ns
+	except FileNotFoundError:
+		mtime = None
+	if mtime is None or time.time() - mtime / 1e9 > HEADER_MAX_AGE:
+		return await common.rpc.bot.get_header_info()
+	if header_cache['mtime'] != mtime:
+		with open(config['header_snapshot']) as fp:
+			header_cache['header'] = json.load(fp)
+		header_cache['mtime'] = mtime
+	return header_cache['header']
+
+async def get_header_info():
+	"""The current header information, with one of the advices picked."""
+	# Don't let the template touch the cached copy
+	header = dict(await load_header())
+	if header.get('advice'):
+		header['advice'] = random.choice(header['advice'])
+	return header
+
+async def anonymous_page_key():
+	"""
+	A `key` for `server.cache_response`, for pages that are the same for every
+	visitor who isn't logged in, apart from the header. The page is cached
+	along with the version of the header it was made with, so the advice in it
+	changes whenever the header does rather than on every page load.
+	"""
+	if flask.session.get('id') is not None or 'user' in flask.session or 'apipass' in flask.request.values:
+		return None
+	# The file's modification time says when the bot last checked the header, not
+	# when it last changed, so go by the version in it
+	return (await load_header())['version']
+
 async def load_session(include_url=True, include_header=True):
 	"""
 	Get the login session information from the cookies.
@@ -144,62 +193,7 @@ async def load_session(include_url=True, include_header=True):
 	else:
 		session['url'] = None
 	if include_header:
-		session['header'] = await common.rpc.bot.get_header_info()
-		if 'current_game' in session['header']:
-			games = server.db.metadata.tables["games"]
-			shows = server.db.metadata.tables["shows"]
-			stats = server.db.metadata.tables["stats"]
-			game_per_show_data = server.db.metadata.tables["game_per_show_data"]
-			game_stats = server.db.metadata.tables["game_stats"]
-			game_votes = server.db.metadata.tables["game_votes"]
-			disabled_stats = server.db.metadata.tables["disabled_stats"]
-			with server.db.engine.begin() as conn:
-				game_id = session['header']['current_game']['id']
-				show_id = session['header']['current_show']['id']
-				session['header']['current_game']['display'], = conn.execute(sqlalchemy.select([
-					sqlalchemy.func.coalesce(game_per_show_data.c.display_name, games.c.name),
-				]).select_from(games
-					.outerjoin(game_per_show_data, (game_per_show_data.c.game_id == games.c.id) & (game_per_show_data.c.show_id == show_id))
-				).where(games.c.id == game_id)).first()
-
-				session['header']['current_show']['name'], = conn.execute(sqlalchemy.select([
-					shows.c.name,
-				]).where(shows.c.id == show_id)).first()
-
-				good = sqlalchemy.cast(
-					sqlalchemy.func.sum(sqlalchemy.cast(game_votes.c.vote, sqlalchemy.Integer)),
-					sqlalchemy.Numeric
-				)
-				rating = conn.execute(sqlalchemy.select([
-					(100 * good / sqlalchemy.func.count(game_votes.c.vote)),
-					good,
-					sqlalchemy.func.count(game_votes.c.vote),
-				]).where(game_votes.c.game_id == game_id).where(game_votes.c.show_id == show_id)).first()
-				if rating[0] is not None and rating[1] is not None:
-					session['header']['current_game']["rating"] = {
-						'perc': rating[0],
-						'good': rating[1],
-						'total': rating[2],
-					}
-				stats_query = sqlalchemy.select([
-					game_stats.c.count,
-					game_data.stat_plural(stats, game_stats.c.count)
-				]).select_from(game_stats
-					.join(stats, stats.c.id == game_stats.c.stat_id)
-				).where(game_stats.c.game_id == game_id) \
-					.where(game_stats.c.show_id == show_id) \
-					.where(~sqlalchemy.exists(sqlalchemy.select([1])
-						.where(disabled_stats.c.stat_id == game_stats.c.stat_id)
-						.where(disabled_stats.c.show_id == game_stats.c.show_id)
-					)) \
-					.order_by(game_stats.c.count.desc())
-				session['header']['current_game']['stats'] = [
-					{
-						'count': count,
-						'type': type,
-					}
-					for count, type in conn.execute(stats_query)
-				]
+		session['header'] = await get_header_info()
 
 	if user_id is not None:
 		users = server.db.metadata.tables["users"]
@@ -1,4 +1,6 @@
 import datetime
+import time
+
 import pytz
 
 import flask
@@ -12,44 +14,69 @@ from common.config import config
 from www import server
 from www import login
 
+NOTIFICATION_EVENTS = {'twitch-subscription', 'twitch-resubscription', 'twitch-message', 'twitch-cheer', 'patreon-pledge'}
+RECENT_EVENTS_AGE = datetime.timedelta(days=2)
+# How long the Patreon creator name is cached for, in seconds
+CREATOR_NAME_CACHE_TIME = 600
+
+# The events from the last two days, as of `last_event_id`. Anything newer
+# comes in over the event stream, so this only needs refreshing when there's a
+# new event.
+events_cache = {'last_event_id': None, 'events': []}
+creator_name_cache = {'expires': 0, 'name': None}
+
 def get_events():
 	events = server.db.metadata.tables['events']
-	recent_events = []
-	query = sqlalchemy.select([events.c.id, events.c.event, events.c.data, events.c.time, sqlalchemy.func.current_timestamp() - events.c.time]) \
-		.where(events.c.time > sqlalchemy.func.current_timestamp() - datetime.timedelta(days=2)) \
-		.where(events.c.event.in_({'twitch-subscription', 'twitch-resubscription', 'twitch-message', 'twitch-cheer', 'patreon-pledge'})) \
-		.order_by(events.c.time.desc())
 	with server.db.engine.begin() as conn:
-		for id, event, data, time, duration in conn.execute(query):
-			data['time'] = time
-			recent_events.append({
-				'id': id,
-				'event': event,
-				'data': data,
-				'duration': common.time.nice_duration(duration, 2)
-			})
-		last_event_id = conn.execute(sqlalchemy.select([sqlalchemy.func.max(events.c.id)])).first()
-		last_event_id = last_event_id[0] if last_event_id is not None else 0
+		last_event_id, = conn.execute(sqlalchemy.select([sqlalchemy.func.max(events.c.id)])).first()
+		last_event_id = last_event_id if last_event_id is not None else 0
+		if events_cache['last_event_id'] != last_event_id:
+			query = sqlalchemy.select([events.c.id, events.c.event, events.c.data, events.c.time]) \
+				.where(events.c.id <= last_event_id) \
+				.where(events.c.time > sqlalchemy.func.current_timestamp() - RECENT_EVENTS_AGE) \
+				.where(events.c.event.in_(NOTIFICATION_EVENTS)) \
+				.order_by(events.c.time.desc())
+			recent_events = []
+			for id, event, data, time in conn.execute(query):
+				data['time'] = time
+				recent_events.append({
+					'id': id,
+					'event': event,
+					'data': data,
+				})
+			events_cache['last_event_id'], events_cache['events'] = last_event_id, recent_events
+
+	now = datetime.datetime.now(tz=pytz.utc)
+	recent_events = [
+		dict(event, duration=common.time.nice_duration(now - event['data']['time'], 2))
+		for event in events_cache['events']
+		if now - event['data']['time'] < RECENT_EVENTS_AGE
+	]
 	return last_event_id, recent_events
 
+def get_creator_name():
+	if creator_name_cache['expires'] < time.time():
+		patreon_users = server.db.metadata.tables['patreon_users']
+		users = server.db.metadata.tables['users']
+		with server.db.engine.begin() as conn:
+			name = conn.execute(sqlalchemy.select([patreon_users.c.full_name])
+				.select_from(users.join(patreon_users))
+				.where(users.c.name == config['channel'])
+			).first()
+		creator_name_cache['name'] = name[0] if name else None
+		creator_name_cache['expires'] = time.time() + CREATOR_NAME_CACHE_TIME
+	return creator_name_cache['name']
+
 @server.app.route('/notifications')
 @login.with_session
 def notifications(session):
 	last_event_id, events = get_events()
 
 	if server.app.debug:
-		eventserver_root = "http://localhost:8080"
+		eventserver_root = "http://localhost:%d" % config["eventserver_port"]
 	else:
 		eventserver_root = ""
 
-	patreon_users = server.db.metadata.tables['patreon_users']
-	users = server.db.metadata.tables['users']
-	with server.db.engine.begin() as conn:
-		name = conn.execute(sqlalchemy.select([patreon_users.c.full_name])
-			.select_from(users.join(patreon_users))
-			.where(users.c.name == config['channel'])
-		).first()
-	if name:
-		name = name[0]
+	name = get_creator_name()
 
 	return flask.render_template('notifications.html', events=events, last_event_id=last_event_id, eventserver_root=eventserver_root, session=session, patreon_creator_name=name)
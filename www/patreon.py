@@ -6,6 +6,7 @@ import pytz
 import flask
 from flaskext.csrf import csrf_exempt
 import hmac
+import logging
 import os
 import sqlalchemy
 from sqlalchemy.dialects.postgresql import insert
@@ -14,9 +15,12 @@ from www import server
 from www import login
 from common.config import config
 from common import patreon
+from common import storm
 from common import utils
 import common.rpc
 
+log = logging.getLogger('www.patreon')
+
 PATREON_BASE_URL = "https://www.patreon.com/"
 
 # Space separated list of scopes.
@@ -211,11 +215,20 @@ async def patreon_webhooks():
 				'twitch': twitch_user,
 			}
 		data["name"] = data['twitch']['name'] if data['twitch'] is not None else data['patreon']['full_name']
-		data["count"] = common.storm.increment(server.db.engine, server.db.metadata, 'patreon-pledge')
-		results = await asyncio.gather(common.rpc.bot.patreon_pledge(data), common.rpc.eventserver.event('patreon-pledge', data, datetime.datetime.now(tz=pytz.utc)), return_exceptions=True)
-		for result in results:
+		try:
+			data["count"] = await common.rpc.bot.increment_storm('patreon-pledge')
+		except utils.PASSTHROUGH_EXCEPTIONS:
+			raise
+		except Exception:
+			# The storm count lives in the bot, but it shouldn't be lost if the bot is down
+			log.exception("Failed to increment the storm count in the bot, writing it directly")
+			data["count"] = storm.increment(server.db.engine, server.db.metadata, 'patreon-pledge')
+		# Once the pledge has been counted, don't fail the webhook: Patreon would
+		# send it again, and it'd be counted and announced twice.
+		results = await asyncio.gather(common.rpc.bot.patreon_pledge(data), common.rpc.events.publish('patreon-pledge', data, datetime.datetime.now(tz=pytz.utc)), return_exceptions=True)
+		for action, result in zip(["announce", "publish"], results):
 			if isinstance(result, BaseException):
-				raise result
+				log.error("Failed to %s a Patreon pledge", action, exc_info=result)
 	elif event == 'pledges:update':
 		with server.db.engine.begin() as conn:
 			query = insert(patreon_users).returning(patreon_users.c.id)
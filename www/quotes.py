@@ -7,9 +7,67 @@ from www import login
 import common.postgres
 
 QUOTES_PER_PAGE = 25
+# Don't count more search results than this. Past this the page count is only a
+# lower bound, but a search for "the" doesn't have to count the whole table.
+MAX_COUNTED = 40 * QUOTES_PER_PAGE
+
+def quote_columns(quotes, games, shows, game_per_show_data):
+	return sqlalchemy.select([
+		quotes.c.id, quotes.c.quote, quotes.c.attrib_name, quotes.c.attrib_date, quotes.c.context,
+		sqlalchemy.func.coalesce(game_per_show_data.c.display_name, games.c.name),
+		shows.c.name,
+	]).select_from(quotes
+		.outerjoin(games, games.c.id == quotes.c.game_id)
+		.outerjoin(shows, shows.c.id == quotes.c.show_id)
+		.outerjoin(game_per_show_data, (game_per_show_data.c.game_id == quotes.c.game_id) & (game_per_show_data.c.show_id == quotes.c.show_id))
+	).where(~quotes.c.deleted)
+
+def get_cursor(name, convert):
+	"""
+	Parse a keyset pagination cursor from the request: a comma-separated list of
+	the sort key values of the last quote on the page before (`after`) or the
+	first quote on the page after (`before`).
+	"""
+	value = flask.request.values.get(name)
+	if not value:
+		return None
+	try:
+		return tuple(f(v) for f, v in zip(convert, value.split(",")))
+	except ValueError:
+		return None
+
+def fetch_page(conn, query, keys, page, after, before):
+	"""
+	Fetch a page of quotes, sorted by `keys` in descending order.
+
+	Moving to the next or previous page uses the cursor of the page we're coming
+	from, so that the database can go straight to it with an index. Jumping to an
+	arbitrary page falls back to OFFSET.
+	"""
+	keys = sqlalchemy.tuple_(*keys)
+	if after is not None:
+		rows = conn.execute(query.where(keys < sqlalchemy.tuple_(*after))
+			.order_by(*[key.desc() for key in keys.clauses]).limit(QUOTES_PER_PAGE)).fetchall()
+	elif before is not None:
+		rows = conn.execute(query.where(keys > sqlalchemy.tuple_(*before))
+			.order_by(*[key.asc() for key in keys.clauses]).limit(QUOTES_PER_PAGE)).fetchall()
+		rows.reverse()
+	else:
+		rows = conn.execute(query.order_by(*[key.desc() for key in keys.clauses])
+			.offset((page - 1) * QUOTES_PER_PAGE).limit(QUOTES_PER_PAGE)).fetchall()
+	return rows
+
+def cursor_args(rows, args, page, pages, cursor):
+	"""Arguments for the links to the previous and next pages."""
+	if not rows:
+		return None, None
+	prev_args = dict(args, page=page - 1, before=cursor(rows[0])) if page > 1 else None
+	next_args = dict(args, page=page + 1, after=cursor(rows[-1])) if page < pages else None
+	return prev_args, next_args
 
 @server.app.route('/quotes/')
 @server.app.route('/quotes/<int:page>')
+@server.cache_response("quotes", key=login.anonymous_page_key)
 @login.with_session
 def quotes(session, page=1):
 	quotes = server.db.metadata.tables["quotes"]
@@ -22,21 +80,15 @@ def quotes(session, page=1):
 
 		page = max(1, min(page, pages))
 
-		quotes = conn.execute(sqlalchemy.select([
-			quotes.c.id, quotes.c.quote, quotes.c.attrib_name, quotes.c.attrib_date, quotes.c.context,
-			sqlalchemy.func.coalesce(game_per_show_data.c.display_name, games.c.name),
-			shows.c.name,
-		]).select_from(quotes
-			.outerjoin(games, games.c.id == quotes.c.game_id)
-			.outerjoin(shows, shows.c.id == quotes.c.show_id)
-			.outerjoin(game_per_show_data, (game_per_show_data.c.game_id == quotes.c.game_id) & (game_per_show_data.c.show_id == quotes.c.show_id))
-		).where(~quotes.c.deleted)
-			.order_by(quotes.c.id.desc()).offset((page-1) * QUOTES_PER_PAGE)
-			.limit(QUOTES_PER_PAGE)).fetchall()
+		rows = fetch_page(conn, quote_columns(quotes, games, shows, game_per_show_data), [quotes.c.id], page,
+			get_cursor("after", [int]), get_cursor("before", [int]))
 
-	return flask.render_template('quotes.html', session=session, quotes=quotes, page=page, pages=pages)
+	prev_args, next_args = cursor_args(rows, {}, page, pages, lambda row: str(row[0]))
+	return flask.render_template('quotes.html', session=session, quotes=rows, page=page, pages=pages,
+		prev_args=prev_args, next_args=next_args)
 
 @server.app.route('/quotes/search')
+@server.cache_response("quotes", key=login.anonymous_page_key)
 @login.with_session
 def quote_search(session):
 	query = flask.request.values["q"]
@@ -46,27 +98,38 @@ def quote_search(session):
 	games = server.db.metadata.tables["games"]
 	shows = server.db.metadata.tables["shows"]
 	game_per_show_data = server.db.metadata.tables["game_per_show_data"]
-	sql = sqlalchemy.select([
-		quotes.c.id, quotes.c.quote, quotes.c.attrib_name, quotes.c.attrib_date, quotes.c.context,
-		sqlalchemy.func.coalesce(game_per_show_data.c.display_name, games.c.name),
-		shows.c.name,
-	]).select_from(quotes
-		.outerjoin(games, games.c.id == quotes.c.game_id)
-		.outerjoin(shows, shows.c.id == quotes.c.show_id)
-		.outerjoin(game_per_show_data, (game_per_show_data.c.game_id == quotes.c.game_id) & (game_per_show_data.c.show_id == quotes.c.show_id))
-	).where(~quotes.c.deleted).order_by(quotes.c.id.desc())
+	sql = quote_columns(quotes, games, shows, game_per_show_data)
 	if mode == 'text':
+		# Same expression as `quotes_ftx_idx`, so that the index gets used
 		fts_column = sqlalchemy.func.to_tsvector('english', quotes.c.quote)
-		sql = sql.where(fts_column.op("@@")(sqlalchemy.func.plainto_tsquery('english', query)))
+		fts_query = sqlalchemy.func.plainto_tsquery('english', query)
+		condition = fts_column.op("@@")(fts_query)
+		# Best matches first, newest first within equally good matches. The rank is
+		# scaled to an integer so that it survives the trip through the URL exactly.
+		rank = sqlalchemy.cast(sqlalchemy.func.ts_rank(fts_column, fts_query) * 1000000, sqlalchemy.Integer)
+		keys = [rank, quotes.c.id]
+		convert = [int, int]
+		sql = sql.column(rank)
+		cursor = lambda row: "%d,%d" % (row[-1], row[0])
 	elif mode == 'name':
-		sql = sql.where(quotes.c.attrib_name.ilike("%" + common.postgres.escape_like(query.lower()) + "%"))
+		condition = quotes.c.attrib_name.ilike("%" + common.postgres.escape_like(query.lower()) + "%")
+		keys = [quotes.c.id]
+		convert = [int]
+		cursor = lambda row: str(row[0])
 	else:
 		return www.utils.error_page("Unrecognised mode")
+	sql = sql.where(condition)
+
 	with server.db.engine.begin() as conn:
-		quotes = conn.execute(sql).fetchall()
-	pages = (len(quotes) - 1) // QUOTES_PER_PAGE + 1
-	page = max(1, min(page, pages))
+		count, = conn.execute(sqlalchemy.select([sqlalchemy.func.count()]).select_from(
+			sqlalchemy.select([quotes.c.id]).where(~quotes.c.deleted).where(condition).limit(MAX_COUNTED + 1).alias()
+		)).first()
+		pages = (min(count, MAX_COUNTED) - 1) // QUOTES_PER_PAGE + 1
+		page = max(1, min(page, pages))
 
-	quotes = quotes[(page - 1) * QUOTES_PER_PAGE : page * QUOTES_PER_PAGE]
+		rows = fetch_page(conn, sql, keys, page, get_cursor("after", convert), get_cursor("before", convert))
 
-	return flask.render_template('quotes.html', session=session, quotes=quotes, page=page, pages=pages, args={'q': query, 'mode': mode})
+	args = {'q': query, 'mode': mode}
+	prev_args, next_args = cursor_args(rows, args, page, pages, cursor)
+	return flask.render_template('quotes.html', session=session, quotes=[row[:7] for row in rows], page=page, pages=pages,
+		args=args, prev_args=prev_args, next_args=next_args, more_results=count > MAX_COUNTED, quotes_counted=MAX_COUNTED)
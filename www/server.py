@@ -1,27 +1,79 @@
 from flask import Flask
+import flask
+import flask.globals
 from flaskext.csrf import csrf
 import flaskext.csrf
 from flask_sqlalchemy import SQLAlchemy
 import sqlalchemy
 import warnings
 import asyncio
+import atexit
 import functools
+import hashlib
+import logging
+import threading
+import time
 
 from common.config import config
 from common import space
 
+log = logging.getLogger('www.server')
+
+# The channel `bump_data_version()` announces new data versions on
+DATA_VERSIONS_CHANNEL = "data_versions"
+# How long to wait before trying to listen for data versions again after failing
+DATA_VERSIONS_RETRY_DELAY = 30
+# How many responses `cache_response` keeps
+RESPONSE_CACHE_SIZE = 1000
+
+class LoopThread:
+	"""
+	Runs an event loop forever in a background thread, so that the connections
+	made on it, like the RPC clients and `common.http`'s session, stay open
+	between requests instead of only being serviced while a view is running.
+	"""
+	def __init__(self, loop):
+		self.loop = loop
+		self.thread = threading.Thread(target=self.run, name="event loop", daemon=True)
+		self.thread.start()
+		# Registered after `common.http`'s cleanup, so it runs before it
+		atexit.register(self.stop)
+
+	def run(self):
+		asyncio.set_event_loop(self.loop)
+		self.loop.run_forever()
+
+	def stop(self):
+		self.loop.call_soon_threadsafe(self.loop.stop)
+		self.thread.join()
+
+	def run_until_complete(self, coro):
+		return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+async def with_request_context(ctx, coro):
+	with ctx:
+		return await coro
+
 class Application(Flask):
 	def __init__(self, *args, **kwargs):
 		self.__wrapped_view_funcs = {}
+		self.loop_thread = None
 		super().__init__(*args, **kwargs)
 
+	def run_coroutine(self, coro):
+		if self.loop_thread is not None:
+			# The view runs on another thread, so it needs its own copy of the request context
+			ctx = flask.globals._request_ctx_stack.top.copy()
+			return self.loop_thread.run_until_complete(with_request_context(ctx, coro))
+		return asyncio.get_event_loop().run_until_complete(coro)
+
 	def add_url_rule(self, rule, endpoint, view_func, **options):
 		# Cache the wrapper functions so Flask doesn't complain.
 		if asyncio.iscoroutinefunction(view_func):
 			if view_func not in self.__wrapped_view_funcs:
 				@functools.wraps(view_func)
 				def inner(*args, **kwargs):
-					return asyncio.get_event_loop().run_until_complete(view_func(*args, **kwargs))
+					return self.run_coroutine(view_func(*args, **kwargs))
 				self.__wrapped_view_funcs[view_func] = inner
 				func = inner
 				if view_func in flaskext.csrf._exempt_views:
@@ -45,5 +97,118 @@ with warnings.catch_warnings():
     db.reflect()
 csrf(app)
 space.monkey_patch_urlize()
+if config['www_loop_thread']:
+	# This has to be the loop everything has been using so far, as the RPC clients
+	# and HTTP session were made on it.
+	app.loop_thread = LoopThread(asyncio.get_event_loop())
+
+class DataVersions:
+	"""
+	The current versions of the groups of tables watched by `bump_data_version()`.
+
+	A version is the ID of the last transaction that changed one of the group's
+	tables, which the trigger announces with a NOTIFY that this listens for.
+	Picking up the notifications only reads what's already arrived on the
+	connection, so checking the versions doesn't need a round trip to the
+	database. Versions are only ever compared for equality, as transactions
+	don't commit in the order of their IDs.
+	"""
+	def __init__(self, engine):
+		self.engine = engine
+		self.conn = None
+		self.versions = {}
+		self.initial_version = None
+		self.retry_after = 0
+
+	def connect(self):
+		raw = self.engine.raw_connection()
+		raw.detach()
+		conn = raw.connection
+		conn.autocommit = True
+		with conn.cursor() as cur:
+			cur.execute("LISTEN " + DATA_VERSIONS_CHANNEL)
+			# Until a group changes, its version is the ID of a transaction that never
+			# changes anything, so nothing cached before this connection is trusted
+			cur.execute("SELECT txid_current()")
+			self.initial_version, = cur.fetchone()
+		self.versions = {}
+		self.conn = conn
+
+	def close(self):
+		if self.conn is not None:
+			try:
+				self.conn.close()
+			except Exception:
+				pass
+		self.conn = None
+		self.versions = {}
+
+	def get(self, groups):
+		"""
+		Get the current versions of `groups`, or `None` if they can't be known
+		right now.
+		"""
+		try:
+			if self.conn is None:
+				if time.time() < self.retry_after:
+					return None
+				self.connect()
+			self.conn.poll()
+		except Exception:
+			log.exception("Lost the connection listening for data versions")
+			self.close()
+			self.retry_after = time.time() + DATA_VERSIONS_RETRY_DELAY
+			return None
+		for notify in self.conn.notifies:
+			name, version = notify.payload.split(" ")
+			self.versions[name] = int(version)
+		del self.conn.notifies[:]
+		return tuple(self.versions.get(group, self.initial_version) for group in groups)
+
+data_versions = DataVersions(db.engine)
+
+# (endpoint, path, query string, key) -> (data versions, body, mimetype, ETag)
+response_cache = {}
+
+def cache_response(*groups, key=None):
+	"""
+	Cache a view's responses until any of the `DataVersions` groups `groups`
+	changes, and answer conditional requests for them with a 304.
+
+	`key`, if given, is a coroutine function returning anything else the
+	response depends on, like the current game. If it returns `None`, the
+	response isn't cached at all.
+
+	Usage:
+	@server.app.route('/path')
+	@server.cache_response("stats")
+	def handler():
+		...
+	"""
+	def decorator(func):
+		@functools.wraps(func)
+		async def wrapper(*args, **kwargs):
+			versions = data_versions.get(groups)
+			extra = await key() if key is not None else ()
+			if versions is None or extra is None:
+				return await asyncio.coroutine(func)(*args, **kwargs)
+
+			cache_key = (flask.request.endpoint, flask.request.path, tuple(sorted(flask.request.args.items(multi=True))), extra)
+			entry = response_cache.get(cache_key)
+			if entry is None or entry[0] != versions:
+				response = app.make_response(await asyncio.coroutine(func)(*args, **kwargs))
+				if response.status_code != 200:
+					return response
+				body = response.get_data()
+				if len(response_cache) >= RESPONSE_CACHE_SIZE:
+					response_cache.clear()
+				entry = response_cache[cache_key] = (versions, body, response.mimetype, hashlib.sha1(body).hexdigest())
+
+			versions, body, mimetype, etag = entry
+			response = flask.Response(body, mimetype=mimetype)
+			response.set_etag(etag)
+			return response.make_conditional(flask.request)
+		return wrapper
+	return decorator
 
-__all__ = ['app', 'db']
+__all__ = ['app', 'db', 'cache_response']
@@ -6,6 +6,7 @@ import common.rpc
 from www import server
 from www import login
 from www import history
+from www import botdata
 import re
 import datetime
 import pytz
@@ -16,7 +17,7 @@ import sqlalchemy
 @login.require_mod
 async def spam(session):
 	link_spam = "link_spam" in flask.request.values
-	data = await common.rpc.bot.get_data('link_spam_rules' if link_spam else 'spam_rules')
+	data = await botdata.get_data('link_spam_rules' if link_spam else 'spam_rules')
 	return flask.render_template("spam.html", rules=data, link_spam=link_spam, session=session)
 
 def verify_rules(rules):
@@ -133,7 +134,7 @@ async def spam_test(session):
 @server.app.route('/spam/find')
 @login.require_mod
 async def spam_find(session):
-	rules = await common.rpc.bot.get_data('spam_rules')
+	rules = await botdata.get_data('spam_rules')
 	for rule in rules:
 		rule['re'] = re.compile(rule['re'])
 
@@ -25,7 +25,7 @@ $(function(){
 	$("#chat").parent().css("overflow-x", "hidden");
 
 	// Allow showing deleted messages
-	$(".deleted").click(function(){
+	$("#chat").on("click", ".deleted", function(){
 		$(this).hide().next(".message").show();
 	});
 
@@ -34,11 +34,10 @@ $(function(){
 	$("#resetscroll").click(startScrolling);
 	window.scrollenable = true;
 
-	// Prepare timestamp lookup table
+	// Timestamp lookup table, filled in as chunks of chat are loaded
 	window.chatlines = [];
-	$(".line").each(function(){
-		window.chatlines.push({ts: Number($(this).data("timestamp")), obj: $(this)});
-	});
+	window.chunks = {};
+	loadChunksAround(window.initial_time || 0);
 
 	// Create poll to scroll the chat to the right place
 	window.lasttime = -1;
@@ -61,9 +60,54 @@ function doScroll() {
 		return;
 	window.lasttime = time;
 
+	loadChunksAround(time);
 	scrollChatTo(time + window.start);
 }
 
+function loadChunksAround(time) {
+	// Load the chat for the current chunk, and the ones either side of it so
+	// there's something to scroll through
+	var current = Math.floor(time / window.chunk_length);
+	for (var chunk = current - 1; chunk <= current + 1; chunk++) {
+		if (chunk >= window.first_chunk && chunk <= window.last_chunk && !window.chunks[chunk])
+			loadChunk(chunk);
+	}
+}
+
+function loadChunk(chunk) {
+	// Put a placeholder in the right place now, so chunks stay in order however
+	// the requests finish
+	var container = $("<div class=\"chunk\">").data("chunk", chunk);
+	var next = $("#chat > .chunk").filter(function(){
+		return $(this).data("chunk") > chunk;
+	}).first();
+	container.insertBefore(next.length ? next : $("#chatbottom"));
+	window.chunks[chunk] = container;
+
+	var request;
+	if (window.transcript_url) {
+		// Chunks with no chat in them aren't in the transcript
+		if (window.transcript_chunks.indexOf(chunk) < 0)
+			return;
+		request = $.getJSON(window.transcript_url + "/" + chunk + ".json");
+	} else {
+		request = $.getJSON(window.chat_url, {chunk: chunk});
+	}
+	request.done(function(data){
+		container.html(data.chat.join(""));
+		// Rebuild the lookup table from the lines, which are in order on the page
+		window.chatlines = [];
+		$(".line").each(function(){
+			window.chatlines.push({ts: Number($(this).data("timestamp")), obj: $(this)});
+		});
+		window.lasttime = -1;
+	}).fail(function(){
+		// Try again next time around
+		container.remove();
+		delete window.chunks[chunk];
+	});
+}
+
 function scrollChatTo(time) {
 	// Binary search to find the first line that is after the current time
 	var min = 0;
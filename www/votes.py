@@ -8,8 +8,8 @@ import common.rpc
 @server.app.route('/votes')
 @login.require_login
 async def votes(session):
-	current_game_id = await common.rpc.bot.get_game_id()
-	current_show_id = await common.rpc.bot.get_show_id()
+	context = await common.rpc.bot.get_current_context()
+	current_game_id, current_show_id = context['game_id'], context['show_id']
 
 	game_votes = server.db.metadata.tables["game_votes"]
 	game_stats = server.db.metadata.tables["game_stats"]